@@ -0,0 +1,307 @@
+"""
+Headless scaling benchmark for Vivarium.animationUpdate.
+A synthetic scene generator fills an empty vivarium with N predators and M prey, each built like a Linkage: a body
+with a number of arms, every arm a chain of joints of configurable depth that swing back and forth. For every scene
+size the benchmark reports ticks per second, the time per tick spent in each phase of animationUpdate, the peak
+traced memory, and the memory and blocks allocated per tick, and it can write all of it as JSON to track regressions.
+
+With --workers, it measures ShardedVivarium instead: steps per second of a tank of N creatures against the number of
+worker processes, next to the single process Interaction.stepForward, to show how the sharded engine scales with
+cores.
+
+usage: python Benchmark.py [--sizes 10,100,1000] [--depth 4] [--arms 4] [--json results.json]
+       python Benchmark.py --workers 1,2,4,8 [--sizes 100000] [--steps 10] [--json results.json]
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import Interaction
+import ShardedVivarium
+from Component import Component
+from EnvironmentObject import EnvironmentObject
+from Point import Point
+from SpatialHash import SpatialHash
+from Vivarium import Vivarium
+
+FORMAT_VERSION = 1
+
+# radii of the default Linkage and Linkage2, for a tank with 8 creatures
+PREDATOR_RADIUS = 0.5
+PREY_RADIUS = 0.2
+DEFAULT_POPULATION = 8
+
+
+class SyntheticCreature(EnvironmentObject, Component):
+    """
+    A creature shaped like Linkage, without any meshes: arms of chained joints swinging around their u axis
+    """
+    joints = None  # list<Component>
+    rotation_speed = None  # list<float>: degrees per step of every joint
+
+    def __init__(self, position, species_id, radius, depth=4, arms=4):
+        super(SyntheticCreature, self).__init__(position)
+        self.joints = []
+        for a in range(arms):
+            arm = Component(Point((0, 0, 0)))
+            arm.setDefaultAngle(360 / arms * a, arm.vAxis)
+            self.addChild(arm)
+            parent = arm
+            for d in range(depth):
+                joint = Component(Point((0, 0, 0.5 if d else 0)))
+                joint.setRotateExtent(joint.uAxis, 0, 32)
+                parent.addChild(joint)
+                self.joints.append(joint)
+                parent = joint
+        self.rotation_speed = [0.5] * len(self.joints)
+        self.bound_center = Point((0, 0, 0))
+        self.bound_radius = radius
+        self.species_id = species_id
+
+    def animationUpdate(self):
+        for i, joint in enumerate(self.joints):
+            joint.rotate(self.rotation_speed[i], joint.uAxis)
+            if joint.uAngle in joint.uRange:
+                self.rotation_speed[i] *= -1
+
+
+def buildScene(predators, prey, depth=4, arms=4, seed=0):
+    """
+    A headless vivarium holding only synthetic creatures, all of them already moving in a random direction.
+    Bounding radii shrink with the population so that the number of interacting neighbors per creature stays
+    that of the default scene.
+
+    :param predators: number of predators
+    :type predators: int
+    :param prey: number of prey
+    :type prey: int
+    :param depth: joints in every arm
+    :type depth: int
+    :param arms: arms of every creature
+    :type arms: int
+    :param seed: seed for positions, headings and the vivarium's random generator
+    :type seed: int
+    :rtype: Vivarium
+    """
+    vivarium = Vivarium(seed=seed, populate=False)
+    rng = np.random.default_rng(seed)
+    n = predators + prey
+    shrink = min(1.0, (DEFAULT_POPULATION / max(n, 1)) ** (1 / 3))
+    half = max(vivarium.tank_dimensions) / 2
+    # uniform inside a sphere well within the tank wall
+    directions = rng.normal(size=(n, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    positions = directions * (rng.random((n, 1)) ** (1 / 3)) * half * 0.8
+    headings = rng.normal(size=(n, 3))
+    headings /= np.linalg.norm(headings, axis=1, keepdims=True)
+    for k in range(n):
+        if k < predators:
+            creature = SyntheticCreature(Point(positions[k]), Interaction.PREDATOR_SPECIES, PREDATOR_RADIUS * shrink,
+                                         depth, arms)
+        else:
+            creature = SyntheticCreature(Point(positions[k]), Interaction.PREY_SPECIES, PREY_RADIUS * shrink,
+                                         depth, arms)
+        creature.translation_speed = Point(headings[k] * Interaction.SPEED)
+        vivarium.addNewObjInTank(creature)
+    return vivarium
+
+
+def countNodes(component):
+    return 1 + sum(countNodes(c) for c in component.children)
+
+
+def measureSpeed(vivarium, minTicks=3, minSeconds=1.0):
+    """
+    Run ticks until both minTicks and minSeconds are reached
+
+    :return: ticks run, ticks per second and milliseconds per tick of every phase
+    :rtype: dict
+    """
+    vivarium.phaseTimes = {}
+    ticks = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while ticks < minTicks or elapsed < minSeconds:
+        vivarium.animationUpdate()
+        ticks += 1
+        elapsed = time.perf_counter() - start
+    phases = {name: seconds / ticks * 1000 for name, seconds in vivarium.phaseTimes.items()}
+    vivarium.phaseTimes = None
+    return {"ticks": ticks, "ticks_per_s": ticks / elapsed, "ms_per_tick": elapsed / ticks * 1000,
+            "phase_ms_per_tick": phases}
+
+
+def measureMemory(vivarium, ticks=3):
+    """
+    Trace Python allocations over a few ticks. Tracing slows everything down, so this runs apart from the speed
+    measurement.
+
+    :return: peak traced bytes while ticking; bytes still held by what the ticks allocated; the peak of bytes
+        allocated during a tick on top of what was held before it; the blocks allocated during a tick that are still
+        alive at its end, counted per allocation site so that one site freeing blocks does not hide another
+        allocating them, though temporaries freed within the tick are not seen; and the net change in allocated
+        memory blocks per tick
+    :rtype: dict
+    """
+    tracemalloc.start()
+    try:
+        # the scene was built before tracing started, so only what ticking allocates is seen
+        transient = []
+        newBlocks = []
+        blocks = sys.getallocatedblocks()
+        for _ in range(ticks):
+            snapshot = tracemalloc.take_snapshot()
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            vivarium.animationUpdate()
+            transient.append(tracemalloc.get_traced_memory()[1] - before)
+            stats = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+            newBlocks.append(sum(stat.count_diff for stat in stats if stat.count_diff > 0))
+        netBlocks = (sys.getallocatedblocks() - blocks) / ticks
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_traced_bytes": peak, "retained_bytes": current,
+            "transient_peak_bytes_per_tick": float(np.mean(transient)),
+            "new_blocks_per_tick": float(np.mean(newBlocks)), "net_block_change_per_tick": netBlocks}
+
+
+def benchmark(sizes, depth=4, arms=4, preyPerPredator=3, seed=0, minTicks=3, minSeconds=1.0, memoryTicks=3):
+    """
+    Measure one scene per size, yielding each result as soon as it is measured
+
+    :param sizes: total number of creatures of every scene
+    :type sizes: list
+    :return: one result per scene size
+    :rtype: generator
+    """
+    for n in sizes:
+        predators = max(1, round(n / (preyPerPredator + 1)))
+        prey = max(0, n - predators)
+        t1 = time.perf_counter()
+        vivarium = buildScene(predators, prey, depth, arms, seed)
+        buildTime = time.perf_counter() - t1
+        result = {"creatures": n, "predators": predators, "prey": prey, "depth": depth, "arms": arms,
+                  "nodes": countNodes(vivarium), "build_s": buildTime}
+        result.update(measureSpeed(vivarium, minTicks, minSeconds))
+        if memoryTicks:
+            result.update(measureMemory(vivarium, memoryTicks))
+        result["alive"] = vivarium.store.count
+        yield result
+
+
+def measureScaling(n, workerCounts, steps=10, seed=0, tank_dimensions=(12, 12, 12)):
+    """
+    Steps per second of ShardedVivarium over a tank of n creatures for every number of worker processes, and of the
+    single process Interaction.stepForward over the same creatures as the baseline
+
+    :param n: number of creatures
+    :type n: int
+    :param workerCounts: numbers of worker processes to measure
+    :type workerCounts: list
+    :param steps: steps timed for every run
+    :type steps: int
+    :return: one result per run, the single process one first with 0 workers
+    :rtype: generator
+    """
+    store = ShardedVivarium.populate(n, tank_dimensions, seed)
+    reach = Interaction.maxInteractionDistance(store)
+
+    single = ShardedVivarium.populate(n, tank_dimensions, seed)
+    grid = SpatialHash(tank_dimensions, reach)
+    rng = np.random.default_rng(seed)
+    t1 = time.perf_counter()
+    for _ in range(steps):
+        turned, eaten = Interaction.stepForward(single, tank_dimensions, rng, grid)
+        keep = np.ones(single.count, dtype=bool)
+        keep[eaten] = False
+        single.keepRows(keep)
+    baseline = time.perf_counter() - t1
+    yield {"creatures": n, "workers": 0, "steps": steps, "steps_per_s": steps / baseline, "speedup": 1.0,
+           "efficiency": 1.0, "alive": single.count}
+
+    for workers in workerCounts:
+        with ShardedVivarium.ShardedVivarium(workers, tank_dimensions, reach, seed=seed) as sharded:
+            sharded.load(store)
+            t1 = time.perf_counter()
+            sharded.run(steps)
+            elapsed = time.perf_counter() - t1
+            alive = len(sharded.gather()[1])
+        yield {"creatures": n, "workers": workers, "steps": steps, "steps_per_s": steps / elapsed,
+               "speedup": baseline / elapsed, "efficiency": baseline / elapsed / workers, "alive": alive}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless scaling benchmark of Vivarium.animationUpdate")
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="comma separated creature counts, large scenes such as 100000 are best run with a "
+                             "small --depth (default: %(default)s)")
+    parser.add_argument("--depth", type=int, default=4, help="joints per arm (default: %(default)s)")
+    parser.add_argument("--arms", type=int, default=4, help="arms per creature (default: %(default)s)")
+    parser.add_argument("--prey-per-predator", type=float, default=3, help="(default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-ticks", type=int, default=3, help="fewest ticks per scene (default: %(default)s)")
+    parser.add_argument("--min-seconds", type=float, default=1.0,
+                        help="shortest timed run per scene (default: %(default)s)")
+    parser.add_argument("--memory-ticks", type=int, default=3,
+                        help="ticks traced for memory, 0 to skip (default: %(default)s)")
+    parser.add_argument("--workers",
+                        help="comma separated worker process counts: measure ShardedVivarium against them instead")
+    parser.add_argument("--steps", type=int, default=10,
+                        help="steps timed per worker count with --workers (default: %(default)s)")
+    parser.add_argument("--json", help="write the results to this file, - for stdout")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    log = sys.stderr if args.json == "-" else sys.stdout
+    results = []
+    if args.workers:
+        workerCounts = [int(w) for w in args.workers.split(",") if w]
+        print(f"{multiprocessing.cpu_count()} CPUs", file=log)
+        for n in sizes:
+            for result in measureScaling(n, workerCounts, args.steps, args.seed):
+                results.append(result)
+                name = f"{result['workers']} workers" if result["workers"] else "single process"
+                print(f"N={n}, {name}: {result['steps_per_s']:.2f} steps/s, speedup {result['speedup']:.2f}x, "
+                      f"efficiency {result['efficiency']:.0%}, {result['alive']} alive", file=log)
+    else:
+        for result in benchmark(sizes, args.depth, args.arms, args.prey_per_predator, args.seed, args.min_ticks,
+                                args.min_seconds, args.memory_ticks):
+            results.append(result)
+            phases = ", ".join(f"{name} {ms:.2f}" for name, ms in result["phase_ms_per_tick"].items())
+            memory = ""
+            if "peak_traced_bytes" in result:
+                memory = f", peak {result['peak_traced_bytes'] / 1e6:.1f}MB, " \
+                         f"{result['transient_peak_bytes_per_tick'] / 1e3:.1f}kB and " \
+                         f"{result['new_blocks_per_tick']:.0f} new blocks/tick"
+            print(f"N={result['creatures']} ({result['nodes']} nodes): {result['ticks_per_s']:.2f} ticks/s "
+                  f"[ms/tick: {phases}]{memory}", file=log)
+
+    if args.json:
+        report = {
+            "format_version": FORMAT_VERSION,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": multiprocessing.cpu_count(),
+            "config": vars(args),
+            "results": results,
+        }
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
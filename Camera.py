@@ -0,0 +1,160 @@
+"""
+Orbit camera with cached view and projection matrices, shared with every shader program through a uniform buffer.
+The camera circles lookAtPt at distance cameraDis, at angle cameraTheta around the vertical axis and cameraPhi
+above the horizontal plane. The view and projection matrices are only rebuilt when a parameter they depend on
+changed, and only then uploaded to the std140 uniform block that all GLProgram variants read them from, so a frame
+with a still camera costs no matrix math and no upload.
+"""
+
+import math
+
+import numpy as np
+
+import GLUtility
+from GLProgram import CAMERA_BLOCK_BINDING
+
+try:
+    import OpenGL
+
+    try:
+        import OpenGL.GL as gl
+        import OpenGL.GLU as glu
+    except ImportError:
+        from ctypes import util
+
+        orig_util_find_library = util.find_library
+
+
+        def new_util_find_library(name):
+            res = orig_util_find_library(name)
+            if res:
+                return res
+            return '/System/Library/Frameworks/' + name + '.framework/' + name
+
+
+        util.find_library = new_util_find_library
+        import OpenGL.GL as gl
+        import OpenGL.GLU as glu
+except ImportError:
+    raise ImportError("Required dependency PyOpenGL not present")
+
+
+class Camera:
+    """
+    Orbit camera. Matrices are column-major, laid out as GLUtility returns them.
+    """
+    lookAtPt = None  # list<float>(3): point the camera looks at
+    upVector = None  # list<float>(3)
+    cameraDis = None  # float: distance from lookAtPt
+    cameraTheta = None  # float: theta on horizontal sphere cut, in range [0, 2pi]
+    cameraPhi = None  # float: in range [-pi/2, pi/2]
+
+    fov = 45  # float: vertical field of view, in degrees
+    width = 1  # int: viewport width, in pixels
+    height = 1  # int: viewport height, in pixels
+    znear = 0.01
+    zfar = 100
+
+    glutility = None
+    version = 0  # int: bumped whenever the view or projection matrix changes
+    _viewKey = None  # tuple: parameters the cached view matrix was built from
+    _viewMat = None
+    _projectionKey = None  # tuple: parameters the cached projection matrix was built from
+    _perspMat = None
+    _frustumVersion = None  # int: version the cached frustum planes were built at
+    _frustumPlanes = None
+
+    ubo = None  # int: uniform buffer holding the projection and view matrices, created on first upload
+    uploadedVersion = None  # int: version last uploaded to ubo
+
+    def __init__(self, lookAtPt=(0, 0, 0), upVector=(0, 1, 0), cameraDis=12, cameraTheta=math.pi / 2,
+                 cameraPhi=math.pi / 6):
+        self.glutility = GLUtility.GLUtility()
+        self.lookAtPt = list(lookAtPt)
+        self.upVector = list(upVector)
+        self.cameraDis = cameraDis
+        self.cameraTheta = cameraTheta
+        self.cameraPhi = cameraPhi
+
+    def setViewport(self, width, height):
+        self.width = width
+        self.height = max(1, height)
+
+    def position(self):
+        """
+        :return: camera position in world space
+        :rtype: list
+        """
+        ct = math.cos(self.cameraTheta)
+        st = math.sin(self.cameraTheta)
+        cp = math.cos(self.cameraPhi)
+        sp = math.sin(self.cameraPhi)
+        return [self.lookAtPt[0] + self.cameraDis * ct * cp,
+                self.lookAtPt[1] + self.cameraDis * sp,
+                self.lookAtPt[2] + self.cameraDis * st * cp]
+
+    @property
+    def viewMat(self):
+        # compared by value, so changing lookAtPt in place is noticed as well
+        key = (self.cameraDis, self.cameraTheta, self.cameraPhi, tuple(self.lookAtPt), tuple(self.upVector))
+        if key != self._viewKey:
+            self._viewMat = self.glutility.view(self.position(), self.lookAtPt, self.upVector)
+            self._viewKey = key
+            self.version += 1
+        return self._viewMat
+
+    @property
+    def perspMat(self):
+        key = (self.fov, self.width, self.height, self.znear, self.zfar)
+        if key != self._projectionKey:
+            self._perspMat = self.glutility.perspective(self.fov, self.width, self.height, self.znear, self.zfar)
+            self._projectionKey = key
+            self.version += 1
+        return self._perspMat
+
+    def frustumPlanes(self):
+        """
+        Planes bounding what the camera sees, in world space: left, right, bottom, top, near and far. A point p is
+        inside the view when a * p.x + b * p.y + c * p.z + d >= 0 for every plane (a, b, c, d). Normals are unit
+        length, so the left hand side is the signed distance to the plane.
+
+        :return: the six planes as rows of an array
+        :rtype: numpy.ndarray
+        """
+        perspMat = self.perspMat
+        viewMat = self.viewMat
+        if self._frustumVersion != self.version:
+            # the matrices are column-major, their transposes map world space to clip space
+            viewProjection = perspMat.T @ viewMat.T
+            rows = viewProjection[:3]
+            w = viewProjection[3]
+            planes = np.concatenate([w + rows, w - rows])[[0, 3, 1, 4, 2, 5]]
+            planes /= np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+            self._frustumPlanes = planes
+            self._frustumVersion = self.version
+        return self._frustumPlanes
+
+    def releaseBuffer(self):
+        """ forget the uniform buffer, for use after the GL context it belonged to is gone """
+        self.ubo = None
+        self.uploadedVersion = None
+
+    def upload(self):
+        """
+        Bring the camera uniform block up to date, if the camera changed since the last upload.
+        The block holds the projection matrix followed by the view matrix, with std140 layout.
+        """
+        data = (self.perspMat, self.viewMat)
+        if self.ubo is None:
+            self.ubo = gl.glGenBuffers(1)
+            gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.ubo)
+            gl.glBufferData(gl.GL_UNIFORM_BUFFER, 128, None, gl.GL_DYNAMIC_DRAW)
+            gl.glBindBufferBase(gl.GL_UNIFORM_BUFFER, CAMERA_BLOCK_BINDING, self.ubo)
+        if self.uploadedVersion == self.version:
+            return
+        # a column-major matrix in C order is what std140 expects for a mat4
+        block = np.concatenate([np.ascontiguousarray(mat, dtype=np.float32).ravel() for mat in data])
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.ubo)
+        gl.glBufferSubData(gl.GL_UNIFORM_BUFFER, 0, block.nbytes, block)
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, 0)
+        self.uploadedVersion = self.version
@@ -10,6 +10,7 @@ Modified by Daniel Scrivener 07/2022
 import copy
 import math
 import os
+import weakref
 from typing import Tuple, Type
 
 import numpy as np
@@ -54,6 +55,10 @@ class Component:
 
     # the homogeneous transformation matrix for the current joint
     transformationMat = None
+    # float32 copy of transformationMat in the column-major layout OpenGL takes (its transpose, C-contiguous), kept up
+    # to date by update() so that draw() uploads it without any conversion
+    drawMat = None
+    drawScale = None  # list<float>(3): scaling of this component's mesh only, in drawMat but not passed to children
 
     # a instance of class which inherit from Displayable
     # if this class is used as skeleton, then keep this empty
@@ -84,13 +89,43 @@ class Component:
     preRotationMat = None
     postRotationMat = None
 
-    texture = None
+    texture = None  # Texture, created by setTexture
     textureOn = False
 
     glUtility = None
 
     quat = None
 
+    instanced = False  # drawn by an InstancedRenderer together with the other copies of its mesh, not by draw()
+    culled = False  # outside the view this frame, nothing in this subtree is drawn. Set by FrustumCuller
+
+    # Transforms are recomputed lazily. Anything that changes this component's local transform calls markDirty(),
+    # which flags the component and every ancestor, and update() then only walks down flagged paths.
+    # A component compiled in a SceneCompiler has the setters below write the value they change into its scene row
+    # instead, and keeps no flags of its own.
+    # Code that changes the transform attributes directly, not through the methods below, must call markDirty().
+    parentComponent = None  # Component this one is a child of
+    localMat = None  # numpy.ndarray(4, 4): cached local transform relative to parentComponent
+    parentMat = None  # numpy.ndarray(4, 4): parent transform transformationMat was last computed with
+    localDirty = True  # localMat is out of date
+    worldDirty = True  # transformationMat of this component or of one of its descendants is out of date
+    scene = None  # SceneCompiler computing the transforms of this component, None to compute them here
+    sceneRow = None  # int: row of this component in scene
+    # cached pieces of localTransform
+    fixedBefore = None  # numpy.ndarray(4, 4): postRotationMat @ outRotation, None when it is the identity
+    fixedAfter = None  # numpy.ndarray(4, 4): inRotation @ preRotationMat, None when it is the identity
+    fixedSources = None  # tuple: the four matrices fixedBefore and fixedAfter were computed from, compared by identity,
+    # so setPreRotation/setPostRotation should be given a new matrix rather than one changed in place
+    localBuffers = None  # tuple<numpy.ndarray>: rotation, local transform and scratch buffers of localTransform
+    axesVersion = 0  # int: bumped whenever uAxis, vAxis or wAxis change
+    structureVersion = 0  # int, shared by all components: bumped whenever children are added or removed
+    # (parent, child, added) of the structure changes some StructureCursor has not read yet, None for a change that
+    # did not say what it was. Entry i is the change that brought structureVersion to structureLogStart + i + 1
+    structureLog = []
+    structureLogStart = 0  # int: structureVersion before the first entry of structureLog
+    structureCursors = weakref.WeakSet()  # StructureCursor: every live reader of structureLog
+    STRUCTURE_LOG_LIMIT = 4096  # int: changes a cursor may fall behind by before they are forgotten
+
     def __init__(self, position, display_obj=None):
         """
         Init Component
@@ -135,7 +170,8 @@ class Component:
         self.postRotationMat = np.identity(4)
         self.inRotation = np.identity(4)
         self.outRotation = np.identity(4)
-        self.texture = Texture()
+        self.localDirty = True
+        self.worldDirty = True
 
     def addChild(self, child):
         """
@@ -151,6 +187,126 @@ class Component:
         # prevent the duplicate child to be added to the self.children
         if child not in self.children:
             self.children.append(child)
+            self.adopt(child)
+
+    def adopt(self, child):
+        """
+        Make this component the parent of child for transform updates. addChild does this already, call it
+        directly only for children added to self.children by other means.
+
+        :type child: Component
+        :return: None
+        """
+        child.parentComponent = self
+        child.markDirty()
+        self.markWorldDirty()
+        Component.structureChanged(self, child, True)
+
+    def ancestorsUpTo(self, root):
+        """
+        :param root: component to stop at
+        :type root: Component
+        :return: this component, its parent, and so on up to and including root. None if root is not among them.
+        :rtype: list
+        """
+        ancestors = []
+        node = self
+        while node is not None:
+            ancestors.append(node)
+            if node is root:
+                return ancestors
+            node = node.parentComponent
+        return None
+
+    @staticmethod
+    def structureChanged(parent=None, child=None, added=True):
+        """
+        Record that children were added to or removed from some component. Code that changes a children list
+        directly must call this, naming the parent and the child when a single child was added or removed: users
+        of the tree can then follow the change, where any other change makes them walk the whole tree again.
+
+        :param parent: component whose children changed
+        :type parent: Component
+        :param child: the child that was added or removed, with its whole subtree
+        :type child: Component
+        :param added: whether child was added or removed
+        :type added: bool
+        """
+        Component.structureVersion += 1
+        if not any(cursor.version is not None for cursor in Component.structureCursors):
+            # no cursor will read the change, so it is not kept
+            Component.structureLog.clear()
+            Component.structureLogStart = Component.structureVersion
+            return
+        log = Component.structureLog
+        log.append(None if parent is None or child is None else (parent, child, added))
+        if len(log) > Component.STRUCTURE_LOG_LIMIT:
+            drop = len(log) // 2
+            del log[:drop]
+            Component.structureLogStart += drop
+
+    @staticmethod
+    def trimStructureLog():
+        """
+        Forget the structure changes every live cursor has read, so the components they name can be freed
+        """
+        versions = [cursor.version for cursor in Component.structureCursors if cursor.version is not None]
+        oldest = min(versions, default=Component.structureVersion)
+        drop = oldest - Component.structureLogStart
+        if drop > 0:
+            del Component.structureLog[:drop]
+            Component.structureLogStart = oldest
+
+    @staticmethod
+    def structureChangesSince(version):
+        """
+        :param version: structureVersion the caller last brought itself up to date with
+        :type version: int
+        :return: (parent, child, added) of every structure change since version, oldest first. None if one of them
+            is unknown, or no longer remembered, in which case the caller should walk the whole tree again.
+        :rtype: list
+        """
+        if version is None or version < Component.structureLogStart:
+            return None
+        changes = Component.structureLog[version - Component.structureLogStart:]
+        if None in changes:
+            return None
+        return changes
+
+    def markDirty(self):
+        """
+        Flag this component's local transform as changed, so the next update() recomputes it and its subtree.
+        A compiled component has all of its parameters read again by its scene.
+        """
+        if self.scene is not None:
+            self.scene.markStale(self.sceneRow)
+            return
+        self.localDirty = True
+        self.markWorldDirty()
+
+    def translationChanged(self):
+        """
+        Flag a change of currentPos alone. A compiled component copies it into its scene row, without having its
+        other parameters read again.
+        """
+        if self.scene is not None:
+            self.scene.write(self.sceneRow, "translations", self.currentPos.coords)
+        else:
+            self.markDirty()
+
+    def markWorldDirty(self):
+        """
+        Flag this component and its ancestors as holding an out of date transform below them
+        """
+        node = self
+        while node is not None:
+            if node.scene is not None:
+                # a compiled subtree keeps its flags in its scene, only its root is flagged
+                node = node.scene.root
+            if node.worldDirty:
+                return
+            node.worldDirty = True
+            node = node.parentComponent
 
     def clear(self):
         """
@@ -160,6 +316,7 @@ class Component:
             c.clear()
             self.children.remove(c)
             del c
+        Component.structureChanged()
 
     def initialize(self):
         """
@@ -178,16 +335,18 @@ class Component:
         self.update()
 
     def draw(self, shaderProg):
-        shaderProg.setMat4("modelMat", self.transformationMat.transpose())
-        shaderProg.setVec3("currentColor", self.current_color)
-        if isinstance(self.displayObj, Displayable):
-            if self.textureOn:
-                shaderProg.use()
-                self.texture.bind(shaderProg.getUniformLocation("textureImage"))
-            else:
-                shaderProg.use()
-                self.texture.unbind(shaderProg.getUniformLocation("textureImage"))
-            self.displayObj.draw()
+        if self.culled:
+            return
+        if not self.instanced:
+            shaderProg.setMat4("modelMat", self.drawMat)
+            shaderProg.setVec3("currentColor", self.current_color)
+            if isinstance(self.displayObj, Displayable):
+                # both are no-ops while the same texture state is still in place
+                if self.textureOn:
+                    self.texture.bind(shaderProg)
+                else:
+                    Texture.unbind(shaderProg)
+                self.displayObj.draw()
 
         for c in self.children:
             c.draw(shaderProg)
@@ -196,34 +355,167 @@ class Component:
         """
         Apply translation, rotation and scaling to this component and all its children
         all matrix are stored in column-major order
-        Must be called after any changes made to the instance
+        Only components flagged by markDirty, and everything below them, are recomputed
 
+        :param parentTransformationMat: transform of the parent, defaults to the parent component's current one
+        :type parentTransformationMat: numpy.ndarray
         :return: None
         """
         if parentTransformationMat is None:
-            parentTransformationMat = np.identity(4)
+            if self.parentComponent is not None and self.parentComponent.transformationMat is not None:
+                parentTransformationMat = self.parentComponent.transformationMat
+            else:
+                parentTransformationMat = np.identity(4)
+        if self.scene is not None:
+            # transforms of a compiled subtree are computed for the whole subtree at once
+            if self.scene.root is self:
+                self.scene.update(parentTransformationMat)
+            else:
+                self.scene.update()
+            return
+        parentChanged = self.parentMat is None or not np.array_equal(parentTransformationMat, self.parentMat)
+        if parentChanged:
+            parentTransformationMat = np.array(parentTransformationMat, dtype=np.float64)
+        self.propagate(parentTransformationMat, parentChanged)
+
+    def propagate(self, parentTransformationMat, parentChanged):
+        """
+        Bring the transforms of this subtree up to date
+
+        :param parentTransformationMat: current transform of the parent
+        :type parentTransformationMat: numpy.ndarray
+        :param parentChanged: whether the parent transform changed since this component last used it
+        :type parentChanged: bool
+        :return: None
+        """
+        if self.scene is not None:
+            self.scene.update(parentTransformationMat, parentChanged)
+            return
+        if not (parentChanged or self.worldDirty):
+            return
+        changed = parentChanged or self.localDirty
+        if self.localDirty:
+            self.localMat = self.localTransform()
+            self.localDirty = False
+        if changed:
+            self.parentMat = parentTransformationMat
+            self.transformationMat = parentTransformationMat @ self.localMat
+            if self.drawMat is None:
+                self.drawMat = np.empty((4, 4), dtype=np.float32)
+            np.copyto(self.drawMat, self.transformationMat.T)
+            if self.drawScale is not None:
+                # rows of drawMat are the columns of transformationMat
+                self.drawMat[:3] *= np.array(self.drawScale, dtype=np.float32)[:, None]
+        self.worldDirty = False
+
+        for c in self.children:
+            c.propagate(self.transformationMat, changed)
 
-        translationMat = self.glUtility.translate(*self.currentPos.getCoords(), False)
+    @staticmethod
+    def axisQuaternion(angle, axis):
+        """
+        Unit quaternion of a rotation around axis, normalized the same way as GLUtility.rotate
+
+        :param angle: rotation degree, in degs
+        :type angle: float
+        :param axis: rotation axis
+        :type axis: Point
+        :return: (s, a, b, c)
+        :rtype: tuple
+        """
+        half = float(angle) * math.pi / 360
+        sinHalf = math.sin(half)
+        x, y, z = axis.coords.tolist()
+        s, a, b, c = math.cos(half), sinHalf * x, sinHalf * y, sinHalf * z
+        norm = math.sqrt(s * s + a * a + b * b + c * c)
+        if norm < 1e-6:
+            return 1.0, 0.0, 0.0, 0.0
+        return s / norm, a / norm, b / norm, c / norm
 
+    @staticmethod
+    def quaternionProduct(q1, q2):
+        """ Hamilton product of two (s, a, b, c) tuples, the rotation q2 followed by q1 """
+        s1, a1, b1, c1 = q1
+        s2, a2, b2, c2 = q2
+        return (s1 * s2 - a1 * a2 - b1 * b2 - c1 * c2,
+                s1 * a2 + a1 * s2 + b1 * c2 - c1 * b2,
+                s1 * b2 - a1 * c2 + b1 * s2 + c1 * a2,
+                s1 * c2 + a1 * b2 - b1 * a2 + c1 * s2)
+
+    def localTransform(self):
+        """
+        This component's transform relative to its parent:
+        translate @ postRotation @ outRotation @ rotateU @ rotateV @ rotateW @ inRotation @ preRotation @ scale
+        The fixed products around the rotation are cached until one of their matrices is replaced, the three
+        rotations are fused into one quaternion, and scaling and translation are applied in place, so the result is
+        written into this component's own buffer without building any intermediate 4x4 matrix.
+
+        :return: the local transform buffer, owned by this component and overwritten by the next call
+        :rtype: numpy.ndarray
+        """
         # if self.quat is set, use the quaternion as your rotation matrix.
         # otherwise, use Euler angles with rotation extents, etc.
         # this means that quaternions will always override the settings for Euler angles
-
-        if self.quat != None:
-            rotationMatU = self.quat.toMatrix().transpose()
-            rotationMatV = np.identity(4)
-            rotationMatW = np.identity(4)
+        if self.quat is not None:
+            # the transpose of the quaternion's matrix is the matrix of its conjugate
+            s, a, b, c = -float(self.quat.s), *map(float, self.quat.v)
         else:
-            rotationMatU = self.glUtility.rotate(self.uAngle, self.uAxis, False)
-            rotationMatV = self.glUtility.rotate(self.vAngle, self.vAxis, False)
-            rotationMatW = self.glUtility.rotate(self.wAngle, self.wAxis, False)
-        scalingMat = self.glUtility.scale(*self.currentScaling, False)
-
-        self.transformationMat = parentTransformationMat @ translationMat @ self.postRotationMat @ self.outRotation @ rotationMatU @ rotationMatV @ \
-                                 rotationMatW @ self.inRotation @ self.preRotationMat @ scalingMat
-
-        for c in self.children:
-            c.update(self.transformationMat)
+            s, a, b, c = self.quaternionProduct(
+                self.quaternionProduct(self.axisQuaternion(self.uAngle, self.uAxis),
+                                       self.axisQuaternion(self.vAngle, self.vAxis)),
+                self.axisQuaternion(self.wAngle, self.wAxis))
+
+        # same layout as Quaternion.toMatrix
+        r00, r01, r02 = 1 - 2 * b * b - 2 * c * c, 2 * a * b - 2 * s * c, 2 * a * c + 2 * s * b
+        r10, r11, r12 = 2 * a * b + 2 * s * c, 1 - 2 * a * a - 2 * c * c, 2 * b * c - 2 * s * a
+        r20, r21, r22 = 2 * a * c - 2 * s * b, 2 * b * c + 2 * s * a, 1 - 2 * a * a - 2 * b * b
+        sx, sy, sz = map(float, self.currentScaling)
+        x, y, z = self.currentPos.coords.tolist()
+
+        sources = self.fixedSources
+        if sources is None or sources[0] is not self.postRotationMat or sources[1] is not self.outRotation or \
+                sources[2] is not self.inRotation or sources[3] is not self.preRotationMat:
+            identity = np.identity(4)
+            fixedBefore = self.postRotationMat @ self.outRotation
+            fixedAfter = self.inRotation @ self.preRotationMat
+            self.fixedBefore = None if np.array_equal(fixedBefore, identity) else fixedBefore
+            self.fixedAfter = None if np.array_equal(fixedAfter, identity) else fixedAfter
+            self.fixedSources = (self.postRotationMat, self.outRotation, self.inRotation, self.preRotationMat)
+
+        if self.localBuffers is None:
+            self.localBuffers = (np.identity(4), np.empty((4, 4)), np.empty((4, 4)))
+        rotation, local, scratch = self.localBuffers
+        if self.fixedBefore is None and self.fixedAfter is None:
+            # the common case: one write of the whole transform
+            local[...] = ((r00 * sx, r01 * sy, r02 * sz, x),
+                          (r10 * sx, r11 * sy, r12 * sz, y),
+                          (r20 * sx, r21 * sy, r22 * sz, z),
+                          (0.0, 0.0, 0.0, 1.0))
+            return local
+
+        rotation[:3, :3] = ((r00, r01, r02), (r10, r11, r12), (r20, r21, r22))
+        if self.fixedAfter is None:
+            np.matmul(self.fixedBefore, rotation, out=local)
+        elif self.fixedBefore is None:
+            np.matmul(rotation, self.fixedAfter, out=local)
+        else:
+            np.matmul(self.fixedBefore, rotation, out=scratch)
+            np.matmul(scratch, self.fixedAfter, out=local)
+        # scaling multiplies the first three columns, translation adds to the first three rows
+        local[:, 0] *= sx
+        local[:, 1] *= sy
+        local[:, 2] *= sz
+        bottom = local[3]
+        if bottom.tolist() == [0.0, 0.0, 0.0, 1.0]:
+            local[:3, 3] += (x, y, z)
+        else:
+            np.multiply(bottom, x, out=scratch[0])
+            local[0] += scratch[0]
+            np.multiply(bottom, y, out=scratch[0])
+            local[1] += scratch[0]
+            np.multiply(bottom, z, out=scratch[0])
+            local[2] += scratch[0]
+        return local
 
     def rotate(self, degree, axis):
         """
@@ -239,14 +531,24 @@ class Component:
             raise TypeError("unknown axis for rotation")
         index = self.axisBucket.index(axis)
         if index == 0:
-            self.uAngle = max(min(degree + self.uAngle, self.uRange[1]), self.uRange[0])
-            # print(self.uAngle)
+            angle = max(min(degree + self.uAngle, self.uRange[1]), self.uRange[0])
+            changed = angle != self.uAngle
+            self.uAngle = angle
         elif index == 1:
-            self.vAngle = max(min(degree + self.vAngle, self.vRange[1]), self.vRange[0])
-            # print(self.vAngle)
+            angle = max(min(degree + self.vAngle, self.vRange[1]), self.vRange[0])
+            changed = angle != self.vAngle
+            self.vAngle = angle
+        else:
+            angle = max(min(degree + self.wAngle, self.wRange[1]), self.wRange[0])
+            changed = angle != self.wAngle
+            self.wAngle = angle
+        # a joint held at its limit keeps its cached transform
+        if not changed:
+            return
+        if self.scene is not None:
+            self.scene.write(self.sceneRow, "angles", angle, index)
         else:
-            self.wAngle = max(min(degree + self.wAngle, self.wRange[1]), self.wRange[0])
-            # print(self.wAngle)
+            self.markDirty()
 
     def reset(self, mode="all"):
         """
@@ -270,6 +572,7 @@ class Component:
             self.setU([1, 0, 0])
             self.setV([0, 1, 0])
             self.setW([0, 0, 1])
+        self.markDirty()
 
     def setRotateExtent(self, axis, minDeg=None, maxDeg=None):
         """
@@ -326,6 +629,9 @@ class Component:
         shaderProg.use()
         texture_image = Image.open(imgFilePath).convert("RGB")
         texture_image = np.array(texture_image, dtype=np.uint8)
+        # texture units are only taken by components that have a texture
+        if self.texture is None:
+            self.texture = Texture()
         self.texture.setTextureImage(texture_image)
         self.textureOn = textureOn
 
@@ -335,12 +641,15 @@ class Component:
         index = self.axisBucket.index(axis)
 
         if index == 0:
-            self.uAngle = self.clamp(angle, self.uRange[0], self.uRange[1])
+            angle = self.uAngle = self.clamp(angle, self.uRange[0], self.uRange[1])
         elif index == 1:
-            self.vAngle = self.clamp(angle, self.vRange[0], self.vRange[1])
+            angle = self.vAngle = self.clamp(angle, self.vRange[0], self.vRange[1])
         else:
-            self.wAngle = self.clamp(angle, self.wRange[0], self.wRange[1])
-        self.update()
+            angle = self.wAngle = self.clamp(angle, self.wRange[0], self.wRange[1])
+        if self.scene is not None:
+            self.scene.write(self.sceneRow, "angles", angle, index)
+        else:
+            self.markDirty()
 
     def setDefaultAngle(self, angle, axis):
         """
@@ -361,6 +670,10 @@ class Component:
         else:
             self.default_wAngle = angle
             self.wAngle = angle
+        if self.scene is not None:
+            self.scene.write(self.sceneRow, "angles", angle, index)
+        else:
+            self.markDirty()
 
     def setDefaultPosition(self, pos):
         """
@@ -373,6 +686,7 @@ class Component:
             raise TypeError("pos should have type Point")
         self.defaultPos = pos.copy()
         self.currentPos = copy.deepcopy(self.defaultPos)
+        self.translationChanged()
 
     def setDefaultScale(self, scale):
         """
@@ -388,7 +702,10 @@ class Component:
             raise ValueError("Component only accept uniform scaling")"""
         self.defaultScaling = copy.deepcopy(scale)
         self.currentScaling = copy.deepcopy(self.defaultScaling)
-        self.update()
+        if self.scene is not None:
+            self.scene.write(self.sceneRow, "scales", self.currentScaling)
+        else:
+            self.markDirty()
 
     def setDefaultColor(self, color):
         """
@@ -412,7 +729,7 @@ class Component:
         if not isinstance(pos, Point):
             raise TypeError("pos should have type Point")
         self.currentPos = pos.copy()
-        self.update()
+        self.translationChanged()
 
     def setCurrentColor(self, color):
         """
@@ -443,7 +760,10 @@ class Component:
         if min(scale) != max(scale):
             raise ValueError("Component only accept uniform scaling")
         self.currentScaling = copy.deepcopy(scale)
-        self.update()
+        if self.scene is not None:
+            self.scene.write(self.sceneRow, "scales", self.currentScaling)
+        else:
+            self.markDirty()
 
     def setPreRotation(self, rotation_matrix=None):
         """
@@ -455,6 +775,7 @@ class Component:
         """
         if isinstance(rotation_matrix, np.ndarray):
             self.preRotationMat = rotation_matrix
+            self.markDirty()
 
     def setPostRotation(self, rotation_matrix=None):
         """
@@ -465,6 +786,7 @@ class Component:
         """
         if isinstance(rotation_matrix, np.ndarray):
             self.postRotationMat = rotation_matrix
+            self.markDirty()
 
     def u(self):
         return self.uAxis.copy()
@@ -480,25 +802,70 @@ class Component:
             raise TypeError("axis should have the same size as the current one")
         for i in range(len(u)):
             self.uAxis[i] = u[i]
+        self.axesVersion += 1
+        self.markDirty()
 
     def setV(self, v):
         if len(v) != len(self.vAxis):
             raise TypeError("axis should have the same size as the current one")
         for i in range(len(v)):
             self.vAxis[i] = v[i]
+        self.axesVersion += 1
+        self.markDirty()
 
     def setW(self, w):
         if len(w) != len(self.wAxis):
             raise TypeError("axis should have the same size as the current one")
         for i in range(len(w)):
             self.wAxis[i] = w[i]
+        self.axesVersion += 1
+        self.markDirty()
     
     def setQuaternion(self, q):
         """ sets a quaternion for rotation """
         if not isinstance(q, Quaternion):
             raise TypeError("q must be of type Quaternion")
         self.quat = q
+        self.markDirty()
 
     def clearQuaternion(self):
         """ clears the existing quaternion """
         self.quat = None
+        self.markDirty()
+
+
+class StructureCursor:
+    """
+    Reads the structure changes of the Component tree, as recorded by Component.structureChanged. The log only keeps
+    the changes that some live cursor has not read yet, so removed components are not held on to for longer than the
+    slowest reader needs them. A cursor is only tracked by a weak reference: dropping its owner stops the log from
+    waiting for it.
+    """
+    version = None  # int: Component.structureVersion this cursor has read up to, None before the first skip()
+
+    def __init__(self):
+        Component.structureCursors.add(self)
+
+    def pending(self):
+        """
+        :return: whether the tree changed since this cursor last read it
+        :rtype: bool
+        """
+        return self.version != Component.structureVersion
+
+    def changes(self):
+        """
+        Read the changes since the last call, and let the log forget them
+
+        :return: (parent, child, added) of every change, oldest first. None if one of them is unknown, or was
+            forgotten, in which case the reader should walk the whole tree again.
+        :rtype: list
+        """
+        changes = Component.structureChangesSince(self.version)
+        self.skip()
+        return changes
+
+    def skip(self):
+        """ Mark every change so far as read, for a reader that just walked the whole tree """
+        self.version = Component.structureVersion
+        Component.trimStructureLog()
@@ -0,0 +1,207 @@
+"""
+Structure-of-arrays storage for the simulation state of creatures.
+Instead of every creature keeping its own Point objects, a CreatureStore keeps one contiguous NumPy array per
+property, and each EnvironmentObject becomes a thin view over one row of those arrays. Vectorized simulation
+passes can then work on plain slices of the arrays without touching any per-creature Python object.
+"""
+
+import numpy as np
+
+
+class CreatureStore:
+    """
+    Contiguous arrays for positions, velocities, bounding radii, species ids and alive flags.
+
+    Rows [0, count) are in use and are always kept dense: releasing a row moves the last row into the hole, so
+    a vectorized pass only ever needs to look at array[:count]. owners[i] is the object that row i belongs to,
+    and its store_row is kept up to date whenever its row moves.
+
+    Arrays are reallocated when the store grows, so never hold on to a slice across an allocate() call. The owners
+    list itself is only ever changed in place, so other objects may share it.
+    """
+    positions = None  # ndarray (capacity, 3): position relative to the parent component
+    previous_positions = None  # ndarray (capacity, 3): position before the last simulation step
+    velocities = None  # ndarray (capacity, 3): translation per simulation step
+    radii = None  # ndarray (capacity,): bounding sphere radius
+    species = None  # ndarray<int32> (capacity,): species id
+    alive = None  # ndarray<bool> (capacity,): False once the creature has been eaten
+    moving = None  # ndarray<bool> (capacity,): False until the creature has been given a velocity
+    step_counters = None  # ndarray<int32> (capacity,): steps since the creature last picked a random heading
+    headings = None  # ndarray (capacity, 3): unit direction the creature was last oriented to, zero if never
+    serials = None  # ndarray<int64> (capacity,): number of the creature in each row, unique across all stores and
+    # kept when the row moves or is copied, so that anyone caching a row index can check it still holds the creature
+    owners = None  # list<EnvironmentObject>: owners[i] holds row i
+
+    count = 0
+    dtype = None
+    nextSerial = 0  # int, shared by all stores: serial of the next creature
+
+    FIELDS = ("positions", "previous_positions", "velocities", "radii", "species", "alive", "moving", "step_counters",
+              "headings", "serials")
+
+    def __init__(self, capacity=16, dtype=np.float64):
+        """
+        :param capacity: number of rows to reserve up front
+        :type capacity: int
+        :param dtype: floating point type used for positions, velocities and radii
+        :type dtype: numpy.float32 or numpy.float64
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in (np.dtype(np.float32), np.dtype(np.float64)):
+            raise TypeError("CreatureStore dtype should be float32 or float64")
+        self.dtype = dtype
+        self.count = 0
+        self.owners = []
+        capacity = max(1, int(capacity))
+        self.positions = np.zeros((capacity, 3), dtype=dtype)
+        self.previous_positions = np.zeros((capacity, 3), dtype=dtype)
+        self.velocities = np.zeros((capacity, 3), dtype=dtype)
+        self.radii = np.zeros(capacity, dtype=dtype)
+        self.species = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.moving = np.zeros(capacity, dtype=bool)
+        self.step_counters = np.zeros(capacity, dtype=np.int32)
+        self.headings = np.zeros((capacity, 3), dtype=dtype)
+        self.serials = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self):
+        return self.count
+
+    def capacity(self):
+        return self.radii.shape[0]
+
+    def _resize(self, capacity):
+        for name in self.FIELDS:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def allocate(self, owner):
+        """
+        Reserve a new row for owner. The row starts at the origin, not moving and alive.
+
+        :param owner: the object this row belongs to
+        :return: the new row index
+        :rtype: int
+        """
+        if self.count == self.capacity():
+            self._resize(self.capacity() * 2)
+        row = self.count
+        self.count += 1
+        self.owners.append(owner)
+        self.positions[row] = 0
+        self.previous_positions[row] = 0
+        self.velocities[row] = 0
+        self.radii[row] = 0
+        self.species[row] = 0
+        self.alive[row] = True
+        self.moving[row] = False
+        self.step_counters[row] = 0
+        self.headings[row] = 0
+        self.serials[row] = self.newSerials(1)[0]
+        return row
+
+    @staticmethod
+    def newSerials(num):
+        """
+        :param num: number of creatures
+        :type num: int
+        :return: serials never given out before, for rows passed to extend()
+        :rtype: numpy.ndarray
+        """
+        first = CreatureStore.nextSerial
+        CreatureStore.nextSerial += num
+        return np.arange(first, first + num, dtype=np.int64)
+
+    def release(self, row):
+        """
+        Free a row by moving the last row into it, which keeps rows [0, count) dense.
+        The owner of the moved row gets its store_row updated.
+
+        :param row: the row to free
+        :type row: int
+        :return: None
+        """
+        if not 0 <= row < self.count:
+            raise IndexError(f"row {row} is not in use")
+        last = self.count - 1
+        if row != last:
+            self.copyRow(row, self, last)
+            moved = self.owners[last]
+            self.owners[row] = moved
+            moved.store_row = row
+        self.owners.pop()
+        self.count = last
+
+    def copyRow(self, row, source, sourceRow):
+        """
+        Copy every property of sourceRow in source into row of this store
+
+        :type row: int
+        :type source: CreatureStore
+        :type sourceRow: int
+        :return: None
+        """
+        self.positions[row] = source.positions[sourceRow]
+        self.previous_positions[row] = source.previous_positions[sourceRow]
+        self.velocities[row] = source.velocities[sourceRow]
+        self.radii[row] = source.radii[sourceRow]
+        self.species[row] = source.species[sourceRow]
+        self.alive[row] = source.alive[sourceRow]
+        self.moving[row] = source.moving[sourceRow]
+        self.step_counters[row] = source.step_counters[sourceRow]
+        self.headings[row] = source.headings[sourceRow]
+        self.serials[row] = source.serials[sourceRow]
+
+    def takeRows(self, rows):
+        """
+        Copy the state of some rows out of the store
+
+        :param rows: row indices or a mask over rows [0, count)
+        :type rows: numpy.ndarray
+        :return: one array per name in FIELDS
+        :rtype: dict
+        """
+        return {name: getattr(self, name)[:self.count][rows].copy() for name in self.FIELDS}
+
+    def extend(self, rows):
+        """
+        Append rows without owners, as returned by takeRows
+
+        :param rows: one array per name in FIELDS
+        :type rows: dict
+        :return: index of the first appended row
+        :rtype: int
+        """
+        first = self.count
+        num = len(rows["radii"])
+        capacity = self.capacity()
+        if first + num > capacity:
+            while first + num > capacity:
+                capacity *= 2
+            self._resize(capacity)
+        for name in self.FIELDS:
+            getattr(self, name)[first:first + num] = rows[name]
+        self.owners.extend([None] * num)
+        self.count = first + num
+        return first
+
+    def keepRows(self, keep):
+        """
+        Drop every row not in keep in one pass. Rows that stay keep their relative order, and owners get their
+        store_row updated.
+
+        :param keep: mask over rows [0, count)
+        :type keep: numpy.ndarray
+        :return: None
+        """
+        kept = int(np.count_nonzero(keep))
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            array[:kept] = array[:self.count][keep]
+        self.owners[:] = [owner for owner, k in zip(self.owners, keep) if k]
+        for row, owner in enumerate(self.owners):
+            if owner is not None:
+                owner.store_row = row
+        self.count = kept
@@ -11,9 +11,9 @@ from random import random
 from Point import Point
 from Displayable import Displayable
 from GLBuffer import VAO, VBO, EBO
+from MeshCache import meshCache
 import numpy as np
 import ColorType
-from collada import *
 
 try:
     import OpenGL
@@ -41,6 +41,75 @@ except ImportError:
     raise ImportError("Required dependency PyOpenGL not present")
 
 
+# interleaved vertex layout used by every mesh: position, normal, color, texture coordinates
+VERTEX_SIZE = 11
+POSITION = slice(0, 3)
+NORMAL = slice(3, 6)
+COLOR = slice(6, 9)
+TEXTURE = slice(9, 11)
+
+
+def interleaveVertices(positions, normals=None, colors=None, textureCoords=None):
+    """
+    Build the flat interleaved vertex array of a mesh from per-vertex attribute arrays, in one pass
+
+    :param positions: (n, 3) vertex positions
+    :type positions: numpy.ndarray
+    :param normals: (n, 3) vertex normals, zero if not given
+    :type normals: numpy.ndarray
+    :param colors: (n, 3) vertex colors, or one color for every vertex, zero if not given
+    :type colors: numpy.ndarray
+    :param textureCoords: (n, 2) texture coordinates, zero if not given
+    :type textureCoords: numpy.ndarray
+    :return: n * VERTEX_SIZE floats
+    :rtype: numpy.ndarray
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    vertices = np.zeros((len(positions), VERTEX_SIZE))
+    vertices[:, POSITION] = positions
+    if normals is not None:
+        vertices[:, NORMAL] = normals
+    if colors is not None:
+        vertices[:, COLOR] = colors
+    if textureCoords is not None:
+        vertices[:, TEXTURE] = textureCoords
+    return vertices.ravel()
+
+
+def vertexRows(vertices):
+    """
+    :param vertices: flat interleaved vertex array
+    :type vertices: numpy.ndarray
+    :return: a (n, VERTEX_SIZE) view of vertices, so that changing it changes vertices
+    :rtype: numpy.ndarray
+    """
+    rows = vertices.view()
+    # assigning the shape, rather than calling reshape, raises instead of silently copying
+    rows.shape = (-1, VERTEX_SIZE)
+    return rows
+
+
+def transformVertices(vertices, scale=None, color=None):
+    """
+    Scale the positions and set the color of every vertex of an interleaved vertex array, in place
+
+    :param vertices: flat interleaved vertex array
+    :type vertices: numpy.ndarray
+    :param scale: three scale factors for the positions, unchanged if None
+    :type scale: list or tuple
+    :param color: RGB color for every vertex, unchanged if None
+    :type color: numpy.ndarray
+    :return: vertices
+    :rtype: numpy.ndarray
+    """
+    rows = vertexRows(vertices)
+    if scale is not None:
+        rows[:, POSITION] *= scale
+    if color is not None:
+        rows[:, COLOR] = color
+    return vertices
+
+
 class DisplayableMesh(Displayable):
     vao = None
     vbo = None
@@ -51,8 +120,12 @@ class DisplayableMesh(Displayable):
     indices = None  # stores triangle indices to vertices
 
     defaultColor = None
+    # shared meshes keep their geometry unscaled in MeshCache, and leave scale to the model matrix and color to the
+    # currentColor uniform
+    meshKey = None  # str: key of the shared geometry in MeshCache, None for a mesh owning its own buffers
+    scale = None  # list<float>(3): scale of a shared mesh, to be applied by whoever sets its model matrix
 
-    def __init__(self, shaderProg, scale, vertexData, indexData, color=ColorType.BLUE):
+    def __init__(self, shaderProg, scale, vertexData, indexData, color=ColorType.BLUE, meshKey=None):
         """
         :param shaderProg: compiled shader program
         :type shaderProg: GLProgram
@@ -62,6 +135,9 @@ class DisplayableMesh(Displayable):
         :type filename: string
         :param color: vertex color to be applied uniformly
         :type color: ColorType
+        :param meshKey: share the GPU buffers of this key with every other mesh of the same key. vertexData and
+            indexData are then left unchanged, and scale is not baked into them.
+        :type meshKey: str
         """
         super(DisplayableMesh, self).__init__()
         assert(len(scale) == 3)
@@ -71,32 +147,60 @@ class DisplayableMesh(Displayable):
         self.shaderProg = shaderProg
         self.shaderProg.use()
 
+        if meshKey is not None:
+            self.meshKey = meshKey
+            self.scale = list(scale)
+            self.vertices = vertexData
+            self.indices = indexData
+            return
+
         self.vao = VAO()
         self.vbo = VBO()  # vbo can only be initiate with glProgram activated
         self.ebo = EBO()
 
         self.indices = indexData
-        self.vertices = vertexData
+        # scaled and colored in a private copy, vertexData may be the read-only geometry shared by an asset
+        self.vertices = transformVertices(np.array(vertexData, dtype=np.float64), scale, self.defaultColor)
 
-        for i in range(len(self.vertices) // 11):
-            i = i * 11
-            self.vertices[i] = self.vertices[i] * scale[0]
-            self.vertices[i + 1] = self.vertices[i + 1] * scale[1]
-            self.vertices[i + 2] = self.vertices[i + 2] * scale[2]
-            self.vertices[i + 5] = self.defaultColor[0]
-            self.vertices[i + 6] = self.defaultColor[1]
-            self.vertices[i + 7] = self.defaultColor[2]
+    def setGeometry(self, meshKey, vertexData, indexData):
+        """
+        Point a shared mesh at the geometry of another key, for instance another level of detail. Only the VAO and
+        EBO binding changes, the buffers of meshKey are uploaded unless MeshCache already holds them.
+
+        :param meshKey: key of the new geometry in MeshCache
+        :type meshKey: str
+        :param vertexData: unscaled interleaved vertex data of meshKey
+        :type vertexData: numpy.ndarray
+        :param indexData: triangle indices of meshKey
+        :type indexData: numpy.ndarray
+        """
+        if self.meshKey is None:
+            raise ValueError("Only a mesh sharing its geometry through MeshCache can change it")
+        self.meshKey = meshKey
+        self.vertices = vertexData
+        self.indices = indexData
+        if self.vao is not None:
+            # already initialized, otherwise initialize() picks up the new key
+            self.vao, self.ebo = meshCache.getVao(meshKey, self.shaderProg, vertexData, indexData)
 
     def draw(self):
         self.vao.bind()
         self.ebo.draw()
         self.vao.unbind()
 
+    def drawBound(self):
+        """ draw with self.vao already bound, for callers drawing many meshes that share it """
+        self.ebo.draw()
+
     def initialize(self):
         """
         Remember to bind VAO before this initialization. If VAO is not bind, program might throw an error
         in systems that don't enable a default VAO after GLProgram compilation
         """
+        if self.meshKey is not None:
+            # only the first mesh of a key uploads anything
+            self.vao, self.ebo = meshCache.getVao(self.meshKey, self.shaderProg, self.vertices, self.indices)
+            return
         self.vao.bind()
         self.vbo.setBuffer(self.vertices, 11)
         self.ebo.setBuffer(self.indices)
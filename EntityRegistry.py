@@ -0,0 +1,175 @@
+"""
+Registry of the creatures living in a CreatureStore, handing out generational ids.
+An id packs a slot number with the generation of that slot, so an id held on to after its creature was removed
+never resolves to the creature that reuses the slot later. Rows of the store stay dense: removing a creature
+swap-removes its row, and removals asked for during a simulation step are queued and carried out together by
+flush() at the end of the step, so nothing disappears while a pass is still walking the rows.
+"""
+
+from CreatureStore import CreatureStore
+
+SLOT_BITS = 24
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+
+class EntityRegistry:
+    """
+    Generational ids, per-species id sets and a deferred despawn queue over the rows of a CreatureStore
+    """
+    store = None  # CreatureStore: holds the state of every registered creature
+    slots = None  # list<EnvironmentObject>: creature in each slot, None for free slots
+    generations = None  # list<int>: current generation of each slot
+    freeSlots = None  # list<int>: slots ready to be reused
+    speciesSets = None  # dict<int, set<int>>: ids of the registered creatures of each species
+    pending = None  # dict<int, int>: slot -> id of the creatures waiting to be despawned
+    listeners = None  # list: told of every spawn through spawned(obj), and every removal through despawned(obj, row)
+
+    def __init__(self, store):
+        """
+        :param store: the store registered creatures are moved into
+        :type store: CreatureStore
+        """
+        if not isinstance(store, CreatureStore):
+            raise TypeError("EntityRegistry needs a CreatureStore")
+        self.store = store
+        self.slots = []
+        self.generations = []
+        self.freeSlots = []
+        self.speciesSets = {}
+        self.pending = {}
+        self.listeners = []
+
+    def __len__(self):
+        return self.store.count
+
+    def __iter__(self):
+        """ registered creatures in row order """
+        return iter(self.store.owners)
+
+    def __contains__(self, entity_id):
+        return self.get(entity_id) is not None
+
+    @staticmethod
+    def slotOf(entity_id):
+        return entity_id & SLOT_MASK
+
+    @staticmethod
+    def generationOf(entity_id):
+        return entity_id >> SLOT_BITS
+
+    def spawn(self, obj):
+        """
+        Register obj and move its state into the store
+
+        :param obj: the creature to register
+        :type obj: EnvironmentObject
+        :return: the new id of obj
+        :rtype: int
+        """
+        if obj.entity_id is not None and obj.registry is self:
+            return obj.entity_id
+        if self.freeSlots:
+            slot = self.freeSlots.pop()
+            self.slots[slot] = obj
+        else:
+            slot = len(self.slots)
+            if slot > SLOT_MASK:
+                raise ValueError("EntityRegistry is out of slots")
+            self.slots.append(obj)
+            self.generations.append(0)
+        entity_id = (self.generations[slot] << SLOT_BITS) | slot
+        obj.attachStore(self.store)
+        obj.entity_id = entity_id
+        obj.registry = self
+        self.speciesSets.setdefault(obj.species_id, set()).add(entity_id)
+        for listener in self.listeners:
+            listener.spawned(obj)
+        return entity_id
+
+    def get(self, entity_id):
+        """
+        :return: the creature with this id, None if it has been despawned
+        :rtype: EnvironmentObject
+        """
+        slot = self.slotOf(entity_id)
+        if slot >= len(self.slots) or self.generations[slot] != self.generationOf(entity_id):
+            return None
+        return self.slots[slot]
+
+    def rowOf(self, entity_id):
+        """
+        :return: the store row of the creature with this id, None if it has been despawned
+        :rtype: int
+        """
+        obj = self.get(entity_id)
+        return None if obj is None else obj.store_row
+
+    def species(self, species_id):
+        """
+        :return: ids of the registered creatures of a species. Do not modify the returned set.
+        :rtype: set
+        """
+        return self.speciesSets.get(species_id, frozenset())
+
+    def changeSpecies(self, entity_id, old, new):
+        """ keep the species sets up to date when a registered creature changes species """
+        self.speciesSets.get(old, set()).discard(entity_id)
+        self.speciesSets.setdefault(new, set()).add(entity_id)
+
+    def despawn(self, entity_id):
+        """
+        Queue the creature with this id for removal at the next flush(). Stale ids are ignored.
+
+        :type entity_id: int
+        :return: True if the creature was queued
+        :rtype: bool
+        """
+        if self.get(entity_id) is None:
+            return False
+        self.pending[self.slotOf(entity_id)] = entity_id
+        return True
+
+    def flush(self):
+        """
+        Remove every queued creature. Each removal swap-removes its store row, so the whole flush costs
+        O(number of removed creatures) whatever the size of the store. Listeners hear of each removal right after
+        its row was released, with the row it held, so they can mirror the swap in lists kept in row order.
+
+        :return: the removed creatures, each now owning a private store
+        :rtype: list
+        """
+        removed = []
+        for slot, entity_id in self.pending.items():
+            obj = self.slots[slot]
+            row = obj.store_row
+            self.speciesSets[obj.species_id].discard(entity_id)
+            obj.detachStore()
+            obj.entity_id = None
+            obj.registry = None
+            self.slots[slot] = None
+            self.generations[slot] += 1
+            self.freeSlots.append(slot)
+            removed.append(obj)
+            for listener in self.listeners:
+                listener.despawned(obj, row)
+        self.pending = {}
+        return removed
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from EnvironmentObject import EnvironmentObject
+
+    # mass predation: despawn a tenth of the creatures in one step
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    for n in sizes:
+        registry = EntityRegistry(CreatureStore(n))
+        ids = [registry.spawn(EnvironmentObject()) for _ in range(n)]
+        t1 = time.time()
+        for entity_id in ids[::10]:
+            registry.despawn(entity_id)
+        removed = registry.flush()
+        t2 = time.time()
+        print(f"N={n}: despawned {len(removed)} in {(t2 - t1) * 1000:.2f}ms "
+              f"({(t2 - t1) / len(removed) * 1e6:.2f}us each)")
@@ -8,45 +8,197 @@ Created on Nov 1, 2018
 modified by Daniel Scrivener 08/2022
 '''
 
-import math
 from Point import Point
-from Quaternion import Quaternion
+from CreatureStore import CreatureStore
 import numpy as np
 
 
+def facingRotations(directions):
+    """
+    Rotations turning the z axis, which creatures face when created, towards each of directions, all in one pass
+
+    :param directions: (n, 3) target facing directions, not necessarily of unit length
+    :type directions: numpy.ndarray
+    :return: (n, 4, 4) rotation matrices
+    :rtype: numpy.ndarray
+    """
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    norms = np.linalg.norm(directions, axis=1)
+    directions = directions / np.where(norms == 0, 1, norms)[:, None]
+    # the rotation axis is z cross direction, x for a creature turning straight around
+    axes = np.zeros_like(directions)
+    axes[:, 0] = -directions[:, 1]
+    axes[:, 1] = directions[:, 0]
+    axisNorms = np.linalg.norm(axes, axis=1)
+    axes[axisNorms == 0] = (1, 0, 0)
+    axes /= np.where(axisNorms == 0, 1, axisNorms)[:, None]
+    halfAngles = np.arccos(np.clip(directions[:, 2], -1, 1)) / 2
+
+    # rotation matrix of the quaternion (s, a, b, c), laid out as Quaternion.toMatrix
+    s = np.cos(halfAngles)
+    a, b, c = (axes * np.sin(halfAngles)[:, None]).T
+    matrices = np.zeros((len(directions), 4, 4))
+    matrices[:, 0, 0] = 1 - 2 * b * b - 2 * c * c
+    matrices[:, 1, 0] = 2 * a * b + 2 * s * c
+    matrices[:, 2, 0] = 2 * a * c - 2 * s * b
+    matrices[:, 0, 1] = 2 * a * b - 2 * s * c
+    matrices[:, 1, 1] = 1 - 2 * a * a - 2 * c * c
+    matrices[:, 2, 1] = 2 * b * c + 2 * s * a
+    matrices[:, 0, 2] = 2 * a * c + 2 * s * b
+    matrices[:, 1, 2] = 2 * b * c - 2 * s * a
+    matrices[:, 2, 2] = 1 - 2 * a * a - 2 * b * b
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
 class EnvironmentObject:
     """
     Define properties and interface for a object in our environment
+
+    The simulation state (currentPos, translation_speed, bound_radius, species_id, alive) lives in one row of a
+    CreatureStore, and the properties below are views over that row. A new object owns a private one-row store
+    until it is attached to the store shared by its tank.
+    Subclasses that also inherit from Component must list EnvironmentObject first, so these properties take
+    precedence over Component's plain attributes.
     """
-    env_obj_list = []  # list<Environment>
     item_id = 0
-    species_id = 0
 
-    bound_radius = None
     bound_center = Point((0,0,0))
     first_rotation = True
-    
-    should_be_removed = False
+
+    flock_params = None  # FlockParams: set on creatures whose species flocks together
+
+    store = None  # CreatureStore which holds this object's state
+    store_row = None  # int: this object's row in store
+    registry = None  # EntityRegistry this object is registered with, if any
+    entity_id = None  # int: generational id given by registry
+
+    def _row(self):
+        if self.store is None:
+            self.store = CreatureStore(capacity=1)
+            self.store_row = self.store.allocate(self)
+        return self.store_row
+
+    def attachStore(self, store):
+        """
+        Move this object's state into a new row of store, and release its row in the old one
+
+        :param store: the store to move to
+        :type store: CreatureStore
+        :return: None
+        """
+        if store is self.store:
+            return
+        oldRow = self._row()
+        oldStore = self.store
+        row = store.allocate(self)
+        store.copyRow(row, oldStore, oldRow)
+        oldStore.release(oldRow)
+        self.store = store
+        self.store_row = row
+
+    def detachStore(self):
+        """
+        Move this object's state out of a shared store into a private one
+        """
+        if self.store is not None:
+            self.attachStore(CreatureStore(capacity=1, dtype=self.store.dtype))
+
+    @property
+    def currentPos(self):
+        row = self._row()
+        pos = Point()
+        pos.coords = self.store.positions[row]
+        return pos
+
+    @currentPos.setter
+    def currentPos(self, pos):
+        # setting the position moves the creature there at once, so it is not interpolated from the old one
+        row = self._row()
+        self.store.positions[row] = pos.coords
+        self.store.previous_positions[row] = pos.coords
+        # only objects that are also Components have a transform to flag
+        translationChanged = getattr(self, "translationChanged", None)
+        if translationChanged is not None:
+            translationChanged()
+
+    @property
+    def translation_speed(self):
+        row = self._row()
+        if not self.store.moving[row]:
+            return None
+        speed = Point()
+        speed.coords = self.store.velocities[row]
+        return speed
+
+    @translation_speed.setter
+    def translation_speed(self, speed):
+        row = self._row()
+        if speed is None:
+            self.store.moving[row] = False
+            self.store.velocities[row] = 0
+        else:
+            self.store.moving[row] = True
+            self.store.velocities[row] = speed.coords
+
+    @property
+    def bound_radius(self):
+        row = self._row()
+        return float(self.store.radii[row])
+
+    @bound_radius.setter
+    def bound_radius(self, radius):
+        row = self._row()
+        self.store.radii[row] = radius
+
+    @property
+    def species_id(self):
+        row = self._row()
+        return int(self.store.species[row])
+
+    @species_id.setter
+    def species_id(self, species_id):
+        row = self._row()
+        old = int(self.store.species[row])
+        self.store.species[row] = species_id
+        if self.registry is not None and old != species_id:
+            self.registry.changeSpecies(self.entity_id, old, species_id)
+
+    @property
+    def alive(self):
+        row = self._row()
+        return bool(self.store.alive[row])
+
+    @alive.setter
+    def alive(self, alive):
+        row = self._row()
+        self.store.alive[row] = alive
 
     def addCollisionObj(self, a):
         """
-        Add an environment object for this creature to interact with
+        Add an environment object for this creature to interact with, by spawning it in this creature's registry
         """
         if isinstance(a, EnvironmentObject):
-            self.env_obj_list.append(a)
+            if self.registry is None:
+                raise ValueError("Only a creature registered with an EntityRegistry can add others")
+            self.registry.spawn(a)
 
     def rmCollisionObj(self, a):
         """
-        Remove an environment object for this creature to interact with
+        Remove an environment object for this creature to interact with. Registered objects are queued and
+        removed when their registry is flushed at the end of the simulation step.
         """
         if isinstance(a, EnvironmentObject):
-            self.env_obj_list.remove(a)
+            if a.registry is None:
+                raise ValueError("Only a creature registered with an EntityRegistry can be removed")
+            a.registry.despawn(a.entity_id)
 
     def animationUpdate(self):
         """
         Perform the next frame of this environment object's animation.
+        Transforms are not recomputed here, Vivarium.animationUpdate updates every dirty component once per step.
         """
-        self.update()
+        return
 
     def stepForward(self):
         """
@@ -66,36 +218,17 @@ class EnvironmentObject:
         :param v1: targed facing direction
         :type v1: Point
         """
-        # Current facing direction when creating creature is along z axis
-        current_direction = Point([0, 0, 1])
-        # Normalize the target direction
-        target_direction = v1.normalize()
-    
-        # Calculate the rotation quaternion to rotate from the current direction to the target direction
-        rotation_axis = current_direction.cross3d(target_direction).normalize()
-        rotation_angle = math.acos(current_direction.dot(target_direction))
-    
-        # Directly compute the rotation matrix
-        s = math.cos(rotation_angle / 2.0)
-        v0 = (rotation_axis[0] * math.sin(rotation_angle / 2.0))
-        v1 = (rotation_axis[1] * math.sin(rotation_angle / 2.0))
-        v2 = (rotation_axis[2] * math.sin(rotation_angle / 2.0))
-        
-        # Apply the rotation to the object's orientation
-        rotation_matrix = Quaternion(s, v0, v1, v2).toMatrix()
+        self.setFacing(facingRotations([v1.coords[:3]])[0])
+
+    def setFacing(self, rotation_matrix):
+        """
+        Apply an orientation computed by facingRotations, for callers orienting many creatures in one pass
+
+        :param rotation_matrix: rotation from the z axis to the facing direction
+        :type rotation_matrix: numpy.ndarray
+        """
         self.setPostRotation(rotation_matrix)
-        
-        # Create quaternions for the current and target orientations
-        #current_quaternion = Quaternion(1, 0, 0, 0)  # Identity quaternion for the current orientation
-        #target_quaternion = Quaternion(s, v0, v1, v2)
-        
-        # Use slerp to interpolate between the current and target quaternions
-        #interpolated_quaternion = Quaternion.slerp(current_quaternion, target_quaternion, 0.5)
-    
-        # Apply the rotation to the object's orientation
-        #rotation_matrix = interpolated_quaternion.toMatrix()
-        #self.setPostRotation(rotation_matrix)
-        
+
         if self.species_id == 1:
             # Rotate the entire object by 90 degrees around the x-axis
             if self.first_rotation:
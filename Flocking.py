@@ -0,0 +1,172 @@
+"""
+Vectorized Boids flocking (Craig Reynolds, http://www.red3d.com/cwr/boids/) for the creatures in a CreatureStore.
+Every creature of a flocking species steers by three rules computed over its flock mates, the moving creatures of
+its own species within its neighbor radius:
+    * separation: move away from mates that are too close
+    * alignment: match the average heading of the mates
+    * cohesion: move toward the center of the mates
+Neighbor sets come from a spatial hash and the per-creature sums are done with bincount, so a step costs about the
+same per creature whether the flock has ten members or ten thousand.
+"""
+
+import numpy as np
+
+from SpatialHash import SpatialHash
+
+
+class FlockParams:
+    """
+    Flocking rule weights and ranges of one species. Velocities are per simulation step, so the weights are small.
+    """
+    neighborRadius = 1.5  # float: how far a creature sees its flock mates
+    separationRadius = 0.5  # float: mates closer than this push the creature away
+    separation = 0.0005  # float: weight of the separation rule
+    alignment = 0.05  # float: weight of the alignment rule
+    cohesion = 0.002  # float: weight of the cohesion rule
+    speed = 0.03  # float: flocking creatures keep moving at this speed
+
+    def __init__(self, neighborRadius=1.5, separationRadius=0.5, separation=0.0005, alignment=0.05,
+                 cohesion=0.002, speed=0.03):
+        if separationRadius > neighborRadius:
+            raise ValueError("separation radius should not be larger than the neighbor radius")
+        self.neighborRadius = neighborRadius
+        self.separationRadius = separationRadius
+        self.separation = separation
+        self.alignment = alignment
+        self.cohesion = cohesion
+        self.speed = speed
+
+
+class Flocking:
+    """
+    Applies the flocking rules of every registered species to a CreatureStore
+    """
+    species = None  # dict<int, FlockParams>
+    tank_dimensions = None
+    grid = None  # SpatialHash sized for the largest neighbor radius
+
+    def __init__(self, tank_dimensions):
+        self.species = {}
+        self.tank_dimensions = tank_dimensions
+        self.grid = None
+
+    def setSpecies(self, species_id, params):
+        """
+        Make a species flock, or stop it from flocking by passing None
+
+        :type species_id: int
+        :type params: FlockParams
+        """
+        if params is None:
+            self.species.pop(species_id, None)
+        else:
+            self.species[species_id] = params
+        self.grid = None
+
+    def _table(self, name, size):
+        table = np.zeros(size)
+        for species_id, params in self.species.items():
+            table[species_id] = getattr(params, name)
+        return table
+
+    def steer(self, store):
+        """
+        Turn every moving creature of a flocking species according to its flock mates
+
+        :param store: creature state
+        :type store: CreatureStore
+        :return: mask of rows whose velocity changed
+        :rtype: numpy.ndarray
+        """
+        n = store.count
+        turned = np.zeros(n, dtype=bool)
+        if not self.species or n < 2:
+            return turned
+        positions = store.positions[:n]
+        velocities = store.velocities[:n]
+        species = store.species[:n]
+
+        size = max(max(self.species) + 1, int(species.max()) + 1)
+        flocks = np.zeros(size, dtype=bool)
+        flocks[list(self.species)] = True
+        neighborRadius = self._table("neighborRadius", size)
+        separationRadius = self._table("separationRadius", size)
+
+        if self.grid is None:
+            self.grid = SpatialHash(self.tank_dimensions, neighborRadius.max())
+        self.grid.update(positions)
+        i, j = self.grid.candidatePairs()
+
+        # flock mates: moving creatures of the same flocking species within the neighbor radius
+        flocking = flocks[species] & store.moving[:n]
+        mates = flocking[i] & flocking[j] & (species[i] == species[j])
+        i, j = i[mates], j[mates]
+        offset = positions[j] - positions[i]
+        distance = np.linalg.norm(offset, axis=1)
+        close = distance < neighborRadius[species[i]]
+        i, j, offset, distance = i[close], j[close], offset[close], distance[close]
+        if len(i) == 0:
+            return turned
+
+        # look at every pair from both sides
+        a = np.concatenate((i, j))
+        b = np.concatenate((j, i))
+        offset = np.concatenate((offset, -offset))
+        distance = np.concatenate((distance, distance))
+        mateNum = np.bincount(a, minlength=n)
+        rows = np.flatnonzero(mateNum)
+
+        def sumByRow(values):
+            return np.stack([np.bincount(a, weights=values[:, k], minlength=n) for k in range(3)], axis=1)[rows]
+
+        # separation: away from mates that are too close, stronger the closer they are
+        tooClose = distance < separationRadius[species[a]]
+        push = -offset / np.maximum(distance, 1e-6)[:, None] ** 2 * tooClose[:, None]
+        separation = sumByRow(push)
+        # alignment: toward the average velocity of the mates
+        alignment = sumByRow(velocities[b]) / mateNum[rows, None] - velocities[rows]
+        # cohesion: toward the center of the mates
+        cohesion = sumByRow(offset) / mateNum[rows, None]
+
+        rowSpecies = species[rows]
+        steering = self._table("separation", size)[rowSpecies, None] * separation + \
+                   self._table("alignment", size)[rowSpecies, None] * alignment + \
+                   self._table("cohesion", size)[rowSpecies, None] * cohesion
+        velocity = velocities[rows] + steering
+        norm = np.linalg.norm(velocity, axis=1, keepdims=True)
+        steered = norm[:, 0] > 1e-12
+        rows = rows[steered]
+        speed = self._table("speed", size)[rowSpecies[steered], None]
+        velocities[rows] = velocity[steered] / norm[steered] * speed
+        turned[rows] = True
+        return turned
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from CreatureStore import CreatureStore
+
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 5000, 20000]
+    tank = [12, 12, 12]
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        store = CreatureStore(n)
+        for k in range(n):
+            store.allocate(None)
+        store.positions[:n] = (rng.random((n, 3)) - 0.5) * 11
+        store.velocities[:n] = (rng.random((n, 3)) - 0.5) * 0.03
+        store.species[:n] = 2
+        store.moving[:n] = True
+        # keep the flock density constant, so that the cost per creature should stay flat
+        params = FlockParams(neighborRadius=0.6 * (1000 / n) ** (1 / 3), separationRadius=0.2 * (1000 / n) ** (1 / 3))
+        flocking = Flocking(tank)
+        flocking.setSpecies(2, params)
+        flocking.steer(store)
+        repeat = 10
+        t1 = time.time()
+        for _ in range(repeat):
+            flocking.steer(store)
+            store.positions[:n] += store.velocities[:n]
+        stepTime = (time.time() - t1) / repeat
+        print(f"N={n}: {stepTime * 1000:.1f}ms/step, {stepTime / n * 1e6:.2f}us per creature")
@@ -0,0 +1,189 @@
+"""
+Bounding sphere frustum culling of whole creatures.
+Every creature (an EnvironmentObject that is also a Component) under root is tested once per frame against the six
+planes of the camera's view frustum, using its bounding sphere: bound_center in the creature's own frame, and
+bound_radius grown by the largest scaling of its world transform. A creature whose sphere lies entirely outside one
+of the planes is flagged Component.culled, and nothing in its subtree is drawn that frame, neither by
+Component.draw, RenderQueue nor InstancedRenderer.
+
+Creatures nested inside another creature are culled together with the outermost one. The creatures are followed
+through structure changes, see TrackedComponents.
+"""
+
+import numpy as np
+
+from EnvironmentObject import EnvironmentObject
+from TrackedComponents import StructureFollower, TrackedComponents
+
+
+class FrustumCuller(StructureFollower):
+    """
+    Flags the creatures under root that are outside the view. Call collect() after changing the bound_center of a
+    creature.
+    """
+    # outermost creatures under root, with the columns centers, the bound_center of every creature in its own frame
+    # in homogeneous coordinates, culled, the culled flag of every creature, storeRows, the row of every creature in
+    # store, and serials, the serial of every creature in store to notice the rows that moved
+    creatures = None  # TrackedComponents
+    store = None  # CreatureStore holding the radius of every creature, None if they do not all share one
+    storeStale = False  # whether some creatures were added without a row in store, so storeRows must be read again
+    culledNum = 0  # int: creatures culled by the last update()
+    drawnNum = 0  # int: creatures left to draw by the last update()
+
+    def __init__(self, root):
+        """
+        :param root: creatures under this component are culled from now on
+        :type root: Component
+        """
+        super(FrustumCuller, self).__init__(root)
+        self.clear()
+
+    @staticmethod
+    def cullable(component):
+        return isinstance(component, EnvironmentObject)
+
+    def clear(self):
+        # creatures that left the tree are drawn again if they come back
+        for creature in self.creatures.components if self.creatures is not None else ():
+            creature.culled = False
+        self.creatures = TrackedComponents(centers=np.ones((0, 4)), culled=np.zeros(0, dtype=bool),
+                                           storeRows=np.zeros(0, dtype=np.int64), serials=np.zeros(0, dtype=np.int64))
+        self.store = None
+        self.storeStale = False
+
+    def add(self, child, ancestors):
+        if any(self.cullable(a) for a in ancestors[1:]):
+            # part of a creature already taken in
+            return
+        creatures = []
+        stack = [child]
+        while stack:
+            component = stack.pop()
+            if not self.cullable(component):
+                stack.extend(component.children)
+            elif component not in self.creatures:
+                creatures.append(component)
+                component.culled = False
+        if not creatures:
+            return
+        centers = np.ones((len(creatures), 4))
+        for i, creature in enumerate(creatures):
+            centers[i, :3] = creature.bound_center.coords[:3]
+        if self.store is not None and all(c.store is self.store for c in creatures):
+            storeRows = np.array([c.store_row for c in creatures], dtype=np.int64)
+            serials = self.store.serials[storeRows]
+        else:
+            storeRows = serials = np.zeros(len(creatures), dtype=np.int64)
+            self.storeStale = True
+        self.creatures.extend(creatures, centers=centers, culled=np.zeros(len(creatures), dtype=bool),
+                              storeRows=storeRows, serials=serials)
+
+    def remove(self, child):
+        stack = [child]
+        while stack:
+            component = stack.pop()
+            if not self.cullable(component):
+                stack.extend(component.children)
+            elif self.creatures.remove(component):
+                component.culled = False
+
+    def readStoreRows(self):
+        """ Find the store holding every creature, and the row of each creature in it """
+        stores = {c.store for c in self.creatures.components}
+        self.store = stores.pop() if len(stores) == 1 else None
+        if self.store is not None:
+            storeRows = np.array([c.store_row for c in self.creatures.components], dtype=np.int64)
+            self.creatures.columns["storeRows"] = storeRows
+            self.creatures.columns["serials"] = self.store.serials[storeRows]
+        self.storeStale = False
+
+    def followStore(self):
+        """ Read again the store row of the creatures whose row moved since it was last read """
+        store = self.store
+        storeRows = self.creatures.columns["storeRows"]
+        serials = self.creatures.columns["serials"]
+        moved = (storeRows >= store.count) | (store.serials[storeRows] != serials)
+        for i in np.flatnonzero(moved).tolist():
+            creature = self.creatures.components[i]
+            if creature.store is not store:
+                self.readStoreRows()
+                return
+            storeRows[i] = creature.store_row
+            serials[i] = store.serials[creature.store_row]
+
+    def radii(self):
+        """
+        :return: bound_radius of every creature
+        :rtype: numpy.ndarray
+        """
+        if self.storeStale:
+            self.readStoreRows()
+        elif self.store is not None:
+            self.followStore()
+        if self.store is not None and self.creatures.components[0].store is self.store:
+            return self.store.radii[self.creatures.columns["storeRows"]]
+        return np.array([c.bound_radius for c in self.creatures.components])
+
+    def visible(self, planes):
+        """
+        :param planes: frustum planes as returned by Camera.frustumPlanes
+        :type planes: numpy.ndarray
+        :return: whether the bounding sphere of every creature is at least partly inside the frustum
+        :rtype: numpy.ndarray
+        """
+        rows = self.creatures.sceneRows()
+        if rows is not None:
+            worlds = self.creatures.scene.world[rows]
+        else:
+            worlds = np.stack([c.transformationMat for c in self.creatures.components])
+        centers = np.einsum("nij,nj->ni", worlds[:, :3], self.creatures.columns["centers"])
+        # columns of the world transform are the world axes of the creature, the longest one scales its radius
+        radii = self.radii() * np.linalg.norm(worlds[:, :3, :3], axis=1).max(axis=1)
+        distances = centers @ planes[:, :3].T + planes[:, 3]
+        return (distances >= -radii[:, None]).all(axis=1)
+
+    def update(self, planes):
+        """
+        Flag the creatures outside the frustum, and clear the flag of the others. Transforms must be up to date,
+        call after update().
+
+        :param planes: frustum planes as returned by Camera.frustumPlanes
+        :type planes: numpy.ndarray
+        :return: number of creatures culled
+        :rtype: int
+        """
+        self.sync()
+        if not self.creatures:
+            self.culledNum = self.drawnNum = 0
+            return 0
+        culled = ~self.visible(planes)
+        for i in np.flatnonzero(culled != self.creatures.columns["culled"]).tolist():
+            self.creatures.components[i].culled = bool(culled[i])
+        self.creatures.columns["culled"] = culled
+        self.culledNum = int(culled.sum())
+        self.drawnNum = len(self.creatures) - self.culledNum
+        return self.culledNum
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import Benchmark
+    from Camera import Camera
+
+    # python FrustumCulling.py [creatures]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    vivarium = Benchmark.buildScene(max(1, n // 4), n - max(1, n // 4))
+    vivarium.update()
+    culler = FrustumCuller(vivarium)
+    camera = Camera()
+    camera.setViewport(800, 600)
+    for distance in (12, 4, 1):
+        camera.cameraDis = distance
+        planes = camera.frustumPlanes()
+        culler.update(planes)
+        t1 = time.time()
+        for _ in range(10):
+            culler.update(planes)
+        elapsed = (time.time() - t1) / 10
+        print(f"camera at {distance}: {culler.culledNum} culled, {culler.drawnNum} drawn, {elapsed * 1000:.2f}ms")
@@ -92,6 +92,42 @@ class VBO:
         gl.glDrawArrays(gl.GL_TRIANGLES, 0, self.vertexNum)
 
 
+class InstanceVBO(VBO):
+    """
+    A VBO holding per-instance attributes, refilled every frame
+    """
+    capacity = 0  # bytes currently allocated on the GPU
+
+    def stream(self, bufferDataArray: np.ndarray):
+        """
+        Upload this frame's instance data. The old storage is orphaned, so the driver does not have to wait for
+        draws still reading last frame's data.
+
+        :param bufferDataArray: C-contiguous float32 array, one row per instance
+        :type bufferDataArray: numpy.ndarray
+        """
+        self.bind()
+        if bufferDataArray.nbytes > self.capacity:
+            self.capacity = bufferDataArray.nbytes
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, self.capacity, None, gl.GL_STREAM_DRAW)
+        gl.glBufferSubData(gl.GL_ARRAY_BUFFER, 0, bufferDataArray.nbytes, bufferDataArray)
+
+    def setInstanceAttribPointer(self, attribLoc, stride, offset, attribSize, columns=1):
+        """
+        Point an attribute at this buffer, advancing once per instance instead of once per vertex.
+        Matrix attributes take one location per column, pass columns=4 with attribSize=4 for a mat4.
+        """
+        if attribLoc < 0:
+            print("Warning: Cannot set instance attrib pointer at ", attribLoc)
+            return
+        self.bind()
+        for column in range(columns):
+            gl.glVertexAttribPointer(attribLoc + column, attribSize, gl.GL_FLOAT, gl.GL_FALSE, stride * 4,
+                                     ctypes.c_void_p((offset + column * attribSize) * 4))
+            gl.glEnableVertexAttribArray(attribLoc + column)
+            gl.glVertexAttribDivisor(attribLoc + column, 1)
+
+
 class EBO:
     """
     A class to handle EBO in OpenGL, with some help functions
@@ -124,6 +160,9 @@ class EBO:
     def draw(self):
         gl.glDrawElements(gl.GL_TRIANGLES, self.indexNum, gl.GL_UNSIGNED_INT, None)
 
+    def drawInstanced(self, instanceNum):
+        gl.glDrawElementsInstanced(gl.GL_TRIANGLES, self.indexNum, gl.GL_UNSIGNED_INT, None, instanceNum)
+
 class lineEBO:
     """
     A class to handle EBO in OpenGL, with some help functions
@@ -180,9 +219,49 @@ class VAO:
 # A global variable in this scope to store next texture id, there should be no duplicate textureUnitID
 NextTextureID = 1
 
+
+class TextureState:
+    """
+    Remembers the texture bound to each texture unit and the active unit, so that binding what is already bound
+    costs no GL call. Textures must be bound through this tracker, or forget() called after binding them otherwise.
+    """
+    bound = None  # dict<int, int>: texture name bound to each unit
+    activeUnit = None  # int: active texture unit
+
+    def __init__(self):
+        self.forget()
+
+    def forget(self):
+        """ drop everything remembered, for use after the GL context changed """
+        self.bound = {}
+        self.activeUnit = None
+
+    def bind(self, unit, textureName):
+        """
+        Bind textureName to unit, unless it is bound there already
+
+        :param unit: texture unit number, 0 for GL_TEXTURE0
+        :type unit: int
+        :param textureName: texture to bind, 0 for none
+        :type textureName: int
+        """
+        if self.bound.get(unit) == textureName:
+            return
+        if self.activeUnit != unit:
+            gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+            self.activeUnit = unit
+        gl.glBindTexture(gl.GL_TEXTURE_2D, textureName)
+        self.bound[unit] = textureName
+
+
+# the tracker of the texture units of the current context
+textureState = TextureState()
+
+
 class Texture:
     """
     Packed help functions to deal with texture mapping in OpenGL, can be used to store multiple textures
+    Only create one for components that actually have a texture, since each takes a texture unit.
     """
     textureName = 0
     textureUnitID = 0
@@ -205,7 +284,7 @@ class Texture:
         height, width, channel = image.shape
         imageData = image.flatten("C")
 
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.textureName)
+        textureState.bind(self.textureUnitID, self.textureName)
         gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, width, height, 0, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, imageData)
         gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
         self.setTextureParameters()
@@ -217,13 +296,17 @@ class Texture:
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
 
-    def bind(self, glslVariableLoc):
-        gl.glActiveTexture(gl.GL_TEXTURE0 + self.textureUnitID)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.textureName)
-        gl.glUniform1i(glslVariableLoc, self.textureUnitID)
-
-    def unbind(self, glslVariableLoc):
-        gl.glActiveTexture(gl.GL_TEXTURE0)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
-        gl.glUniform1i(glslVariableLoc, 0)
+    def bind(self, shaderProg, samplerName="textureImage"):
+        """
+        Bind this texture to its unit and point the sampler of shaderProg at it, skipping whatever is already set
+        """
+        textureState.bind(self.textureUnitID, self.textureName)
+        shaderProg.setInt(samplerName, self.textureUnitID)
 
+    @staticmethod
+    def unbind(shaderProg, samplerName="textureImage"):
+        """
+        Point the sampler of shaderProg at unit 0, with no texture bound there
+        """
+        textureState.bind(0, 0)
+        shaderProg.setInt(samplerName, 0)
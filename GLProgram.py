@@ -33,6 +33,9 @@ except ImportError:
 import numpy as np
 import math
 
+# uniform buffer binding point of the camera block, see Camera.upload
+CAMERA_BLOCK_BINDING = 0
+
 
 def perspectiveMatrix(angleOfView, near, far):
     result = np.identity(4)
@@ -59,9 +62,25 @@ class GLProgram:
 
     ready = False  # a control flag which reflect if this GLprogram is ready
     debug = 0
-
-    def __init__(self) -> None:
+    # the instanced variant takes the model matrix and color as per-instance vertex attributes instead of uniforms,
+    # for drawing many copies of one mesh with glDrawElementsInstanced
+    instanced = False
+
+    # GL state is cached to avoid redundant driver calls: locations are looked up once, the program in use is
+    # tracked so use() only calls glUseProgram when switching, and a uniform is only uploaded when its value
+    # changed. Code that sets uniforms or switches programs with raw gl calls must call forgetState() afterwards.
+    current = None  # GLProgram in use, shared by all programs of the context
+    attribLocations = None  # dict<str, int>: location of each vertex attribute, by program variable name
+    uniformLocations = None  # dict<str, int>: location of each uniform, by program variable name
+    uniformValues = None  # dict<int, object>: value last uploaded to each uniform location,
+    # a private float32 copy for matrices
+
+    def __init__(self, instanced=False) -> None:
         self.program = gl.glCreateProgram()
+        self.instanced = instanced
+        self.attribLocations = {}
+        self.uniformLocations = {}
+        self.uniformValues = {}
 
         self.ready = False
 
@@ -74,6 +93,7 @@ class GLProgram:
 
             "textureImage": "theTexture01",
 
+            "cameraBlock": "Camera",
             "projectionMat": "projection",
             "viewMat": "view",
             "modelMat": "model",
@@ -81,7 +101,10 @@ class GLProgram:
             "vertexJoints": "joint",
             "vertexJointWeights" : "jw",
 
-            "currentColor": "cColor"
+            "currentColor": "cColor",
+
+            "instanceModelMat": "aModel",
+            "instanceColor": "aInstanceColor"
         }
 
         self.vertexShaderSource = self.genVertexShaderSource()
@@ -89,6 +112,8 @@ class GLProgram:
 
     def __del__(self) -> None:
         try:
+            if GLProgram.current is self:
+                GLProgram.current = None
             gl.glDeleteProgram(self.program)
         except Exception as e:
             pass
@@ -106,6 +131,18 @@ class GLProgram:
         return shader
 
     def genVertexShaderSource(self):
+        if self.instanced:
+            modelSource = f"""
+        in mat4 {self.attribs["instanceModelMat"]};
+        in vec3 {self.attribs["instanceColor"]};
+        flat out vec3 vInstanceColor;"""
+            model = self.attribs["instanceModelMat"]
+            instanceColor = f"vInstanceColor = {self.attribs['instanceColor']};"
+        else:
+            modelSource = f"""
+        uniform mat4 {self.attribs["modelMat"]};"""
+            model = self.attribs["modelMat"]
+            instanceColor = ""
         vss = f'''
         #version 330 core
         in vec3 {self.attribs["vertexPos"]};
@@ -118,22 +155,32 @@ class GLProgram:
         smooth out vec3 vNormal;
         out vec2 vTexture;
         
-        uniform mat4 {self.attribs["projectionMat"]};
-        uniform mat4 {self.attribs["viewMat"]};
-        uniform mat4 {self.attribs["modelMat"]};
+        layout(std140) uniform {self.attribs["cameraBlock"]}
+        {{
+            mat4 {self.attribs["projectionMat"]};
+            mat4 {self.attribs["viewMat"]};
+        }};
+        {modelSource}
         
         void main()
         {{
-            gl_Position = {self.attribs["projectionMat"]} * {self.attribs["viewMat"]} * {self.attribs["modelMat"]} * vec4({self.attribs["vertexPos"]}, 1.0);
-            vPos = vec3({self.attribs["modelMat"]} * vec4({self.attribs["vertexPos"]}, 1.0));
+            gl_Position = {self.attribs["projectionMat"]} * {self.attribs["viewMat"]} * {model} * vec4({self.attribs["vertexPos"]}, 1.0);
+            vPos = vec3({model} * vec4({self.attribs["vertexPos"]}, 1.0));
             vColor = {self.attribs["vertexColor"]};
-            vNormal = normalize(transpose(inverse({self.attribs["modelMat"]})) * vec4({self.attribs["vertexNormal"]}, 0.0) ).xyz;
+            vNormal = normalize(transpose(inverse({model})) * vec4({self.attribs["vertexNormal"]}, 0.0) ).xyz;
             vTexture = {self.attribs["vertexTexture"]};
+            {instanceColor}
         }}
         '''
         return vss
 
     def genFragShaderSource(self):
+        if self.instanced:
+            colorSource = "flat in vec3 vInstanceColor;"
+            color = "vInstanceColor"
+        else:
+            colorSource = f"uniform vec3 {self.attribs['currentColor']};"
+            color = self.attribs["currentColor"]
         fss = f"""
         #version 330 core
         
@@ -142,7 +189,7 @@ class GLProgram:
         smooth in vec3 vNormal;
         in vec2 vTexture;
 
-        uniform vec3 {self.attribs["currentColor"]};
+        {colorSource}
         uniform sampler2D {self.attribs["textureImage"]};
         
         out vec4 FragColor;
@@ -155,7 +202,7 @@ class GLProgram:
             FragColor = clamp(FragColor, 0, 1);
 
             // Shade according to vertex colors
-            FragColor = vec4({self.attribs["currentColor"]}, 1.0);
+            FragColor = vec4({color}, 1.0);
         }}
         """
         return fss
@@ -172,7 +219,10 @@ class GLProgram:
 
     def getAttribLocation(self, name):
         programName = self.getAttribName(name)
-        attribLoc = gl.glGetAttribLocation(self.program, programName)
+        attribLoc = self.attribLocations.get(programName)
+        if attribLoc is None:
+            attribLoc = gl.glGetAttribLocation(self.program, programName)
+            self.attribLocations[programName] = attribLoc
         if attribLoc == -1 and self.debug > 1:
             print(f"Warning: Attrib {name} cannot found. Might have been optimized off")
         return attribLoc
@@ -182,11 +232,31 @@ class GLProgram:
             variableName = self.getAttribName(name)
         else:
             variableName = name
-        uniformLoc = gl.glGetUniformLocation(self.program, variableName)
+        uniformLoc = self.uniformLocations.get(variableName)
+        if uniformLoc is None:
+            uniformLoc = gl.glGetUniformLocation(self.program, variableName)
+            self.uniformLocations[variableName] = uniformLoc
         if uniformLoc == -1 and self.debug > 1:
             print(f"Warning: Uniform {name} cannot found. Might have been optimized off")
         return uniformLoc
 
+    def resolveLocations(self):
+        """
+        Look up the location of every attribute and uniform named in self.attribs, once, right after linking.
+        Names the shader does not use, or that the compiler optimized away, resolve to -1.
+        """
+        self.attribLocations = {}
+        self.uniformLocations = {}
+        self.uniformValues = {}
+        for variableName in self.attribs.values():
+            self.attribLocations[variableName] = gl.glGetAttribLocation(self.program, variableName)
+            self.uniformLocations[variableName] = gl.glGetUniformLocation(self.program, variableName)
+
+    def forgetState(self):
+        """ Forget the cached program in use and uniform values, after GL state was changed behind this class """
+        GLProgram.current = None
+        self.uniformValues = {}
+
     def getAttribName(self, attribIndexName):
         return self.attribs[attribIndexName]
 
@@ -219,64 +289,100 @@ class GLProgram:
             raise Exception(info)
 
         self.ready = True
+        self.resolveLocations()
+        # projection and view come from the camera's uniform buffer, shared by every program
+        blockIndex = gl.glGetUniformBlockIndex(self.program, self.attribs["cameraBlock"])
+        if blockIndex != gl.GL_INVALID_INDEX:
+            gl.glUniformBlockBinding(self.program, blockIndex, CAMERA_BLOCK_BINDING)
 
     def use(self):
         """
         This is required before the uniforms set up.
         """
+        if GLProgram.current is self:
+            return
         if not self.ready:
             raise Exception("GLProgram must compile before use it")
         gl.glUseProgram(self.program)
+        GLProgram.current = self
+
+    def _changed(self, location, value):
+        """
+        Remember value as the one last uploaded to location
+
+        :return: whether location held a different value before, and so needs the upload
+        :rtype: bool
+        """
+        if location == -1 or self.uniformValues.get(location) == value:
+            return False
+        self.uniformValues[location] = value
+        return True
 
     # some help methods to set uniform in program
-    def setMat4(self, name, mat, lookThroughAttribs=True):
+    # matrices are passed in column-major form, as laid out by GLUtility; a C-contiguous float32 matrix is handed to
+    # OpenGL as it is, anything else is converted first
+    def _setMatrix(self, name, mat, size, upload, lookThroughAttribs):
         self.use()
-        if mat.shape != (4, 4):
-            raise Exception("Projection Matrix must have 4x4 shape")
-        gl.glUniformMatrix4fv(self.getUniformLocation(name, lookThroughAttribs), 1, gl.GL_FALSE, mat.flatten("C"))
+        if mat.shape != (size, size):
+            raise Exception(f"Projection Matrix must have {size}x{size} shape")
+        mat = np.ascontiguousarray(mat, dtype=np.float32)
+        location = self.getUniformLocation(name, lookThroughAttribs)
+        if location == -1:
+            return
+        # compared in place against a private copy, which is only refreshed when the matrix changed
+        last = self.uniformValues.get(location)
+        if last is not None and np.array_equal(last, mat):
+            return
+        if last is None:
+            self.uniformValues[location] = mat.copy()
+        else:
+            np.copyto(last, mat)
+        upload(location, 1, gl.GL_FALSE, mat)
+
+    def setMat4(self, name, mat, lookThroughAttribs=True):
+        self._setMatrix(name, mat, 4, gl.glUniformMatrix4fv, lookThroughAttribs)
 
     def setMat3(self, name, mat, lookThroughAttribs=True):
-        self.use()
-        if mat.shape != (3, 3):
-            raise Exception("Projection Matrix must have 3x3 shape")
-        gl.glUniformMatrix3fv(self.getUniformLocation(name, lookThroughAttribs), 1, gl.GL_FALSE, mat.flatten("C"))
+        self._setMatrix(name, mat, 3, gl.glUniformMatrix3fv, lookThroughAttribs)
 
     def setMat2(self, name, mat, lookThroughAttribs=True):
+        self._setMatrix(name, mat, 2, gl.glUniformMatrix2fv, lookThroughAttribs)
+
+    def _setVector(self, name, vec, size, upload, lookThroughAttribs):
         self.use()
-        if mat.shape != (2, 2):
-            raise Exception("Projection Matrix must have 2x2 shape")
-        gl.glUniformMatrix2fv(self.getUniformLocation(name, lookThroughAttribs), 1, gl.GL_FALSE, mat.flatten("C"))
+        if vec.size != size:
+            raise Exception(f"Vector must have size {size}")
+        location = self.getUniformLocation(name, lookThroughAttribs)
+        if self._changed(location, tuple(np.asarray(vec, dtype=np.float32).ravel().tolist())):
+            upload(location, 1, vec)
 
     def setVec4(self, name, vec, lookThroughAttribs=True):
-        self.use()
-        if vec.size != 4:
-            raise Exception("Vector must have size 4")
-        gl.glUniform4fv(self.getUniformLocation(name, lookThroughAttribs), 1, vec)
+        self._setVector(name, vec, 4, gl.glUniform4fv, lookThroughAttribs)
 
     def setVec3(self, name, vec, lookThroughAttribs=True):
-        self.use()
-        if vec.size != 3:
-            raise Exception("Vector must have size 3")
-        gl.glUniform3fv(self.getUniformLocation(name, lookThroughAttribs), 1, vec)
+        self._setVector(name, vec, 3, gl.glUniform3fv, lookThroughAttribs)
 
     def setVec2(self, name, vec, lookThroughAttribs=True):
-        self.use()
-        if vec.size != 2:
-            raise Exception("Vector must have size 2")
-        gl.glUniform2fv(self.getUniformLocation(name, lookThroughAttribs), 1, vec)
+        self._setVector(name, vec, 2, gl.glUniform2fv, lookThroughAttribs)
 
     def setBool(self, name, value, lookThroughAttribs=True):
         self.use()
         if value not in (0, 1):
             raise Exception("bool only accept True/False/0/1")
-        gl.glUniform1i(self.getUniformLocation(name, lookThroughAttribs), int(value))
+        location = self.getUniformLocation(name, lookThroughAttribs)
+        if self._changed(location, int(value)):
+            gl.glUniform1i(location, int(value))
 
     def setInt(self, name, value, lookThroughAttribs=True):
         self.use()
         if value != int(value):
             raise Exception("set int only accept  integer")
-        gl.glUniform1i(self.getUniformLocation(name, lookThroughAttribs), int(value))
+        location = self.getUniformLocation(name, lookThroughAttribs)
+        if self._changed(location, int(value)):
+            gl.glUniform1i(location, int(value))
 
     def setFloat(self, name, value, lookThroughAttribs=True):
         self.use()
-        gl.glUniform1f(self.getUniformLocation(name, lookThroughAttribs), float(value))
+        location = self.getUniformLocation(name, lookThroughAttribs)
+        if self._changed(location, float(value)):
+            gl.glUniform1f(location, float(value))
@@ -0,0 +1,277 @@
+"""
+Instanced drawing of the primitive shapes of a Component tree.
+All shapes built from the same primitive and level of detail (same Shape.meshKey) are drawn by a single
+glDrawElementsInstanced call over the shared buffers of the mesh in MeshCache. Each shape's drawMat, which has its
+size folded in, and its color are streamed once per frame into a per-instance attribute buffer read by the
+instanced variant of GLProgram.
+
+Textured shapes, and anything that is not a Shape, are left to Component.draw. Shapes of creatures flagged culled by
+a FrustumCuller are left out of the instance data.
+
+The batches are filled once, then kept up to date from a StructureCursor, so a creature joining or
+leaving the tree only costs a walk of its own subtree.
+"""
+
+import numpy as np
+
+from FrustumCulling import FrustumCuller
+from GLBuffer import InstanceVBO
+from MeshCache import meshCache
+from TrackedComponents import StructureFollower, TrackedComponents
+
+INSTANCE_FLOATS = 19  # 16 for the column-major model matrix, 3 for the color
+
+
+class InstanceBatch:
+    """
+    Shared GPU mesh and per-instance data of all the shapes with one mesh key
+    """
+    key = None  # str: Shape.meshKey of the batched shapes
+    vao = None  # VAO: the shared mesh buffers and the instance buffer, laid out for the instanced program
+    ebo = None  # EBO: shared with every other user of the mesh key
+    instanceVbo = None  # InstanceVBO: model matrix and color of every instance
+    shapes = None  # TrackedComponents: batched shapes, with the index in owners of each one's creature as ownerIndex
+    data = None  # ndarray<float32> (capacity, INSTANCE_FLOATS): instance data uploaded every frame
+    owners = None  # list<Component>: distinct creatures the batched shapes belong to, whose culled flag applies
+    ownerIds = None  # dict<Component, int>: position of each creature in owners
+    ownerCounts = None  # list<int>: number of batched shapes of each creature in owners
+    drawnNum = 0  # int: instances drawn by the last draw()
+
+    def __init__(self, key, shaderProg, vertices, indices):
+        """
+        :param key: mesh key of the batched shapes
+        :type key: str
+        :param shaderProg: compiled instanced shader program
+        :type shaderProg: GLProgram
+        :param vertices: unscaled interleaved vertex data, 11 floats per vertex, uploaded unless already cached
+        :type vertices: numpy.ndarray
+        :param indices: triangle indices, uploaded unless already cached
+        :type indices: numpy.ndarray
+        """
+        self.key = key
+        self.clear()
+        self.vao, self.ebo = meshCache.getVao(key, shaderProg, vertices, indices)
+        self.instanceVbo = InstanceVBO()
+
+        # the cached VAO belongs to the instanced program alone, so the instance attributes can be added to it
+        self.vao.bind()
+        self.instanceVbo.setInstanceAttribPointer(shaderProg.getAttribLocation("instanceModelMat"),
+                                                  stride=INSTANCE_FLOATS, offset=0, attribSize=4, columns=4)
+        self.instanceVbo.setInstanceAttribPointer(shaderProg.getAttribLocation("instanceColor"),
+                                                  stride=INSTANCE_FLOATS, offset=16, attribSize=3)
+        self.vao.unbind()
+
+    def clear(self):
+        """ Stop drawing every shape """
+        self.shapes = TrackedComponents(ownerIndex=np.zeros(0, dtype=np.int64))
+        self.owners = []
+        self.ownerIds = {}
+        self.ownerCounts = []
+        self.data = np.zeros((0, INSTANCE_FLOATS), dtype=np.float32)
+
+    def add(self, components, owners):
+        """
+        :param components: shapes to draw from now on, with this batch's mesh key
+        :type components: list
+        :param owners: culling creature of each shape, None for shapes that are never culled
+        :type owners: list
+        """
+        ownerIndex = np.full(len(components), -1, dtype=np.int64)
+        for i, owner in enumerate(owners):
+            if owner is None:
+                continue
+            ownerId = self.ownerIds.get(owner)
+            if ownerId is None:
+                ownerId = self.ownerIds[owner] = len(self.owners)
+                self.owners.append(owner)
+                self.ownerCounts.append(0)
+            self.ownerCounts[ownerId] += 1
+            ownerIndex[i] = ownerId
+        self.shapes.extend(components, ownerIndex=ownerIndex)
+
+    def remove(self, component):
+        """
+        Stop drawing a shape
+
+        :type component: Shape
+        :return: creature of the shape, None if it had none
+        :rtype: Component
+        """
+        ownerId = int(self.shapes.columns["ownerIndex"][self.shapes.index[component]])
+        self.shapes.remove(component)
+        if ownerId == -1:
+            return None
+        owner = self.owners[ownerId]
+        self.ownerCounts[ownerId] -= 1
+        if self.ownerCounts[ownerId] == 0:
+            # the creature has no shape left here, the last creature takes its place
+            del self.ownerIds[owner]
+            lastId = len(self.owners) - 1
+            if ownerId != lastId:
+                movedOwner = self.owners[lastId]
+                self.owners[ownerId] = movedOwner
+                self.ownerIds[movedOwner] = ownerId
+                self.ownerCounts[ownerId] = self.ownerCounts[lastId]
+                ownerIndex = self.shapes.columns["ownerIndex"]
+                ownerIndex[ownerIndex == lastId] = ownerId
+            self.owners.pop()
+            self.ownerCounts.pop()
+        return owner
+
+    def visible(self):
+        """
+        :return: indices of the shapes whose creature is not culled, None if none is
+        :rtype: numpy.ndarray
+        """
+        culled = np.fromiter((owner.culled for owner in self.owners), dtype=bool, count=len(self.owners))
+        if not culled.any():
+            return None
+        # the extra entry, at index -1, stands for shapes without a creature
+        return np.flatnonzero(~np.append(culled, False)[self.shapes.columns["ownerIndex"]])
+
+    def draw(self):
+        self.drawnNum = 0
+        n = len(self.shapes)
+        if n == 0:
+            return
+        if len(self.data) < n:
+            self.data = np.zeros((2 * n, INSTANCE_FLOATS), dtype=np.float32)
+        rows = self.shapes.sceneRows()
+        visible = self.visible()
+        components = self.shapes.components
+        if visible is not None:
+            n = len(visible)
+            if n == 0:
+                return
+            components = [components[i] for i in visible.tolist()]
+            rows = rows[visible] if rows is not None else None
+        data = self.data[:n]
+        if rows is not None:
+            data[:, :16] = self.shapes.scene.drawWorld[rows].reshape(n, 16)
+        else:
+            data[:, :16] = np.stack([c.drawMat for c in components]).reshape(n, 16)
+        data[:, 16:] = [c.current_color for c in components]
+        self.instanceVbo.stream(data)
+        self.vao.bind()
+        self.ebo.drawInstanced(n)
+        self.vao.unbind()
+        self.drawnNum = n
+
+
+class InstancedRenderer(StructureFollower):
+    """
+    Draws every untextured Shape under root through instanced draw calls, one per mesh key. Call collect() after
+    turning a texture on or off.
+    """
+    shaderProg = None  # GLProgram: compiled with instanced=True
+    batches = None  # dict<str, InstanceBatch>
+    batchOf = None  # dict<Shape, InstanceBatch>: batch drawing each shape
+    drawCalls = 0  # int: instanced draw calls issued by the last draw()
+    instanceNum = 0  # int: shapes drawn by the last draw()
+
+    def __init__(self, shaderProg, root):
+        """
+        :param shaderProg: shader program compiled with instanced=True
+        :type shaderProg: GLProgram
+        :param root: every shape under this component is drawn by this renderer from now on
+        :type root: Component
+        """
+        if not shaderProg.instanced:
+            raise ValueError("InstancedRenderer needs an instanced GLProgram")
+        super().__init__(root)
+        self.shaderProg = shaderProg
+        self.batches = {}
+        self.batchOf = {}
+
+    @staticmethod
+    def instanceable(component):
+        meshKey = getattr(component, "meshKey", None)
+        return component.displayObj is not None and meshKey is not None and meshKey() is not None and \
+            not component.textureOn
+
+    def batch(self, component):
+        """
+        :return: the batch of component's mesh key, created on first use
+        :rtype: InstanceBatch
+        """
+        key = component.meshKey()
+        if key not in self.batches:
+            vertices, indices = component.geometry()
+            self.shaderProg.use()
+            self.batches[key] = InstanceBatch(key, self.shaderProg, vertices, indices)
+        return self.batches[key]
+
+    def clear(self):
+        for batch in self.batches.values():
+            batch.clear()
+        for component in self.batchOf:
+            component.instanced = False
+        self.batchOf = {}
+
+    def add(self, child, ancestors):
+        # each shape goes with the outermost creature above it, the one FrustumCuller flags
+        owner = None
+        for component in reversed(ancestors[1:]):
+            if FrustumCuller.cullable(component):
+                owner = component
+                break
+        groups = {}
+        stack = [(child, owner)]
+        while stack:
+            component, owner = stack.pop()
+            if owner is None and FrustumCuller.cullable(component):
+                owner = component
+            if self.instanceable(component):
+                if component not in self.batchOf:
+                    batch = self.batch(component)
+                    components, owners = groups.setdefault(batch, ([], []))
+                    components.append(component)
+                    owners.append(owner)
+                    self.batchOf[component] = batch
+                    component.instanced = True
+            else:
+                component.instanced = False
+            stack.extend((c, owner) for c in reversed(component.children))
+        for batch, (components, owners) in groups.items():
+            batch.add(components, owners)
+
+    def remove(self, child):
+        stack = [child]
+        while stack:
+            component = stack.pop()
+            batch = self.batchOf.pop(component, None)
+            if batch is not None:
+                batch.remove(component)
+                component.instanced = False
+            stack.extend(component.children)
+
+    def rekey(self, shapes):
+        """
+        Move shapes whose mesh key changed, such as after a level of detail switch, to the batch of their new key
+
+        :param shapes: shapes that may have changed mesh key
+        :type shapes: list
+        """
+        for shape in shapes:
+            batch = self.batchOf.get(shape)
+            if batch is None or batch.key == shape.meshKey():
+                continue
+            owner = batch.remove(shape)
+            batch = self.batch(shape)
+            batch.add([shape], [owner])
+            self.batchOf[shape] = batch
+
+    def draw(self):
+        """
+        Draw every batched shape with its current transform and color. Transforms must be up to date, draw after
+        update().
+        """
+        self.sync()
+        self.shaderProg.use()
+        self.drawCalls = 0
+        self.instanceNum = 0
+        for batch in self.batches.values():
+            batch.draw()
+            if batch.drawnNum:
+                self.drawCalls += 1
+                self.instanceNum += batch.drawnNum
@@ -0,0 +1,301 @@
+"""
+Vectorized creature interaction for one simulation step.
+Every creature in a CreatureStore is moved, bounced off the tank wall and checked against every other creature in
+a few batched NumPy passes, instead of each creature looping over all the others with temporary Points.
+
+The behavior follows the rules of the original per-creature stepForward:
+    * every RETARGET_FREQUENCY steps a creature picks a new random heading at SPEED
+    * a creature whose next position leaves the (spherical) tank is reflected about the wall normal
+    * a predator within CHASE_RADIUS_FACTOR * its bound_radius of a prey heads straight for it
+    * two creatures of the same species whose bounding spheres overlap bounce apart
+    * a prey whose bounding sphere overlaps a creature of another species gets eaten
+Each pair of creatures is visited once. When a predator sees several prey it chases the nearest one, and a
+creature touching several of its own kind reflects once about the sum of the contact normals.
+"""
+
+import numpy as np
+
+SPEED = 0.03
+RETARGET_FREQUENCY = 1000
+CHASE_RADIUS_FACTOR = 3
+PREDATOR_SPECIES = 1
+PREY_SPECIES = 2
+
+# upper bound on the number of pair distances held in memory at once
+BLOCK_ELEMENTS = 1 << 20
+
+
+def integrate(store, tank_dimensions, rng, count=None):
+    """
+    Pick new random headings, bounce off the tank wall and move every moving creature by its velocity.
+
+    :param store: creature state
+    :type store: CreatureStore
+    :param tank_dimensions: size of the tank along x, y and z; the wall is a sphere of the largest one
+    :type tank_dimensions: list
+    :param rng: random generator used for new headings
+    :type rng: numpy.random.Generator
+    :param count: only rows [0, count) are updated, defaults to every row in the store
+    :type count: int
+    :return: mask of the updated rows whose heading changed
+    :rtype: numpy.ndarray
+    """
+    n = store.count if count is None else count
+    positions = store.positions[:n]
+    velocities = store.velocities[:n]
+    moving = store.moving[:n]
+    counters = store.step_counters[:n]
+
+    counters += 1
+    turned = counters >= RETARGET_FREQUENCY
+    retargetNum = np.count_nonzero(turned)
+    if retargetNum:
+        direction = rng.random((retargetNum, 3)) - 0.5
+        norm = np.linalg.norm(direction, axis=1, keepdims=True)
+        velocities[turned] = direction / np.maximum(norm, 1e-12) * SPEED
+        moving[turned] = True
+        counters[turned] = 0
+
+    # Check collision with tank walls, considering the tank as a sphere centered at the origin
+    newPositions = positions + velocities
+    distance = np.linalg.norm(newPositions, axis=1)
+    hit = moving & (distance + store.radii[:n] > max(tank_dimensions) / 2) & (distance > 0)
+    if hit.any():
+        # reflect the velocity about the normal pointing back to the tank center
+        normal = -newPositions[hit] / distance[hit, None]
+        v = velocities[hit]
+        velocities[hit] = v - 2 * np.sum(normal * v, axis=1, keepdims=True) * normal
+        turned |= hit
+
+    positions[moving] += velocities[moving]
+    return turned
+
+
+def maxInteractionDistance(store, count=None):
+    """
+    The longest distance at which two creatures in store can affect each other
+
+    :rtype: float
+    """
+    n = store.count if count is None else count
+    if n == 0:
+        return 0.0
+    return float(store.radii[:n].max()) * max(CHASE_RADIUS_FACTOR, 2)
+
+
+def _cutoff(radiiA, radiiB):
+    # interaction range of a pair: touching, or a predator seeing its prey
+    reach = max(CHASE_RADIUS_FACTOR, 1)
+    return np.maximum(radiiA + radiiB, np.maximum(radiiA, radiiB) * reach)
+
+
+def nearbyPairs(store, count=None, owned=None, broadphase=None):
+    """
+    Find every pair of creatures close enough to interact.
+    Without a broadphase the pairwise distances are computed in blocks so that no more than BLOCK_ELEMENTS
+    distances are held at once. With one, only the candidate pairs it hands out are measured.
+
+    :param store: creature state
+    :type store: CreatureStore
+    :param count: rows [0, count) take part, defaults to every row in the store
+    :type count: int
+    :param owned: only pairs with at least one row below owned are returned, defaults to count
+    :type owned: int
+    :param broadphase: spatial hash over the rows, brought up to date with the current positions here
+    :type broadphase: SpatialHash
+    :return: arrays (i, j, distance) with i < j
+    :rtype: tuple
+    """
+    n = store.count if count is None else count
+    owned = n if owned is None else owned
+    positions = store.positions[:n]
+    radii = store.radii[:n]
+
+    if broadphase is not None:
+        broadphase.update(positions)
+        i, j = broadphase.candidatePairs()
+        mine = i < owned
+        i, j = i[mine], j[mine]
+        distance = np.linalg.norm(positions[i] - positions[j], axis=1)
+        close = distance < _cutoff(radii[i], radii[j])
+        return i[close], j[close], distance[close]
+
+    squared = np.einsum("ij,ij->i", positions, positions)
+
+    blockRows = max(1, BLOCK_ELEMENTS // max(n, 1))
+    pairsI = [np.zeros(0, dtype=np.intp)]
+    pairsJ = [np.zeros(0, dtype=np.intp)]
+    for start in range(0, owned, blockRows):
+        end = min(start + blockRows, owned)
+        # only columns after the block's first row can hold a pair (i, j) with i < j
+        # |p - q|^2 = |p|^2 + |q|^2 - 2 p.q, with the dot products done as one matrix product
+        d2 = squared[start:end, None] + squared[None, start:] - 2 * (positions[start:end] @ positions[start:].T)
+        cutoff = _cutoff(radii[start:end, None], radii[None, start:])
+        # pad the cutoff a little, the expanded form above loses some precision
+        close = d2 < cutoff * cutoff * 1.0001 + 1e-6
+        close &= np.arange(start, n)[None, :] > np.arange(start, end)[:, None]
+        i, j = np.nonzero(close)
+        pairsI.append(i + start)
+        pairsJ.append(j + start)
+    i = np.concatenate(pairsI)
+    j = np.concatenate(pairsJ)
+    # exact distances for the few candidates that are left
+    distance = np.linalg.norm(positions[i] - positions[j], axis=1)
+    return i, j, distance
+
+
+def interact(store, pairs, owned=None):
+    """
+    Classify close pairs as chase, bounce or eat by species, and apply the resulting velocity updates.
+    Rows at or above owned are only looked at, never changed, which lets a shard read its neighbors' creatures.
+
+    :param store: creature state
+    :type store: CreatureStore
+    :param pairs: arrays (i, j, distance) as returned by nearbyPairs
+    :type pairs: tuple
+    :param owned: rows [0, owned) are updated, defaults to every row in the store
+    :type owned: int
+    :return: mask of the updated rows whose heading changed, and the rows that got eaten
+    :rtype: tuple
+    """
+    owned = store.count if owned is None else owned
+    positions = store.positions
+    velocities = store.velocities
+    radii = store.radii
+    species = store.species
+    moving = store.moving
+    turned = np.zeros(owned, dtype=bool)
+
+    i, j, d = pairs
+    if len(i) == 0:
+        return turned, np.zeros(0, dtype=np.intp)
+    # look at every pair from both sides, then keep the side that is updated here
+    a = np.concatenate((i, j))
+    b = np.concatenate((j, i))
+    d = np.concatenate((d, d))
+    mine = a < owned
+    a, b, d = a[mine], b[mine], d[mine]
+    # a creature only reacts to its surroundings while it is moving
+    active = moving[a]
+    a, b, d = a[active], b[active], d[active]
+    sameSpecies = species[a] == species[b]
+    touching = d < radii[a] + radii[b]
+
+    # Predator-prey interaction: change direction to move toward the nearest prey
+    chase = (species[a] == PREDATOR_SPECIES) & (species[b] == PREY_SPECIES) & (d < CHASE_RADIUS_FACTOR * radii[a])
+    if chase.any():
+        hunter, prey, gap = a[chase], b[chase], d[chase]
+        order = np.lexsort((gap, hunter))
+        hunter, firsts = np.unique(hunter[order], return_index=True)
+        prey = prey[order][firsts]
+        direction = positions[prey] - positions[hunter]
+        norm = np.linalg.norm(direction, axis=1, keepdims=True)
+        velocities[hunter] = direction / np.maximum(norm, 1e-12) * SPEED
+        turned[hunter] = True
+
+    # Collision between the same species: reflect about the sum of the contact normals
+    bounce = touching & sameSpecies & moving[b]
+    if bounce.any():
+        src, dst, gap = a[bounce], b[bounce], d[bounce]
+        contact = (positions[dst] - positions[src]) / np.maximum(gap, 1e-12)[:, None]
+        normal = np.zeros((owned, 3), dtype=positions.dtype)
+        np.add.at(normal, src, contact)
+        rows = np.unique(src)
+        normal = normal[rows]
+        norm = np.linalg.norm(normal, axis=1, keepdims=True)
+        keep = norm[:, 0] > 1e-12
+        rows, normal = rows[keep], normal[keep] / norm[keep]
+        v = velocities[rows]
+        velocities[rows] = v - 2 * np.sum(normal * v, axis=1, keepdims=True) * normal
+        turned[rows] = True
+
+    # Predator-prey collision: the prey gets eaten
+    eat = touching & ~sameSpecies & (species[a] == PREY_SPECIES)
+    eaten = np.unique(a[eat])
+    store.alive[eaten] = False
+    return turned, eaten
+
+
+def stepForward(store, tank_dimensions, rng, broadphase=None):
+    """
+    Take one simulation step for every creature in store
+
+    :param store: creature state
+    :type store: CreatureStore
+    :param tank_dimensions: size of the tank along x, y and z
+    :type tank_dimensions: list
+    :param rng: random generator used for new headings
+    :type rng: numpy.random.Generator
+    :param broadphase: spatial hash used to find close pairs, all pairs are checked without one
+    :type broadphase: SpatialHash
+    :return: mask of rows whose heading changed, and the rows that got eaten
+    :rtype: tuple
+    """
+    turned = integrate(store, tank_dimensions, rng)
+    bounced, eaten = interact(store, nearbyPairs(store, broadphase=broadphase))
+    return turned | bounced, eaten
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from Point import Point
+    from CreatureStore import CreatureStore
+
+    class Creature:
+        """ the per-object state the original stepForward loops worked on """
+        def __init__(self, pos, speed, radius, species_id):
+            self.currentPos = Point(pos)
+            self.translation_speed = Point(speed)
+            self.bound_radius = radius
+            self.species_id = species_id
+
+    def loopStepForward(creatures, tank_dimensions):
+        # the nested loops of Linkage.stepForward / Linkage2.stepForward, without orientation and printing
+        for c in creatures:
+            new_position = c.currentPos + c.translation_speed
+            tank_center = Point((0, 0, 0))
+            if new_position.distance(tank_center) + c.bound_radius > max(tank_dimensions) / 2:
+                n = (tank_center - new_position).normalize()
+                c.translation_speed -= 2 * n.dot(c.translation_speed) * n
+            c.currentPos += c.translation_speed
+            for other in creatures:
+                if other != c:
+                    d = c.currentPos.distance(other.currentPos)
+                    if c.species_id == PREDATOR_SPECIES and d < 3 * c.bound_radius and other.species_id == PREY_SPECIES:
+                        c.translation_speed = (other.currentPos - c.currentPos).normalize() * SPEED
+                    if d < c.bound_radius + other.bound_radius:
+                        if c.species_id == other.species_id:
+                            n = (other.currentPos - c.currentPos).normalize()
+                            c.translation_speed -= 2 * n.dot(c.translation_speed) * n
+                            other.translation_speed -= 2 * n.dot(other.translation_speed) * n
+
+    sizes = [int(a) for a in sys.argv[1:]] or [100, 300, 1000]
+    tank = [12, 12, 12]
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        pos = (rng.random((n, 3)) - 0.5) * 8
+        vel = (rng.random((n, 3)) - 0.5) * SPEED
+        radius = np.where(np.arange(n) % 4 == 0, 0.5, 0.2)
+        species = np.where(np.arange(n) % 4 == 0, PREDATOR_SPECIES, PREY_SPECIES)
+
+        creatures = [Creature(pos[k], vel[k], radius[k], species[k]) for k in range(n)]
+        t1 = time.time()
+        loopStepForward(creatures, tank)
+        loopTime = time.time() - t1
+
+        store = CreatureStore(n)
+        for k in range(n):
+            row = store.allocate(None)
+            store.positions[row] = pos[k]
+            store.velocities[row] = vel[k]
+            store.radii[row] = radius[k]
+            store.species[row] = species[k]
+            store.moving[row] = True
+        repeat = 20
+        t1 = time.time()
+        for _ in range(repeat):
+            stepForward(store, tank, rng)
+        vectorTime = (time.time() - t1) / repeat
+        print(f"N={n}: loops {loopTime * 1000:.1f}ms/step, vectorized {vectorTime * 1000:.2f}ms/step, "
+              f"speedup {loopTime / vectorTime:.0f}x")
@@ -0,0 +1,130 @@
+"""
+Distance-based level of detail for the primitive shapes of a Component tree.
+Every shape whose primitive ships a low poly variant (Shape.pathnameLP) is measured each frame by the diameter, in
+pixels, of its bounding sphere once projected on screen. Shapes shrinking below lowBelow pixels switch to the low
+poly mesh, and only switch back once they grow above highAbove pixels, so a shape hovering around one threshold
+does not pop back and forth between the two meshes. Switching only changes which shared mesh the shape is bound to,
+see Shape.setLowPoly.
+
+The shapes are followed through structure changes, see TrackedComponents.
+"""
+
+import math
+
+import numpy as np
+
+from TrackedComponents import StructureFollower, TrackedComponents
+
+
+class LevelOfDetail(StructureFollower):
+    """
+    Picks the level of detail of every shape with a low poly variant under root
+    """
+    lowBelow = 32  # float: projected diameter, in pixels, below which a shape switches to its low poly variant
+    highAbove = 40  # float: projected diameter, in pixels, above which a shape switches back to its full mesh
+    # shapes with a low poly variant, with the columns radii, the bounding sphere radius of each shape's unscaled
+    # primitive, and lowPoly, the current level of detail of each shape
+    shapes = None  # TrackedComponents
+    meshRadii = {}  # dict<type, float>: bounding sphere radius of each primitive, shared by all instances
+    switches = 0  # int: shapes that changed level of detail in the last update()
+    switched = None  # list<Shape>: the shapes that changed level of detail in the last update()
+
+    def __init__(self, root, lowBelow=32, highAbove=40):
+        """
+        :param root: every shape with a low poly variant under this component is managed from now on
+        :type root: Component
+        :param lowBelow: projected diameter, in pixels, below which shapes switch to their low poly variant
+        :type lowBelow: float
+        :param highAbove: projected diameter, in pixels, above which shapes switch back to their full mesh
+        :type highAbove: float
+        """
+        super(LevelOfDetail, self).__init__(root)
+        if lowBelow > highAbove:
+            raise ValueError("lowBelow should not be larger than highAbove")
+        self.lowBelow = lowBelow
+        self.highAbove = highAbove
+        self.switched = []
+        self.clear()
+
+    @classmethod
+    def meshRadius(cls, shapeClass):
+        """
+        :return: radius of the bounding sphere of both variants of a primitive, centered at its origin
+        :rtype: float
+        """
+        if shapeClass not in cls.meshRadii:
+            radius = 0.0
+            for vertices in (shapeClass.vertices, shapeClass.verticesLP):
+                positions = np.asarray(vertices).reshape(-1, 11)[:, :3]
+                radius = max(radius, float(np.linalg.norm(positions, axis=1).max()))
+            cls.meshRadii[shapeClass] = radius
+        return cls.meshRadii[shapeClass]
+
+    def clear(self):
+        self.shapes = TrackedComponents(radii=np.zeros(0), lowPoly=np.zeros(0, dtype=bool))
+
+    def add(self, child, ancestors):
+        shapes = []
+        stack = [child]
+        while stack:
+            component = stack.pop()
+            if getattr(component, "pathnameLP", None) is not None and component not in self.shapes:
+                shapes.append(component)
+            stack.extend(component.children)
+        self.shapes.extend(shapes, radii=np.array([self.meshRadius(type(s)) for s in shapes], dtype=np.float64),
+                           lowPoly=np.array([s.lowPoly for s in shapes], dtype=bool))
+
+    def remove(self, child):
+        stack = [child]
+        while stack:
+            component = stack.pop()
+            self.shapes.remove(component)
+            stack.extend(component.children)
+
+    def projectedSizes(self, cameraPos, fov, viewportHeight):
+        """
+        :param cameraPos: camera position in world space
+        :type cameraPos: list
+        :param fov: vertical field of view, in degrees
+        :type fov: float
+        :param viewportHeight: viewport height, in pixels
+        :type viewportHeight: int
+        :return: diameter in pixels of the bounding sphere of every shape, as seen from cameraPos
+        :rtype: numpy.ndarray
+        """
+        rows = self.shapes.sceneRows()
+        if rows is not None:
+            mats = self.shapes.scene.drawWorld[rows]
+        else:
+            mats = np.stack([s.drawMat for s in self.shapes.components])
+        # the first three rows of drawMat are the world axes of the mesh, with its size and any parent scaling
+        scales = np.linalg.norm(mats[:, :3, :3], axis=2).max(axis=1)
+        distances = np.linalg.norm(mats[:, 3, :3] - np.asarray(cameraPos), axis=1)
+        pixelsPerUnit = viewportHeight / math.tan(math.radians(fov) / 2)  # diameter of a unit sphere at unit distance
+        return self.shapes.columns["radii"] * scales / np.maximum(distances, 1e-6) * pixelsPerUnit
+
+    def update(self, cameraPos, fov, viewportHeight):
+        """
+        Switch the shapes that got too small or large on screen to their other level of detail. Transforms must be
+        up to date, call after update().
+
+        :return: number of shapes that switched, anyone batching shapes by mesh key must regroup the shapes in
+            switched if non zero
+        :rtype: int
+        """
+        self.sync()
+        self.switches = 0
+        self.switched = []
+        if not self.shapes:
+            return 0
+        sizes = self.projectedSizes(cameraPos, fov, viewportHeight)
+        # between the two thresholds every shape keeps the level of detail it has
+        current = self.shapes.columns["lowPoly"]
+        lowPoly = np.where(current, sizes < self.highAbove, sizes < self.lowBelow)
+        for i in np.flatnonzero(lowPoly != current).tolist():
+            shape = self.shapes.components[i]
+            shape.setLowPoly(lowPoly[i])
+            self.switched.append(shape)
+            self.switches += 1
+        self.shapes.columns["lowPoly"] = lowPoly
+        return self.switches
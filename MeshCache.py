@@ -0,0 +1,70 @@
+"""
+Cache of the GPU buffers of shared meshes.
+Geometry is keyed by asset and level of detail only: the vertex and index buffers of a key are uploaded once and
+shared by every component drawing that mesh, whatever its size or color. A VAO records the attribute layout of one
+shader program, so each (key, program) pair gets its own VAO over the same shared buffers.
+
+GL objects belong to one context; call clear() whenever the context is created again.
+"""
+
+from GLBuffer import VAO, VBO, EBO
+
+
+class MeshCache:
+    """
+    Shared VBO/EBO per mesh key, and a VAO per mesh key and shader program
+    """
+    buffers = None  # dict<str, tuple<VBO, EBO>>
+    vaos = None  # dict<tuple<str, GLProgram>, VAO>
+
+    def __init__(self):
+        self.buffers = {}
+        self.vaos = {}
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def clear(self):
+        """ forget every cached GL object, for use after the GL context changed """
+        self.buffers = {}
+        self.vaos = {}
+
+    def getVao(self, key, shaderProg, vertices, indices):
+        """
+        :param key: mesh key, usually the asset path and level of detail
+        :type key: str
+        :param shaderProg: compiled shader program the VAO is laid out for
+        :type shaderProg: GLProgram
+        :param vertices: interleaved vertex data, 11 floats per vertex, uploaded the first time key is seen
+        :type vertices: numpy.ndarray
+        :param indices: triangle indices, uploaded the first time key is seen
+        :type indices: numpy.ndarray
+        :return: a VAO with the shared buffers of key bound to the vertex attributes of shaderProg, and the EBO
+            of key
+        :rtype: tuple
+        """
+        if (key, shaderProg) not in self.vaos:
+            shaderProg.use()
+            vao = VAO()
+            vao.bind()
+            if key not in self.buffers:
+                # uploaded with the new VAO bound: core profile contexts need one, and binding the EBO must not
+                # change the element array of whatever VAO was bound before
+                vbo = VBO()
+                ebo = EBO()
+                vbo.setBuffer(vertices, 11)
+                ebo.setBuffer(indices)
+                self.buffers[key] = (vbo, ebo)
+            vbo, ebo = self.buffers[key]
+            ebo.bind()
+            vbo.setAttribPointer(shaderProg.getAttribLocation("vertexPos"), stride=11, offset=0, attribSize=3)
+            vbo.setAttribPointer(shaderProg.getAttribLocation("vertexNormal"), stride=11, offset=3, attribSize=3)
+            vbo.setAttribPointer(shaderProg.getAttribLocation("vertexColor"), stride=11, offset=6, attribSize=3)
+            vbo.setAttribPointer(shaderProg.getAttribLocation("vertexTexture"), stride=11, offset=9, attribSize=2)
+            vao.unbind()
+            self.vaos[key, shaderProg] = vao
+        return self.vaos[key, shaderProg], self.buffers[key][1]
+
+
+# the cache used by DisplayableMesh and InstancedRenderer
+meshCache = MeshCache()
@@ -7,16 +7,13 @@ First version at 09/28/2021
 
 Modified by Daniel Scrivener 08/2022
 """
-import random
-import numpy as np
 from Component import Component
 from Shapes import Cube
-from Shapes import Cylinder
 from Shapes import Sphere
 from Point import Point
-from Quaternion import Quaternion
 import ColorType as Ct
 from EnvironmentObject import EnvironmentObject
+from Flocking import FlockParams
 
 try:
     import OpenGL
@@ -56,14 +53,12 @@ except ImportError:
 #         3. The predator and prey should have distinguishable different colors.
 #         4. You are welcome to reuse your PA2 creature in this assignment.
 
-class Linkage(Component, EnvironmentObject):
+class Linkage(EnvironmentObject, Component):
     """
     A Linkage with animation enabled and is defined as an object in environment
     """
     components = None
     rotation_speed = None
-    translation_speed = None
-    update_speed_frequency = 1000  # Adjust this value based on desired frequency
 
     def __init__(self, parent, position, shaderProg):
         super(Linkage, self).__init__(position)
@@ -102,9 +97,6 @@ class Linkage(Component, EnvironmentObject):
         self.bound_radius = 0.1 * 5
         self.species_id = 1        
         
-        # Counter to control the frequency of speed updates
-        self.update_speed_counter = 0
-        
 
     def animationUpdate(self):
         ##### TODO 2: Animate your creature!
@@ -136,131 +128,27 @@ class Linkage(Component, EnvironmentObject):
             if comp.wAngle in comp.wRange:
                 self.rotation_speed[i][2] *= -1
         #self.vAngle = (self.vAngle + 3) % 360
-        
-        self.update()
-        
 
         ##### BONUS 6: Group behaviors
         # Requirements:
         #   1. Add at least 5 creatures to the vivarium and make it possible for creatures to engage in group behaviors,
         #   for instance flocking together. This can be achieved by implementing the
         #   [Boids animation algorithms](http://www.red3d.com/cwr/boids/) of Craig Reynolds.
+        # Flocking is steered for the whole tank at once by Flocking.steer, which Vivarium.animationUpdate runs once
+        # per step for every species that declares flock_params.
 
-        self.update()
-
-    def stepForward(self, components, tank_dimensions, vivarium):
-        ##### TODO 3: Interact with the environment
-        # Requirements:
-        #   1. Your creatures should always stay within the fixed size 3D "tank". You should do collision detection
-        #   between the creature and the tank walls. When it hits the tank walls, it should turn and change direction to stay
-        #   within the tank.
-        #   2. Your creatures should have a prey/predator relationship. For example, you could have a bug being chased
-        #   by a spider, or a fish eluding a shark. This means your creature should react to other creatures in the tank.
-        #       1. Use potential functions to change its direction based on other creatures’ location, their
-        #       inter-creature distances, and their current configuration.
-        #       2. You should detect collisions between creatures.
-        #           1. Predator-prey collision: The prey should disappear (get eaten) from the tank.
-        #           2. Collision between the same species: They should bounce apart from each other. You can use a
-        #           reflection vector about a plane to decide the after-collision direction.
-        #       3. You are welcome to use bounding spheres for collision detection.   
-                
-        # Increment the counter on each step
-        self.update_speed_counter += 1
+    ##### TODO 3: Interact with the environment
+    # Moving, bouncing off the tank walls, chasing, bouncing apart and eating are done for every creature at once:
+    # once per step, Vivarium.animationUpdate runs Interaction.integrate, then Interaction.nearbyPairs and
+    # Interaction.interact.
 
-        # Update speed when the counter reaches the desired frequency
-        if self.update_speed_counter >= self.update_speed_frequency:
-            # Get a new random direction
-            new_direction = Point([random.random()-0.5 for _ in range(3)])
-            new_direction.normalize()
-            
-            # Set the translation speed based on the new direction
-            self.translation_speed = new_direction * 0.03
-            
-            # Use the rotateDirection function to set the new orientation
-            self.rotateDirection(new_direction)               
-            
-            # Reset the counter
-            self.update_speed_counter = 0
-             
-        if self.currentPos and self.translation_speed is not None:
-            # Update translation
-            new_position = self.currentPos + self.translation_speed
-                
-            # Check collision with tank walls
-            tank_center = Point((0, 0, 0))
-            
-            # Calculate distance to tank center
-            distance_to_tank_center = new_position.distance(tank_center)
-            
-            # Check for collision with tank walls (considering it as a sphere)
-            if distance_to_tank_center + self.bound_radius > max(tank_dimensions) / 2:
-                # Calculate the reflection direction based on the normal vector at the collision point
-                reflection_direction = (tank_center - new_position).normalize()
-            
-                # Reverse the direction component that caused the collision
-                self.translation_speed -= 2 * reflection_direction.dot(self.translation_speed) * reflection_direction
-            
-                # Use the reflected direction to update the orientation
-                self.rotateDirection(self.translation_speed)
-                
-            # Update translation based on collision resolution
-            self.currentPos += self.translation_speed 
-            
-            # Check for collisions with other creatures in the env_obj_list
-            for other_creature in self.env_obj_list:                
-                if other_creature != self:
-                    if isinstance(other_creature, EnvironmentObject):
-                        distance_to_other = self.currentPos.distance(other_creature.currentPos)
-                        # Potential functions to check for nearby prey
-                        if distance_to_other < (3 * self.bound_radius) and other_creature.species_id == 2:
-                            # Predator-prey interaction: Change direction to move toward the prey
-                            direction_to_prey = (other_creature.currentPos - self.currentPos).normalize()
-                            print("Chasing the prey!")
-                            # Update translation speed and orientation to move toward the prey
-                            self.translation_speed = direction_to_prey * 0.03
-                            self.rotateDirection(direction_to_prey)                    
-                            
-                        
-                        if distance_to_other < self.bound_radius + other_creature.bound_radius:
-                            # Handle collision response based on the relationship (predator-prey or same species)
-                            if self.species_id == other_creature.species_id:
-                                # Bounce apart from each other
-                                # Calculate the reflection direction based on the normal vector at the collision point
-                                reflection_direction = (other_creature.currentPos - self.currentPos).normalize()
-                    
-                                # Reverse the direction component that caused the collision for both creatures
-                                self.translation_speed -= 2 * reflection_direction.dot(self.translation_speed) * reflection_direction
-                                other_creature.translation_speed -= 2 * reflection_direction.dot(other_creature.translation_speed) * reflection_direction
-                    
-                                # Use the reflected direction to update the orientation for both creatures
-                                self.rotateDirection(self.translation_speed)
-                                other_creature.rotateDirection(other_creature.translation_speed)
-                                print("I bounced")
-                            else:
-                                # Predator-prey collision: The prey should disappear (get eaten)
-                                pass    
-            
-        '''
-        # Check collision with tank walls
-        for i in range(3):
-            if new_position[i] < -tank_dimensions[i] / 2 or new_position[i] > tank_dimensions[i] / 2:
-                # Reverse the direction component that caused the collision
-                self.translation_speed = Point([-coord if i == j else coord for j, coord in enumerate(self.translation_speed.coords)])
-                
-                # Use the reflected direction to update the orientation
-                self.rotateDirection(self.translation_speed)
-        '''     
-        
-        self.update()
-    
-class Linkage2(Component, EnvironmentObject):
+class Linkage2(EnvironmentObject, Component):
     """
     A Linkage with animation enabled and is defined as an object in environment
     """
     components = None
     rotation_speed = None
-    translation_speed = None
-    update_speed_frequency = 1000  # Adjust this value based on desired frequency
+    flock_params = FlockParams()
 
     def __init__(self, parent, position, shaderProg):
         super(Linkage2, self).__init__(position)
@@ -287,10 +175,6 @@ class Linkage2(Component, EnvironmentObject):
         self.bound_radius = 0.1 * 2
         self.species_id = 2
         
-        # Append the current instance to the env_obj_list
-        self.env_obj_list.append(self)        
-        # Counter to control the frequency of speed updates
-        self.update_speed_counter = 0
         # Initialize slerp_frame_counter
         self.slerp_frame_counter = 0
         # Frames
@@ -328,127 +212,11 @@ class Linkage2(Component, EnvironmentObject):
             if comp.wAngle in comp.wRange:
                 self.rotation_speed[i][2] *= -1
         #self.vAngle = (self.vAngle + 3) % 360
-        
-        self.update()
-
-    def stepForward(self, components, tank_dimensions, vivarium):
-        ##### TODO 3: Interact with the environment
-        # Requirements:
-        #   1. Your creatures should always stay within the fixed size 3D "tank". You should do collision detection
-        #   between the creature and the tank walls. When it hits the tank walls, it should turn and change direction to stay
-        #   within the tank.
-        #   2. Your creatures should have a prey/predator relationship. For example, you could have a bug being chased
-        #   by a spider, or a fish eluding a shark. This means your creature should react to other creatures in the tank.
-        #       1. Use potential functions to change its direction based on other creatures’ location, their
-        #       inter-creature distances, and their current configuration.
-        #       2. You should detect collisions between creatures.
-        #           1. Predator-prey collision: The prey should disappear (get eaten) from the tank.
-        #           2. Collision between the same species: They should bounce apart from each other. You can use a
-        #           reflection vector about a plane to decide the after-collision direction.
-        #       3. You are welcome to use bounding spheres for collision detection.   
-        
-        # Increment the counter on each step
-        self.update_speed_counter += 1
 
-        # Update speed when the counter reaches the desired frequency
-        if self.update_speed_counter >= self.update_speed_frequency:
-            # Get a new random direction
-            new_direction = Point([random.random()-0.5 for _ in range(3)])
-            new_direction.normalize()
-            
-            # Set the translation speed based on the new direction
-            self.translation_speed = new_direction * 0.03
-            
-            # Use the rotateDirection function to set the new orientation
-            self.rotateDirection(new_direction)               
-            
-            # Reset the counter
-            self.update_speed_counter = 0
-             
-        if self.currentPos and self.translation_speed is not None:
-            # Update translation
-            new_position = self.currentPos + self.translation_speed
-        
-            # Check collision with tank walls
-            tank_center = Point((0, 0, 0))  # Assuming the tank is centered at the origin
-            
-            # Calculate distance to tank center
-            distance_to_tank_center = new_position.distance(tank_center)
-            
-            # Check for collision with tank walls (considering it as a sphere)
-            if distance_to_tank_center + self.bound_radius > max(tank_dimensions) / 2:
-                # Calculate the reflection direction based on the normal vector at the collision point
-                reflection_direction = (tank_center - new_position).normalize()
-            
-                # Reverse the direction component that caused the collision
-                self.translation_speed -= 2 * reflection_direction.dot(self.translation_speed) * reflection_direction
-            
-                # Use the reflected direction to update the orientation
-                self.rotateDirection(self.translation_speed)
-        
-            # Update translation based on collision resolution
-            self.currentPos += self.translation_speed
-        
-            # Check for collisions with other creatures in the env_obj_list
-            for other_creature in self.env_obj_list:
-                if other_creature != self:
-                    if isinstance(other_creature, EnvironmentObject):
-                        distance_to_other = self.currentPos.distance(other_creature.currentPos)
-                        # Check for collision with other creatures (considering bounding spheres)
-                        if distance_to_other < self.bound_radius + other_creature.bound_radius:
-                            # Handle collision response based on the relationship (predator-prey or same species)
-                            if self.species_id == other_creature.species_id:
-                                # Bounce apart from each other
-                                # Calculate the reflection direction based on the normal vector at the collision point
-                                reflection_direction = (other_creature.currentPos - self.currentPos).normalize()
-                    
-                                # Reverse the direction component that caused the collision for both creatures
-                                self.translation_speed -= 2 * reflection_direction.dot(self.translation_speed) * reflection_direction
-                                other_creature.translation_speed -= 2 * reflection_direction.dot(other_creature.translation_speed) * reflection_direction
-                    
-                                # Use the reflected direction to update the orientation for both creatures
-                                self.rotateDirection(self.translation_speed)
-                                other_creature.rotateDirection(other_creature.translation_speed)
-                                print("I bounced")
-                            else:
-                                # Predator-prey collision: The prey should disappear (get eaten)
-                                self.env_obj_list.remove(self)
-                                print("i got eaten")
-        
-            '''
-            # Check for interactions with other creatures in the vivarium
-            for creature in self.components:
-                if creature != self and isinstance(creature, EnvironmentObject):
-                    distance = self.currentPos.distance(creature.currentPos)
-                    print("Distance:", distance)
-                    print("Bounding Radii:", self.bound_radius, creature.bound_radius)
-                    if distance < self.bound_radius + creature.bound_radius:
-                        # Handle interactions between creatures (e.g., bouncing off or predator-prey relationship)
-                        relative_position = creature.currentPos - self.currentPos
-                        relative_distance = relative_position.norm()
-                        print("i got here")
-                        
-                        # Potential function to determine the direction based on relative position
-                        potential_direction = relative_position.normalize() * (1.0 / relative_distance)
-                        
-                        # Check if it's the same species
-                        if self.species_id == creature.species_id:
-                            # Collision between the same species: Bounce apart
-                            # Use a reflection vector about a plane to decide the after-collision direction
-                            reflection_direction = relative_position - 2 * relative_position.dot(potential_direction) * potential_direction
-                            self.translation_speed += reflection_direction * 0.03
-                            print("i tried to bounce")
-                        else:
-                            # Predator-prey relationship
-                            # The prey should disappear (get eaten) from the tank
-                            self.creatures_to_remove.append(creature)
-                            print("i got eaten")
-                            
-                        # Update translation based on collision resolution
-                        self.currentPos += self.translation_speed
-            '''
-                    
-        self.update()
+    ##### TODO 3: Interact with the environment
+    # Moving, bouncing off the tank walls, chasing, bouncing apart and eating are done for every creature at once:
+    # once per step, Vivarium.animationUpdate runs Interaction.integrate, then Interaction.nearbyPairs and
+    # Interaction.interact.
 
 class ModelArm(Component):
     """
@@ -7,16 +7,19 @@ Daniel Scrivener 08/2022
 from Displayable import Displayable
 from Component import Component
 from GLBuffer import VAO, VBO, lineEBO
+from DisplayableMesh import interleaveVertices, transformVertices
 import numpy as np
 import ColorType
-from collada import *
 
 class Tank(Component):
 
     def __init__(self, position, shaderProg, scale):
         self.species_id = -1
         self.default_color = ColorType.PINK
-        self.mesh = DisplayableTank(shaderProg, scale, color=ColorType.PINK)
+        # without a shader program the tank is only a grouping node for headless simulation
+        self.mesh = None
+        if shaderProg is not None:
+            self.mesh = DisplayableTank(shaderProg, scale, color=ColorType.PINK)
         super(Tank, self).__init__(position, self.mesh)
 
 class DisplayableTank(Displayable):
@@ -44,18 +47,9 @@ class DisplayableTank(Displayable):
         self.vbo = VBO()  # vbo can only be initiate with glProgram activated
         self.ebo = lineEBO()
 
-        # construct vertex list
-        
-        self.vertices = np.array([
-            -scale[0] / 2, -scale[1] / 2, -scale[2] / 2, 0, 0, 0, *self.defaultColor, 0, 0,
-            -scale[0] / 2, -scale[1] / 2, scale[2] / 2, 0, 0, 0, *self.defaultColor, 0, 0,
-            -scale[0] / 2, scale[1] / 2, -scale[2] / 2, 0, 0, 0, *self.defaultColor, 0, 0,
-            -scale[0] / 2, scale[1] / 2, scale[2] / 2, 0, 0, 0, *self.defaultColor, 0, 0,
-            scale[0] / 2, -scale[1] / 2, -scale[2] / 2, 0, 0, 0, *self.defaultColor, 0, 0,
-            scale[0] / 2, -scale[1] / 2, scale[2] / 2, 0, 0, 0, *self.defaultColor, 0, 0,
-            scale[0] / 2, scale[1] / 2, -scale[2] / 2, 0, 0, 0, *self.defaultColor, 0, 0,
-            scale[0] / 2, scale[1] / 2, scale[2] / 2, 0, 0, 0, *self.defaultColor, 0, 0,
-        ])
+        # construct vertex list: the eight corners of a unit cube, scaled to the tank
+        corners = np.array([(x, y, z) for x in (-0.5, 0.5) for y in (-0.5, 0.5) for z in (-0.5, 0.5)])
+        self.vertices = transformVertices(interleaveVertices(corners), scale, self.defaultColor)
 
         
         # construct indices
@@ -82,6 +76,10 @@ class DisplayableTank(Displayable):
         self.ebo.draw()
         self.vao.unbind()
 
+    def drawBound(self):
+        """ draw with self.vao already bound, for callers drawing many meshes that share it """
+        self.ebo.draw()
+
     def initialize(self):
         """
         Remember to bind VAO before this initialization. If VAO is not bind, program might throw an error
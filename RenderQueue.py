@@ -0,0 +1,107 @@
+"""
+Render queue decoupling scene traversal from GL submission.
+The Component tree is walked once to collect a draw item for every component with something to draw, the items
+are sorted by (shader program, VAO, texture, depth) so that consecutive draws share as much GL state as possible,
+with the draws of one state ordered front to back so the depth test rejects hidden fragments early, and the
+sorted items are then submitted in one loop that only touches the state that changes from one item to the next.
+
+Components drawn by an InstancedRenderer are skipped, and so are subtrees culled by a FrustumCuller.
+"""
+
+import numpy as np
+
+from Displayable import Displayable
+from GLBuffer import Texture
+
+
+class RenderQueue:
+    """
+    Draw items of one frame, collected from a Component tree
+    """
+    items = None  # list<tuple>: (program rank, VAO name, texture name, depth, program, component) of every draw
+    programRanks = None  # dict<GLProgram, int>: sort rank of every program, in order of first use
+    drawCalls = 0  # int: draws submitted by the last execute()
+    vaoBinds = 0  # int: VAO binds done by the last execute()
+
+    def __init__(self):
+        self.items = []
+        self.programRanks = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def clear(self):
+        self.items = []
+
+    def collect(self, root, shaderProg, cameraPos=None):
+        """
+        Queue a draw for every displayable component under root, replacing what was queued before
+
+        :param root: top of the tree to draw, with up to date transforms
+        :type root: Component
+        :param shaderProg: program to draw the components with
+        :type shaderProg: GLProgram
+        :param cameraPos: camera position in world space, for the front to back order. Depth is ignored if None.
+        :type cameraPos: list
+        """
+        components = []
+        stack = [root]
+        while stack:
+            component = stack.pop()
+            if component.culled:
+                continue
+            if not component.instanced and isinstance(component.displayObj, Displayable):
+                components.append(component)
+            stack.extend(component.children)
+
+        self.items = []
+        if not components:
+            return
+        if cameraPos is None:
+            depths = [0.0] * len(components)
+        else:
+            # the last row of drawMat holds the translation of the world transform
+            origins = np.array([c.drawMat[3, :3] for c in components])
+            depths = np.linalg.norm(origins - np.asarray(cameraPos), axis=1).tolist()
+        rank = self.programRanks.setdefault(shaderProg, len(self.programRanks))
+        for component, depth in zip(components, depths):
+            vao = getattr(component.displayObj, "vao", None)
+            texture = component.texture.textureName if component.textureOn else 0
+            self.items.append((rank, 0 if vao is None else vao.vao, texture, depth, shaderProg, component))
+
+    def sort(self):
+        """ order the queued draws by program, then VAO, then texture, then front to back """
+        self.items.sort(key=lambda item: item[:4])
+
+    def execute(self):
+        """
+        Submit every queued draw in order. Displayables offering drawBound() are drawn with their VAO bound once
+        for a whole run of items sharing it.
+        """
+        self.drawCalls = 0
+        self.vaoBinds = 0
+        boundVao = None
+        for rank, vaoName, textureName, depth, shaderProg, component in self.items:
+            shaderProg.setMat4("modelMat", component.drawMat)
+            shaderProg.setVec3("currentColor", component.current_color)
+            if component.textureOn:
+                component.texture.bind(shaderProg)
+            else:
+                Texture.unbind(shaderProg)
+            displayObj = component.displayObj
+            drawBound = getattr(displayObj, "drawBound", None)
+            if drawBound is None:
+                # draws that bind their own VAO leave none bound
+                if boundVao is not None:
+                    boundVao.unbind()
+                    boundVao = None
+                displayObj.draw()
+            else:
+                if boundVao is not displayObj.vao:
+                    displayObj.vao.bind()
+                    boundVao = displayObj.vao
+                    self.vaoBinds += 1
+                drawBound()
+            self.drawCalls += 1
+        if boundVao is not None:
+            boundVao.unbind()
@@ -0,0 +1,555 @@
+"""
+Flattened scene graph which computes the world transforms of a whole Component tree with batched NumPy calls.
+The tree under a root component is laid out in breadth first order, so that every depth level is one contiguous
+block of rows and every parent comes before its children. The local transform parameters of all nodes (translation,
+u/v/w rotations or quaternion, scaling and the fixed pre/post/in/out rotations) are kept in stacked arrays, the local
+matrices of all dirty nodes are built in one vectorized call, and the world matrices then take one batched matrix
+product per depth level instead of one Python call per node.
+
+The arrays stay resident: Component setters write the parameter they change straight into their node's row and flag
+the row, so a frame never walks the tree or reads node attributes. Only nodes flagged by markDirty, whose attributes
+were changed behind the setters' back, are read again.
+
+Each node's transformationMat is a view into the stacked world matrices, and its drawMat a view into one shared
+float32 array of the same matrices in the column-major layout OpenGL takes, so drawing code keeps working unchanged.
+
+Every level block ends with some free rows. A subtree added to the tree takes free rows of the levels it spans, and
+a removed subtree gives its rows back, so adding or removing a creature costs time in the size of its subtree only.
+Rows of the other nodes never move, so their sceneRow can be cached until layoutVersion changes. The tree is
+flattened again only when its StructureCursor cannot say what changed, when a compiled node moved to
+another parent, when a level runs out of free rows, or when more than half of the rows are free.
+"""
+
+from bisect import bisect_right
+from itertools import chain
+
+import numpy as np
+
+from Component import Component, StructureCursor
+
+MIN_FREE_ROWS = 4  # int: free rows each level gets at least when the tree is flattened, a quarter of its nodes if more
+
+
+def quaternionMatrices(quats):
+    """
+    Rotation matrices of a stack of quaternions, with the same formula as Quaternion.toMatrix
+
+    :param quats: (n, 4) array of (s, x, y, z)
+    :type quats: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    s, a, b, c = quats[:, 0], quats[:, 1], quats[:, 2], quats[:, 3]
+    result = np.zeros((len(quats), 4, 4))
+    result[:, 0, 0] = 1 - 2 * b * b - 2 * c * c
+    result[:, 1, 0] = 2 * a * b + 2 * s * c
+    result[:, 2, 0] = 2 * a * c - 2 * s * b
+    result[:, 0, 1] = 2 * a * b - 2 * s * c
+    result[:, 1, 1] = 1 - 2 * a * a - 2 * c * c
+    result[:, 2, 1] = 2 * b * c + 2 * s * a
+    result[:, 0, 2] = 2 * a * c + 2 * s * b
+    result[:, 1, 2] = 2 * b * c - 2 * s * a
+    result[:, 2, 2] = 1 - 2 * a * a - 2 * b * b
+    result[:, 3, 3] = 1
+    return result
+
+
+def axisAngleQuaternions(angles, axes):
+    """
+    Quaternions of rotations by angles (in degrees) around axes, normalized the way GLUtility.rotate does it
+
+    :param angles: (n,) array of degrees, or an array of any shape
+    :param axes: (n, 3) array of rotation axes, with one more dimension than angles
+    :return: (n, 4) array of (s, x, y, z)
+    :rtype: numpy.ndarray
+    """
+    half = np.radians(angles) * 0.5
+    quats = np.empty(np.shape(angles) + (4,))
+    quats[..., 0] = np.cos(half)
+    quats[..., 1:] = np.sin(half)[..., None] * axes
+    norm = np.sqrt(np.einsum("...i,...i->...", quats, quats))
+    degenerate = norm < 1e-6
+    quats /= np.where(degenerate, 1.0, norm)[..., None]
+    quats[degenerate] = (1, 0, 0, 0)
+    return quats
+
+
+def quaternionProducts(q1, q2):
+    """
+    Hamilton products of two stacks of quaternions, the rotations q2 followed by q1, as Component.quaternionProduct
+
+    :param q1: (n, 4) array of (s, x, y, z)
+    :param q2: (n, 4) array of (s, x, y, z)
+    :rtype: numpy.ndarray
+    """
+    s1, a1, b1, c1 = q1.T
+    s2, a2, b2, c2 = q2.T
+    return np.stack((s1 * s2 - a1 * a2 - b1 * b2 - c1 * c2,
+                     s1 * a2 + a1 * s2 + b1 * c2 - c1 * b2,
+                     s1 * b2 - a1 * c2 + b1 * s2 + c1 * a2,
+                     s1 * c2 + a1 * b2 - b1 * a2 + c1 * s2), axis=1)
+
+
+class SceneCompiler:
+    """
+    Batched world transform computation for the subtree under root
+    """
+    root = None  # Component
+    nodes = None  # list<Component>: breadth first order, None for free rows
+    parents = None  # ndarray<int64> (n,): row of each node's parent, -1 for the root and 0 for free rows
+    levels = None  # list<tuple>: (start, end) rows of every depth level below the root, free rows included
+    levelStarts = None  # list<int>: start row of every level, to find the level of a row
+    freeRows = None  # list<list<int>>: free rows of every level
+    freeNum = 0  # int: free rows in all levels
+    cursor = None  # StructureCursor: structure changes of the tree not followed yet
+    layoutVersion = 0  # int: bumped whenever the tree is flattened again, which moves every node to a new row
+    parentMat = None  # ndarray (4, 4): transform of the root's parent
+
+    # stacked local transform parameters, one row per node
+    translations = None  # ndarray (n, 3)
+    angles = None  # ndarray (n, 3): u, v and w angles in degrees
+    axes = None  # ndarray (n, 3, 3): u, v and w axes
+    quats = None  # ndarray (n, 4): quaternion overriding the u/v/w angles
+    useQuat = None  # ndarray<bool> (n,)
+    scales = None  # ndarray (n, 3)
+    drawScales = None  # ndarray<float32> (n, 3): Component.drawScale, ones where it is not set
+    fixedBefore = None  # ndarray (n, 4, 4): postRotationMat @ outRotation
+    fixedAfter = None  # ndarray (n, 4, 4): inRotation @ preRotationMat
+    fixedIdentity = None  # ndarray<bool> (n,): rows whose fixedBefore and fixedAfter are both the identity
+    fixedSources = None  # list<tuple>: the four matrices fixedBefore and fixedAfter were last computed from
+    axesVersions = None  # list<int>: axesVersion of each node when its axes were last gathered
+    dirty = None  # ndarray<bool> (n,): rows whose local matrix is out of date
+    stale = None  # ndarray<bool> (n,): rows whose parameters must be read from their node again, set by markDirty
+
+    local = None  # ndarray (n, 4, 4): local transform of every node
+    world = None  # ndarray (n, 4, 4): world transform of every node, viewed by each node's transformationMat
+    drawWorld = None  # ndarray<float32> (n, 4, 4): transposed world transforms, viewed by each node's drawMat
+
+    def __init__(self, root):
+        """
+        :param root: the component at the top of the subtree to compile. Its transforms, and those of everything
+            below it, are computed by this compiler from then on.
+        :type root: Component
+        """
+        if not isinstance(root, Component):
+            raise TypeError("SceneCompiler root should be a Component")
+        self.root = root
+        self.nodes = []
+        self.parentMat = np.identity(4)
+        self.cursor = StructureCursor()
+        self.compile()
+
+    def compile(self):
+        """
+        Flatten the tree under root into breadth first arrays. Nodes that were already compiled keep their
+        parameters, local matrix and flags, new nodes are gathered and flagged dirty.
+        """
+        levelNodes = [[self.root]]
+        levelParents = [[-1]]
+        while True:
+            below = []
+            belowParents = []
+            for i, node in enumerate(levelNodes[-1]):
+                for child in node.children:
+                    below.append(child)
+                    belowParents.append(i)
+            if not below:
+                break
+            levelNodes.append(below)
+            levelParents.append(belowParents)
+
+        # every level below the root gets free rows at the end of its block, for subtrees added later
+        nodes = [self.root]
+        parents = [-1]
+        levels = []
+        freeRows = []
+        previousStart = 0
+        for below, belowParents in zip(levelNodes[1:], levelParents[1:]):
+            start = len(nodes)
+            free = max(MIN_FREE_ROWS, len(below) // 4)
+            nodes.extend(below)
+            nodes.extend([None] * free)
+            parents.extend([previousStart + i for i in belowParents])
+            parents.extend([0] * free)
+            levels.append((start, len(nodes)))
+            freeRows.append(list(range(len(nodes) - 1, len(nodes) - free - 1, -1)))
+            previousStart = start
+
+        # row of every node in the previous layout, -1 for new nodes
+        oldRows = np.full(len(nodes), -1, dtype=np.int64)
+        live = np.zeros(len(nodes), dtype=bool)
+        for row, node in enumerate(nodes):
+            if node is None:
+                continue
+            live[row] = True
+            if self.holds(node):
+                oldRows[row] = node.sceneRow
+        for node in self.nodes:
+            if node is not None:
+                # nodes no longer in the tree compute their own transforms again
+                node.scene = None
+                node.sceneRow = None
+                node.localDirty = True
+                node.worldDirty = True
+
+        n = len(nodes)
+        kept = np.flatnonzero(oldRows >= 0)
+        fresh = np.flatnonzero(live & (oldRows < 0))
+        old = oldRows[kept]
+        arrays = {}
+        for name, shape, dtype in (("translations", (3,), np.float64), ("angles", (3,), np.float64),
+                                   ("axes", (3, 3), np.float64), ("quats", (4,), np.float64),
+                                   ("useQuat", (), bool), ("scales", (3,), np.float64),
+                                   ("drawScales", (3,), np.float32),
+                                   ("fixedBefore", (4, 4), np.float64), ("fixedAfter", (4, 4), np.float64),
+                                   ("fixedIdentity", (), bool),
+                                   ("local", (4, 4), np.float64), ("dirty", (), bool), ("stale", (), bool)):
+            array = np.zeros((n,) + shape, dtype=dtype)
+            if len(kept):
+                array[kept] = getattr(self, name)[old]
+            arrays[name] = array
+        fixedSources = [None] * n
+        axesVersions = [None] * n
+        for row, oldRow in zip(kept.tolist(), old.tolist()):
+            fixedSources[row] = self.fixedSources[oldRow]
+            axesVersions[row] = self.axesVersions[oldRow]
+
+        self.nodes = nodes
+        self.parents = np.array(parents, dtype=np.int64)
+        self.levels = levels
+        self.levelStarts = [start for start, end in levels]
+        self.freeRows = freeRows
+        self.freeNum = sum(len(free) for free in freeRows)
+        self.layoutVersion += 1
+        self.cursor.skip()
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.fixedSources = fixedSources
+        self.axesVersions = axesVersions
+        self.world = np.zeros((n, 4, 4))
+        self.drawWorld = np.zeros((n, 4, 4), dtype=np.float32)
+        for row, node in enumerate(nodes):
+            if node is not None:
+                self.place(row, node)
+        if len(fresh):
+            self.gather(fresh, [nodes[row] for row in fresh.tolist()])
+            self.dirty[fresh] = True
+
+    def holds(self, node):
+        """
+        :return: whether node has a row in this compiler
+        :rtype: bool
+        """
+        row = node.sceneRow
+        return node.scene is self and row is not None and row < len(self.nodes) and self.nodes[row] is node
+
+    def place(self, row, node):
+        # node is computed in row from now on
+        self.nodes[row] = node
+        node.scene = self
+        node.sceneRow = row
+        node.transformationMat = self.world[row]
+        node.drawMat = self.drawWorld[row]
+        node.localDirty = False
+        node.worldDirty = False
+
+    def levelOf(self, row):
+        """
+        :return: index in levels of the level holding row, -1 for the root
+        :rtype: int
+        """
+        return bisect_right(self.levelStarts, row) - 1
+
+    def insert(self, parent, child):
+        """
+        Give the subtree under child, just added to parent, free rows of the levels it spans
+
+        :return: False if it cannot be done without flattening the tree again
+        :rtype: bool
+        """
+        if not self.holds(parent):
+            # outside of this tree, or below a subtree that was not inserted yet and will bring child along
+            return not self.holds(child)
+        if self.holds(child):
+            # already inserted with a subtree added after it, unless it moved from another parent
+            return self.parents[child.sceneRow] == parent.sceneRow
+
+        layers = [[(child, parent)]]
+        while True:
+            below = [(grandchild, node) for node, _ in layers[-1] for grandchild in node.children]
+            if not below:
+                break
+            layers.append(below)
+        level = self.levelOf(parent.sceneRow) + 1
+        if level + len(layers) > len(self.levels):
+            return False
+        for i, layer in enumerate(layers):
+            if len(self.freeRows[level + i]) < len(layer):
+                return False
+            if any(self.holds(node) for node, _ in layer):
+                return False
+
+        rows = []
+        nodes = []
+        for i, layer in enumerate(layers):
+            free = self.freeRows[level + i]
+            for node, nodeParent in layer:
+                row = free.pop()
+                self.parents[row] = nodeParent.sceneRow
+                self.fixedSources[row] = None
+                self.axesVersions[row] = None
+                self.place(row, node)
+                rows.append(row)
+                nodes.append(node)
+        self.freeNum -= len(rows)
+        rows = np.array(rows, dtype=np.int64)
+        self.gather(rows, nodes)
+        self.dirty[rows] = True
+        return True
+
+    def remove(self, parent, child):
+        """
+        Free the rows of the subtree under child, just removed from parent. Its components keep a copy of their
+        last transforms, and compute their own from then on.
+
+        :return: False if it cannot be done without flattening the tree again
+        :rtype: bool
+        """
+        if not self.holds(child):
+            return True
+        if not self.holds(parent) or self.parents[child.sceneRow] != parent.sceneRow:
+            return False
+        stack = [child]
+        while stack:
+            node = stack.pop()
+            row = node.sceneRow
+            for grandchild in node.children:
+                if self.holds(grandchild) and self.parents[grandchild.sceneRow] == row:
+                    stack.append(grandchild)
+            self.nodes[row] = None
+            self.parents[row] = 0
+            self.local[row] = 0
+            self.dirty[row] = False
+            self.stale[row] = False
+            self.freeRows[self.levelOf(row)].append(row)
+            self.freeNum += 1
+            node.scene = None
+            node.sceneRow = None
+            node.transformationMat = self.world[row].copy()
+            node.drawMat = self.drawWorld[row].copy()
+            node.parentMat = None
+            node.localDirty = True
+            node.worldDirty = True
+        return True
+
+    def sparse(self):
+        """
+        :return: whether more than half of the rows are free, not counting the few every level starts with
+        :rtype: bool
+        """
+        return self.freeNum > len(self.nodes) // 2 + MIN_FREE_ROWS * len(self.levels)
+
+    def applyChanges(self, changes):
+        """
+        Follow a list of structure changes, as returned by StructureCursor.changes
+
+        :return: False if the tree has to be flattened again
+        :rtype: bool
+        """
+        for parent, child, added in changes:
+            if not (self.insert(parent, child) if added else self.remove(parent, child)):
+                return False
+        return True
+
+    def gather(self, rows, nodes):
+        """
+        Copy the local transform parameters of nodes into their rows, one bulk assignment per parameter. Runs for
+        nodes joining the scene, and for nodes flagged by markDirty.
+        Axes are only read again when their axesVersion changed, and the fixed rotations are only multiplied again
+        when one of them was replaced; they are assumed to never be changed in place, which holds for
+        setPreRotation and setPostRotation.
+        """
+        k = len(nodes)
+        self.translations[rows] = np.concatenate([node.currentPos.coords for node in nodes]).reshape(k, 3)
+        self.angles[rows] = np.fromiter(chain.from_iterable([(node.uAngle, node.vAngle, node.wAngle) for node in nodes]),
+                                        np.float64, 3 * k).reshape(k, 3)
+        self.scales[rows] = np.fromiter(chain.from_iterable([node.currentScaling for node in nodes]),
+                                        np.float64, 3 * k).reshape(k, 3)
+        self.drawScales[rows] = [(1, 1, 1) if node.drawScale is None else node.drawScale for node in nodes]
+        useQuat = [node.quat is not None for node in nodes]
+        self.useQuat[rows] = useQuat
+        fixedSources = self.fixedSources
+        axesVersions = self.axesVersions
+        identity = np.identity(4)
+        for row, node, hasQuat in zip(rows.tolist(), nodes, useQuat):
+            if hasQuat:
+                self.quats[row] = (node.quat.s, *node.quat.v)
+            if axesVersions[row] != node.axesVersion:
+                self.axes[row] = (node.uAxis.coords, node.vAxis.coords, node.wAxis.coords)
+                axesVersions[row] = node.axesVersion
+            sources = fixedSources[row]
+            if sources is None or sources[0] is not node.postRotationMat or sources[1] is not node.outRotation or \
+                    sources[2] is not node.inRotation or sources[3] is not node.preRotationMat:
+                self.fixedBefore[row] = node.postRotationMat @ node.outRotation
+                self.fixedAfter[row] = node.inRotation @ node.preRotationMat
+                self.fixedIdentity[row] = np.array_equal(self.fixedBefore[row], identity) and \
+                    np.array_equal(self.fixedAfter[row], identity)
+                fixedSources[row] = (node.postRotationMat, node.outRotation, node.inRotation, node.preRotationMat)
+
+    def buildLocal(self, rows):
+        """
+        Compute the local matrices of some rows in one vectorized pass:
+        translate @ post @ out @ rotateU @ rotateV @ rotateW @ in @ pre @ scale
+
+        :param rows: row indices
+        :type rows: numpy.ndarray
+        :return: None
+        """
+        if len(rows) == 0:
+            return
+        # the three rotations fused into one quaternion, as in Component.localTransform
+        u, v, w = axisAngleQuaternions(self.angles[rows], self.axes[rows]).transpose(1, 0, 2)
+        quats = quaternionProducts(quaternionProducts(u, v), w)
+        useQuat = self.useQuat[rows]
+        if useQuat.any():
+            # the quaternion replaces all three angles, and Component uses the transpose of its matrix, which is
+            # the matrix of its conjugate
+            quats[useQuat] = self.quats[rows][useQuat] * (-1, 1, 1, 1)
+        local = quaternionMatrices(quats)
+        fixed = np.flatnonzero(~self.fixedIdentity[rows])
+        if len(fixed):
+            fixedRows = rows[fixed]
+            local[fixed] = self.fixedBefore[fixedRows] @ local[fixed] @ self.fixedAfter[fixedRows]
+        # scaling multiplies the first three columns, translation adds to the first three rows
+        local[:, :, :3] *= self.scales[rows][:, None, :]
+        local[:, :3, :] += self.translations[rows][:, :, None] * local[:, 3:4, :]
+        self.local[rows] = local
+
+    def touch(self, row):
+        """
+        Flag the local transform of row as changed, its parameters being up to date in the arrays already
+        """
+        self.dirty[row] = True
+        if not self.root.worldDirty:
+            self.root.markWorldDirty()
+
+    def markStale(self, row):
+        """
+        Flag row to have every parameter read from its node again, for changes made without a Component setter
+        """
+        self.stale[row] = True
+        self.touch(row)
+
+    def write(self, row, name, value, column=None):
+        """
+        Store the new value of one local transform parameter of row, as Component setters do, and flag the row
+
+        :param name: name of the parameter array, such as "translations", "angles" or "scales"
+        :type name: str
+        :param column: the one column of the parameter to store, all of them if None
+        :type column: int
+        """
+        if column is None:
+            getattr(self, name)[row] = value
+        else:
+            getattr(self, name)[row, column] = value
+        self.touch(row)
+
+    def collectDirty(self):
+        """
+        Read the parameters of stale rows again, and clear the flags of every dirty row
+
+        :return: rows whose local transform changed
+        :rtype: numpy.ndarray
+        """
+        self.root.worldDirty = False
+        stale = np.flatnonzero(self.stale)
+        if len(stale):
+            self.gather(stale, [self.nodes[row] for row in stale.tolist()])
+            self.stale[stale] = False
+        rows = np.flatnonzero(self.dirty)
+        if len(rows):
+            self.dirty[rows] = False
+        return rows
+
+    def detach(self):
+        """
+        Stop compiling the subtree, its components go back to computing their own transforms
+        """
+        for node in self.nodes:
+            if node is None:
+                continue
+            node.scene = None
+            node.sceneRow = None
+            node.localDirty = True
+            node.worldDirty = True
+            node.parentMat = None
+            node.drawMat = None
+        self.root.scene = None
+        self.root.worldDirty = False
+        self.root.markDirty()
+        self.nodes = []
+
+    def update(self, parentTransformationMat=None, parentChanged=None):
+        """
+        Bring the world transforms of the whole subtree up to date
+
+        :param parentTransformationMat: transform of the root's parent, defaults to the one used last time
+        :type parentTransformationMat: numpy.ndarray
+        :param parentChanged: whether the parent transform changed, compared with the last one if not given
+        :type parentChanged: bool
+        :return: None
+        """
+        if parentTransformationMat is not None:
+            if parentChanged is None:
+                parentChanged = not np.array_equal(parentTransformationMat, self.parentMat)
+            if parentChanged:
+                self.parentMat = np.array(parentTransformationMat, dtype=np.float64)
+        parentChanged = bool(parentChanged)
+
+        structureChanged = self.cursor.pending()
+        if structureChanged:
+            changes = self.cursor.changes()
+            if changes is None or not self.applyChanges(changes) or self.sparse():
+                self.compile()
+        dirtyRows = self.collectDirty()
+        if len(dirtyRows):
+            self.buildLocal(dirtyRows)
+        elif not parentChanged and not structureChanged:
+            return
+
+        world = self.world
+        world[0] = self.parentMat @ self.local[0]
+        for start, end in self.levels:
+            world[start:end] = world[self.parents[start:end]] @ self.local[start:end]
+        # one conversion for the whole scene, so drawing uploads every node's matrix as it is
+        np.copyto(self.drawWorld, world.transpose(0, 2, 1))
+        self.drawWorld[:, :3, :] *= self.drawScales[:, :, None]
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import Benchmark
+
+    # python SceneCompiler.py [creatures]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    vivarium = Benchmark.buildScene(max(1, n // 4), n - max(1, n // 4))
+
+    def frame():
+        # every joint swings and every creature moves, so the whole scene is dirty
+        for c in vivarium.store.owners:
+            c.animationUpdate()
+            c.translationChanged()
+        t1 = time.time()
+        vivarium.update()
+        return time.time() - t1
+
+    compiler = vivarium.scene
+    compiler.detach()
+    frame()
+    recursive = sum(frame() for _ in range(3)) / 3
+    compiler = SceneCompiler(vivarium)
+    frame()
+    compiled = sum(frame() for _ in range(3)) / 3
+    print(f"{len(compiler.nodes) - compiler.freeNum} nodes: recursive update {recursive * 1000:.1f}ms, "
+          f"compiled {compiled * 1000:.1f}ms, speedup {recursive / compiled:.1f}x")
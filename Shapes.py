@@ -4,14 +4,31 @@ Implements four geometric primitives (Sphere, Cube, Cone, Cylinder) using the Di
 Modified by Daniel Scrivener 09/2023
 """
 
-from collada import *
-from DisplayableMesh import DisplayableMesh
+import hashlib
+import os
+
+from DisplayableMesh import DisplayableMesh, interleaveVertices
 from Component import Component
 import GLUtility
 import ColorType
 import numpy as np
 
+# compiled copies of the assets are kept in this directory, next to the .dae files they come from
+COMPILED_MESH_DIR = ".meshcache"
+# bumped whenever getVertexData changes what it produces, so that older compiled copies are not used
+COMPILED_MESH_FORMAT = 2
+
 def getVertexData(filename):
+    """
+    Parse the first triangle set of a COLLADA file into the interleaved vertex layout, with empty normals, colors
+    and texture coordinates, and a flat array of triangle indices
+
+    :param filename: .dae file to import
+    :type filename: string
+    :rtype: tuple
+    """
+    # pycollada is slow to import, so it is only imported once a mesh is actually loaded
+    from collada import Collada
 
     colladaData = Collada(filename)
 
@@ -20,35 +37,101 @@ def getVertexData(filename):
 
     geo = colladaData.geometries[0]
     tridata = geo.primitives[0]
-    trilist = list(tridata)
 
-    # construct vertex list
-    vertices = np.array([])
-    
-    for vert in tridata.vertex:
-        vert = np.concatenate((vert, [0.,0.,0.]), axis=0) # empty normals
-        vert = np.concatenate((vert, [0.,0.,0.]), axis=0) # color
-        vert = np.concatenate((vert, [0.,0.]), axis=0) # empty UV
-        vertices = np.append(vertices, vert)
+    vertices = interleaveVertices(tridata.vertex)
+    indices = np.asarray(tridata.vertex_index, dtype=np.int32).ravel()
 
-    # construct indices
-    indices = np.array([])
+    return (vertices, indices)
 
-    for tri in trilist:
-        indices = np.append(indices, tri.indices)
+def loadCompiledVertexData(filename):
+    """
+    Vertex and index data of an asset, read from its compiled .npy copies with memory mapping, so that processes
+    loading the same asset share its pages. The copies are named after a hash of the .dae file's content, and are
+    compiled again, replacing the stale ones, whenever the file changes. If the cache directory cannot be written,
+    the asset is parsed every time instead.
 
-    return (vertices, indices)
+    :param filename: .dae file to import
+    :type filename: string
+    :return: read-only vertex and index arrays
+    :rtype: tuple
+    """
+    with open(filename, "rb") as f:
+        digest = hashlib.sha256(f"{COMPILED_MESH_FORMAT}:".encode() + f.read()).hexdigest()[:16]
+    directory = os.path.join(os.path.dirname(filename), COMPILED_MESH_DIR)
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    paths = [os.path.join(directory, f"{stem}-{digest}.{part}.npy") for part in ("vertices", "indices")]
+    try:
+        return tuple(np.load(path, mmap_mode="r") for path in paths)
+    except (OSError, ValueError):
+        pass
+
+    data = getVertexData(filename)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for entry in os.listdir(directory):
+            if entry.startswith(stem + "-") and not entry.startswith(f"{stem}-{digest}."):
+                os.remove(os.path.join(directory, entry))
+        for path, array in zip(paths, data):
+            # write under a private name first, so other processes never see a partial file
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                np.save(f, array)
+            os.replace(temporary, path)
+        return tuple(np.load(path, mmap_mode="r") for path in paths)
+    except OSError:
+        return data
+
+# vertex and index data of every asset loaded so far, shared by the whole process
+meshDataCache = {}
+
+def getMeshData(filename):
+    """
+    Vertex and index data of an asset, loaded on first use and cached for the rest of the process.
+    The arrays are shared by every shape built from the asset, so they must not be changed.
+
+    :param filename: .dae file to import
+    :type filename: string
+    :rtype: tuple
+    """
+    if filename not in meshDataCache:
+        meshDataCache[filename] = loadCompiledVertexData(filename)
+    return meshDataCache[filename]
+
+class AssetData:
+    """
+    Class attribute standing for (part of) the mesh data of the asset named by another class attribute, loaded the
+    first time it is read, so that importing this module parses nothing
+    """
+
+    def __init__(self, pathAttribute, index=None):
+        """
+        :param pathAttribute: name of the class attribute holding the asset path
+        :type pathAttribute: str
+        :param index: 0 for the vertices, 1 for the indices, None for both
+        :type index: int
+        """
+        self.pathAttribute = pathAttribute
+        self.index = index
+
+    def __get__(self, obj, owner):
+        data = getMeshData(getattr(owner, self.pathAttribute))
+        return data if self.index is None else data[self.index]
 
 class Shape(Component):
     vertexData = None
     indexData = None
     mesh = None
 
+    pathname = None  # str: asset of the primitive, set by each subclass
+    pathnameLP = None  # str: asset of the low poly variant, if the primitive has one
+    size = None  # list<float>(3): scale factors applied to the primitive's vertices
+    lowPoly = False  # whether this shape uses the low poly variant
+
     def __init__(self, position, shaderProg, size, vertexData, indexData, color=ColorType.YELLOW):
         """
         :param position: location of the object
         :type position: Point
-        :param shaderProg: compiled shader program
+        :param shaderProg: compiled shader program, or None for a simulation-only shape with no GPU resources
         :type shaderProg: GLProgram
         :param size: set of three size factors to be applied to each vertex
         :type size: list or tuple
@@ -60,19 +143,63 @@ class Shape(Component):
             rather than the object's center
         :type limb: boolean
         """
-        self.mesh = DisplayableMesh(shaderProg, size, vertexData, indexData, color)
+        self.size = list(size)
+        if shaderProg is not None:
+            # primitives share their geometry with every other shape of the same primitive, the size is applied by
+            # drawMat instead
+            self.mesh = DisplayableMesh(shaderProg, size, vertexData, indexData, color, meshKey=self.meshKey())
         super(Shape, self).__init__(position, self.mesh)
+        if self.meshKey() is not None:
+            self.drawScale = self.size
+        if self.mesh is None:
+            # headless shapes have nothing to draw, but keep their color for anyone who asks
+            self.setDefaultColor(color)
+
+    def meshKey(self):
+        """
+        Shapes with the same key are built from the same unscaled geometry, and differ only by size and color
+
+        :return: asset path of this shape's primitive and level of detail, None if it has none
+        :rtype: str
+        """
+        return self.pathnameLP if self.lowPoly else self.pathname
+
+    def geometry(self):
+        """
+        :return: unscaled vertex and index data of this shape's primitive and level of detail
+        :rtype: tuple
+        """
+        if self.lowPoly:
+            return self.verticesLP, self.indicesLP
+        return self.vertices, self.indices
+
+    def setLowPoly(self, lowPoly):
+        """
+        Switch between the full and the low poly variant of the primitive. Only the mesh binding changes: size,
+        color and transforms are the same for both variants.
+
+        :param lowPoly: whether to draw the low poly variant
+        :type lowPoly: bool
+        """
+        if self.pathnameLP is None:
+            raise ValueError("%s has no low poly variant" % type(self).__name__)
+        lowPoly = bool(lowPoly)
+        if lowPoly == self.lowPoly:
+            return
+        self.lowPoly = lowPoly
+        if self.mesh is not None:
+            self.mesh.setGeometry(self.meshKey(), *self.geometry())
 
 class Cone(Shape):
 
     pathname = "assets/cone0.dae"
     pathnameLP = "assets/coneLP.dae"
-    data = getVertexData(pathname)
-    dataLP = getVertexData(pathnameLP)
-    vertices = data[0]
-    verticesLP = dataLP[0]
-    indices = data[1]
-    indicesLP = dataLP[1]
+    data = AssetData("pathname")
+    dataLP = AssetData("pathnameLP")
+    vertices = AssetData("pathname", 0)
+    verticesLP = AssetData("pathnameLP", 0)
+    indices = AssetData("pathname", 1)
+    indicesLP = AssetData("pathnameLP", 1)
 
     def __init__(self, position, shaderProg, size, color=ColorType.YELLOW, limb=True, lowPoly=False):
         """
@@ -85,10 +212,11 @@ class Cone(Shape):
         :param color: vertex color to be applied uniformly
         :type color: ColorType
         """
+        self.lowPoly = lowPoly
         if lowPoly:
-            super(Cone, self).__init__(position, shaderProg, size, self.verticesLP.copy(), self.indicesLP.copy(), color)
+            super(Cone, self).__init__(position, shaderProg, size, self.verticesLP, self.indicesLP, color)
         else:
-            super(Cone, self).__init__(position, shaderProg, size, self.vertices.copy(), self.indices.copy(), color)
+            super(Cone, self).__init__(position, shaderProg, size, self.vertices, self.indices, color)
 
         # translate object by -z extent of the new component so that rotations occur @ the joint
         # rather than around the object's true center
@@ -105,9 +233,9 @@ class Cone(Shape):
 class Cube(Shape):
 
     pathname = "assets/cube0.dae"
-    data = getVertexData(pathname)
-    vertices = data[0]
-    indices = data[1]
+    data = AssetData("pathname")
+    vertices = AssetData("pathname", 0)
+    indices = AssetData("pathname", 1)
 
     def __init__(self, position, shaderProg, size, color=ColorType.RED, limb=True):
         """
@@ -120,7 +248,7 @@ class Cube(Shape):
         :param color: vertex color to be applied uniformly
         :type color: ColorType
         """
-        super(Cube, self).__init__(position, shaderProg, size, self.vertices.copy(), self.indices.copy(), color)
+        super(Cube, self).__init__(position, shaderProg, size, self.vertices, self.indices, color)
         # translate object by -z extent of the new component so that rotations occur @ the joint
         # rather than around the object's true center
         glutility = GLUtility.GLUtility()
@@ -137,12 +265,12 @@ class Cylinder(Shape):
 
     pathname = "assets/cylinder0.dae"
     pathnameLP = "assets/cylinderLP.dae"
-    data = getVertexData(pathname)
-    dataLP = getVertexData(pathnameLP)
-    vertices = data[0]
-    verticesLP = dataLP[0]
-    indices = data[1]
-    indicesLP = dataLP[1]
+    data = AssetData("pathname")
+    dataLP = AssetData("pathnameLP")
+    vertices = AssetData("pathname", 0)
+    verticesLP = AssetData("pathnameLP", 0)
+    indices = AssetData("pathname", 1)
+    indicesLP = AssetData("pathnameLP", 1)
 
     def __init__(self, position, shaderProg, size, color=ColorType.GREEN, limb=True, lowPoly=False):
         """
@@ -155,10 +283,11 @@ class Cylinder(Shape):
         :param color: vertex color to be applied uniformly
         :type color: ColorType
         """
+        self.lowPoly = lowPoly
         if lowPoly:
-            super(Cylinder, self).__init__(position, shaderProg, size, self.verticesLP.copy(), self.indicesLP.copy(), color)
+            super(Cylinder, self).__init__(position, shaderProg, size, self.verticesLP, self.indicesLP, color)
         else:
-            super(Cylinder, self).__init__(position, shaderProg, size, self.vertices.copy(), self.indices.copy(), color)
+            super(Cylinder, self).__init__(position, shaderProg, size, self.vertices, self.indices, color)
         # translate object by -z extent of the new component so that rotations occur @ the joint
         # rather than around the object's true center
         glutility = GLUtility.GLUtility()
@@ -175,12 +304,12 @@ class Sphere(Shape):
 
     pathname = "assets/sphere0.dae"
     pathnameLP = "assets/sphereLP.dae"
-    data = getVertexData(pathname)
-    dataLP = getVertexData(pathnameLP)
-    vertices = data[0]
-    verticesLP = dataLP[0]
-    indices = data[1]
-    indicesLP = dataLP[1]
+    data = AssetData("pathname")
+    dataLP = AssetData("pathnameLP")
+    vertices = AssetData("pathname", 0)
+    verticesLP = AssetData("pathnameLP", 0)
+    indices = AssetData("pathname", 1)
+    indicesLP = AssetData("pathnameLP", 1)
 
     def __init__(self, position, shaderProg, size, color=ColorType.BLUE, limb=True, lowPoly=False):
         """
@@ -197,10 +326,11 @@ class Sphere(Shape):
             Set this to False for eyes or other ball joints.
         :type limb: boolean
         """
+        self.lowPoly = lowPoly
         if lowPoly:
-            super(Sphere, self).__init__(position, shaderProg, size, self.verticesLP.copy(), self.indicesLP.copy(), color)
+            super(Sphere, self).__init__(position, shaderProg, size, self.verticesLP, self.indicesLP, color)
         else:
-            super(Sphere, self).__init__(position, shaderProg, size, self.vertices.copy(), self.indices.copy(), color)
+            super(Sphere, self).__init__(position, shaderProg, size, self.vertices, self.indices, color)
         # translate object by -z extent of the new component so that rotations occur @ the joint
         # rather than around the object's true center   
         glutility = GLUtility.GLUtility()
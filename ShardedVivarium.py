@@ -0,0 +1,341 @@
+"""
+Multi-process simulation of very large tanks.
+The tank is cut along x into slabs, and each slab is simulated by its own worker process with its own CreatureStore.
+A step runs in three rounds:
+    1. every worker integrates the creatures it owns, and hands over those that left its slab (migration)
+    2. every worker takes in the creatures that migrated into its slab, and sends copies of the creatures within
+       interaction distance of a slab border to the neighbor on the other side (ghost zone)
+    3. every worker checks its own creatures against its own and the ghost creatures, and removes its eaten prey
+Moving, bouncing and eating reuse Interaction.integrate, Interaction.nearbyPairs and Interaction.interact, so the
+rules are the same as in the single process Interaction.stepForward. Ghost rows are only read, never changed: each
+creature is updated by the worker that owns it.
+
+Creatures only carry their simulation state here, there are no Components and nothing is drawn.
+"""
+
+import multiprocessing
+
+import numpy as np
+
+import Interaction
+from CreatureStore import CreatureStore
+from SpatialHash import SpatialHash
+
+
+class Shard:
+    """
+    The creatures of one slab, living inside a worker process
+    """
+    store = None  # CreatureStore: owned creatures, followed by ghosts while interacting
+    ids = None  # ndarray<int64>: global id of every owned creature
+    low = None  # float: lower x border of the slab
+    high = None  # float: upper x border of the slab
+    reach = None  # float: width of the ghost zone
+    tank_dimensions = None
+    rng = None
+    grid = None  # SpatialHash over owned and ghost creatures
+
+    def __init__(self, tank_dimensions, low, high, reach, seed, dtype):
+        self.store = CreatureStore(dtype=dtype)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.low = low
+        self.high = high
+        self.reach = reach
+        self.tank_dimensions = tank_dimensions
+        self.rng = np.random.default_rng(seed)
+        self.grid = SpatialHash(tank_dimensions, reach) if reach > 0 else None
+
+    def add(self, rows, ids):
+        self.store.extend(rows)
+        self.ids = np.concatenate((self.ids, ids))
+
+    def integrate(self):
+        """ move the owned creatures, and return those that left the slab """
+        Interaction.integrate(self.store, self.tank_dimensions, self.rng)
+        x = self.store.positions[:self.store.count, 0]
+        leaving = (x < self.low) | (x >= self.high)
+        if not leaving.any():
+            return None
+        rows = self.store.takeRows(leaving)
+        ids = self.ids[leaving]
+        self.store.keepRows(~leaving)
+        self.ids = self.ids[~leaving]
+        return rows, ids
+
+    def ghosts(self):
+        """ copies of the owned creatures close enough to a border to interact across it, for (lower, upper) """
+        x = self.store.positions[:self.store.count, 0]
+        lower = self.store.takeRows(x < self.low + self.reach)
+        upper = self.store.takeRows(x >= self.high - self.reach)
+        return lower, upper
+
+    def interact(self, ghostRows):
+        """ interact the owned creatures with each other and with the ghosts, then drop the eaten ones """
+        owned = self.store.count
+        for rows in ghostRows:
+            if len(rows["radii"]):
+                self.store.extend(rows)
+        pairs = Interaction.nearbyPairs(self.store, owned=owned, broadphase=self.grid)
+        turned, eaten = Interaction.interact(self.store, pairs, owned=owned)
+        # ghosts are gone again until the next step
+        self.store.count = owned
+        del self.store.owners[owned:]
+        if len(eaten) == 0:
+            return self.ids[:0]
+        keep = np.ones(owned, dtype=bool)
+        keep[eaten] = False
+        eatenIds = self.ids[eaten]
+        self.store.keepRows(keep)
+        self.ids = self.ids[keep]
+        return eatenIds
+
+    def gather(self):
+        return self.store.takeRows(slice(None)), self.ids.copy()
+
+
+def _work(connection, tank_dimensions, low, high, reach, seed, dtype):
+    """ worker process main loop: run the requests of the coordinator on one shard until told to stop """
+    shard = Shard(tank_dimensions, low, high, reach, seed, dtype)
+    while True:
+        request, payload = connection.recv()
+        if request == "add":
+            shard.add(*payload)
+            connection.send(None)
+        elif request == "integrate":
+            connection.send(shard.integrate())
+        elif request == "migrants":
+            for rows, ids in payload:
+                shard.add(rows, ids)
+            connection.send(shard.ghosts())
+        elif request == "interact":
+            connection.send(shard.interact(payload))
+        elif request == "gather":
+            connection.send(shard.gather())
+        elif request == "close":
+            connection.close()
+            return
+        else:
+            raise ValueError(f"unknown request {request}")
+
+
+class ShardedVivarium:
+    """
+    Coordinator of the worker processes simulating the slabs of one tank.
+    Use it as a context manager, or call close() to stop the workers.
+    """
+    tank_dimensions = None
+    borders = None  # ndarray (shardNum + 1,): x borders of the slabs
+    reach = None  # float: width of the ghost zone
+    connections = None  # list<Connection>: pipe to each worker
+    processes = None  # list<multiprocessing.Process>
+    eaten = None  # list<int>: global ids of the creatures eaten so far
+    nextId = 0
+
+    def __init__(self, shardNum=None, tank_dimensions=(12, 12, 12), reach=None, seed=None, dtype=np.float64):
+        """
+        :param shardNum: number of slabs and worker processes, defaults to the number of CPUs
+        :type shardNum: int
+        :param tank_dimensions: size of the tank along x, y and z; the wall is a sphere of the largest one
+        :type tank_dimensions: tuple
+        :param reach: longest interaction distance of any creature that will be added, the ghost zone width
+        :type reach: float
+        :param seed: seed of the random generators, each worker derives its own from it
+        :type seed: int
+        :param dtype: floating point type of the creature state
+        :type dtype: numpy.float32 or numpy.float64
+        """
+        shardNum = shardNum or multiprocessing.cpu_count()
+        self.tank_dimensions = list(tank_dimensions)
+        half = max(self.tank_dimensions) / 2
+        self.borders = np.linspace(-half, half, shardNum + 1)
+        if reach is None:
+            reach = 0.0
+        if reach * 1.0001 > self.borders[1] - self.borders[0]:
+            raise ValueError("slabs should be wider than the interaction reach, use fewer shards")
+        self.reach = reach
+        self.eaten = []
+        self.nextId = 0
+
+        seeds = np.random.SeedSequence(seed).spawn(shardNum)
+        context = multiprocessing.get_context("spawn")
+        self.connections = []
+        self.processes = []
+        for k in range(shardNum):
+            # the outermost slabs also own whatever lies beyond the tank
+            low = -np.inf if k == 0 else self.borders[k]
+            high = np.inf if k == shardNum - 1 else self.borders[k + 1]
+            parentEnd, childEnd = context.Pipe()
+            process = context.Process(target=_work, daemon=True,
+                                      args=(childEnd, self.tank_dimensions, low, high, reach, seeds[k], dtype))
+            process.start()
+            childEnd.close()
+            self.connections.append(parentEnd)
+            self.processes.append(process)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _shardOf(self, x):
+        return np.clip(np.searchsorted(self.borders, x, side="right") - 1, 0, len(self) - 1)
+
+    def _ask(self, request, payloads):
+        for connection, payload in zip(self.connections, payloads):
+            connection.send((request, payload))
+        return [connection.recv() for connection in self.connections]
+
+    def load(self, store):
+        """
+        Hand the creatures of a store out to the slabs their x position falls into
+
+        :param store: creature state to simulate, it is copied and not changed
+        :type store: CreatureStore
+        :return: global ids of the creatures, in row order of store
+        :rtype: numpy.ndarray
+        """
+        n = store.count
+        reach = Interaction.maxInteractionDistance(store)
+        if reach > self.reach:
+            raise ValueError(f"creatures interact up to {reach}, further than the ghost zone of {self.reach}")
+        ids = np.arange(self.nextId, self.nextId + n)
+        self.nextId += n
+        shards = self._shardOf(store.positions[:n, 0])
+        self._ask("add", [(store.takeRows(shards == k), ids[shards == k]) for k in range(len(self))])
+        return ids
+
+    def step(self):
+        """
+        Take one simulation step in every slab
+
+        :return: global ids of the creatures eaten in this step
+        :rtype: numpy.ndarray
+        """
+        shardNum = len(self)
+        migrants = [[] for _ in range(shardNum)]
+        for leaving in self._ask("integrate", [None] * shardNum):
+            if leaving is None:
+                continue
+            rows, ids = leaving
+            targets = self._shardOf(rows["positions"][:, 0])
+            for k in np.unique(targets):
+                mask = targets == k
+                migrants[k].append(({name: array[mask] for name, array in rows.items()}, ids[mask]))
+
+        ghosts = self._ask("migrants", migrants)
+        # each slab sees the upper ghosts of the slab below it and the lower ghosts of the slab above it
+        incoming = []
+        for k in range(shardNum):
+            rows = []
+            if k > 0:
+                rows.append(ghosts[k - 1][1])
+            if k < shardNum - 1:
+                rows.append(ghosts[k + 1][0])
+            incoming.append(rows)
+
+        eaten = np.concatenate(self._ask("interact", incoming))
+        self.eaten.extend(eaten.tolist())
+        return eaten
+
+    def run(self, steps):
+        """
+        :param steps: number of simulation steps to take
+        :type steps: int
+        :return: None
+        """
+        for _ in range(steps):
+            self.step()
+
+    def gather(self):
+        """
+        Collect the state of every living creature
+
+        :return: a store with one row per creature, sorted by global id, and the global ids
+        :rtype: tuple
+        """
+        parts = self._ask("gather", [None] * len(self))
+        store = CreatureStore()
+        ids = []
+        for rows, shardIds in parts:
+            store.extend(rows)
+            ids.append(shardIds)
+        ids = np.concatenate(ids)
+        order = np.argsort(ids)
+        sortedStore = CreatureStore(max(1, len(ids)), dtype=store.dtype)
+        sortedStore.extend(store.takeRows(order))
+        return sortedStore, ids[order]
+
+    def close(self):
+        """ stop the workers """
+        for connection in self.connections:
+            try:
+                connection.send(("close", None))
+                connection.close()
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+
+def populate(n, tank_dimensions=(12, 12, 12), seed=0):
+    """
+    A store with n creatures spread over the tank, one predator for every three prey, all of them moving
+
+    :rtype: CreatureStore
+    """
+    rng = np.random.default_rng(seed)
+    store = CreatureStore(n)
+    store.extend({
+        "positions": (rng.random((n, 3)) - 0.5) * max(tank_dimensions) * 0.8,
+        "previous_positions": np.zeros((n, 3)),
+        "velocities": (rng.random((n, 3)) - 0.5) * Interaction.SPEED,
+        "radii": np.full(n, 0.02),
+        "species": np.where(np.arange(n) % 4 == 0, Interaction.PREDATOR_SPECIES, Interaction.PREY_SPECIES),
+        "alive": np.ones(n, dtype=bool),
+        "moving": np.ones(n, dtype=bool),
+        "step_counters": np.zeros(n, dtype=np.int32),
+        "headings": np.zeros((n, 3)),
+        "serials": CreatureStore.newSerials(n),
+    })
+    return store
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # python ShardedVivarium.py [creatures] [steps]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    tank = [12, 12, 12]
+    store = populate(n, tank)
+    reach = Interaction.maxInteractionDistance(store)
+    print(f"{n} creatures, {steps} steps, {multiprocessing.cpu_count()} CPUs")
+
+    single = populate(n, tank)
+    grid = SpatialHash(tank, reach)
+    rng = np.random.default_rng(0)
+    t1 = time.time()
+    for _ in range(steps):
+        turned, eaten = Interaction.stepForward(single, tank, rng, grid)
+        keep = np.ones(single.count, dtype=bool)
+        keep[eaten] = False
+        single.keepRows(keep)
+    baseline = time.time() - t1
+    print(f"single process: {steps / baseline:.2f} steps/s, {single.count} creatures left")
+
+    for shardNum in sorted({1, 2, 4, multiprocessing.cpu_count()}):
+        with ShardedVivarium(shardNum, tank, reach, seed=0) as sharded:
+            sharded.load(store)
+            t1 = time.time()
+            sharded.run(steps)
+            elapsed = time.time() - t1
+            left = len(sharded.gather()[1])
+        print(f"{shardNum} shards: {steps / elapsed:.2f} steps/s, speedup {baseline / elapsed:.2f}x, "
+              f"{left} creatures left")
@@ -0,0 +1,90 @@
+"""
+Fixed timestep clock which decouples the simulation from paint events.
+Real time since the last frame is added to an accumulator, and the simulation takes one step of dt for every dt
+in the accumulator. A frame can therefore run zero, one or several simulation steps, and whatever is left in the
+accumulator says how far the display is between the last two steps.
+"""
+
+import time
+
+
+class SimulationClock:
+    """
+    Accumulator that turns elapsed real time into a number of fixed size simulation steps
+    """
+    dt = None  # float: simulated seconds per simulation step
+    maxStepsPerFrame = None  # int: catch-up cap, backlog beyond it is dropped
+    timeScale = 1.0  # float: simulated seconds per real second
+    accumulator = 0.0
+    lastTime = None
+    timer = None
+
+    def __init__(self, dt=1 / 120, maxStepsPerFrame=8, timeScale=1.0, timer=time.perf_counter):
+        """
+        :param dt: length of one simulation step in seconds. The creatures were tuned for one step per frame at
+            120 frames per second, so that is the default.
+        :type dt: float
+        :param maxStepsPerFrame: most steps a single frame will run to catch up
+        :type maxStepsPerFrame: int
+        :param timeScale: how much faster than real time the simulation runs
+        :type timeScale: float
+        :param timer: function returning the current time in seconds
+        """
+        if dt <= 0:
+            raise ValueError("simulation step should be longer than 0")
+        self.dt = dt
+        self.maxStepsPerFrame = maxStepsPerFrame
+        self.timeScale = timeScale
+        self.timer = timer
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all elapsed time, the next advance starts counting from there
+        """
+        self.accumulator = 0.0
+        self.lastTime = None
+
+    def hold(self):
+        """
+        Keep the display on the current simulation step, for every frame the simulation is paused. Elapsed time is
+        dropped, alpha() stays at 1, and the first advance after the pause runs the next step right away, so the
+        display moves on from where it stopped instead of jumping back to the step before.
+        """
+        self.accumulator = self.dt
+        self.lastTime = None
+
+    def advance(self, now=None):
+        """
+        Add the time since the last call to the accumulator and take out as many whole steps as it holds
+
+        :param now: current time in seconds, read from the timer if not given
+        :type now: float
+        :return: number of simulation steps to run for this frame
+        :rtype: int
+        """
+        if now is None:
+            now = self.timer()
+        if self.lastTime is None:
+            self.lastTime = now
+            return 0
+        self.accumulator += (now - self.lastTime) * self.timeScale
+        self.lastTime = now
+
+        steps = int(self.accumulator // self.dt)
+        if steps > self.maxStepsPerFrame:
+            # too far behind to catch up, drop the backlog instead of spiraling into longer and longer frames
+            steps = self.maxStepsPerFrame
+            self.accumulator = self.accumulator % self.dt
+        else:
+            self.accumulator -= steps * self.dt
+        return steps
+
+    def alpha(self):
+        """
+        How far the display is between the previous and the current simulation step
+
+        :return: interpolation factor in [0, 1)
+        :rtype: float
+        """
+        return min(self.accumulator / self.dt, 1.0)
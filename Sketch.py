@@ -20,9 +20,16 @@ from Point import Point
 from CanvasBase import CanvasBase
 import ColorType
 from GLProgram import GLProgram
-from GLBuffer import VAO, VBO, EBO, Texture
+from InstancedRenderer import InstancedRenderer
+from FrustumCulling import FrustumCuller
+from LevelOfDetail import LevelOfDetail
+from MeshCache import meshCache
+from RenderQueue import RenderQueue
+from Camera import Camera
+from GLBuffer import VAO, VBO, EBO, Texture, textureState
 from Vivarium import Vivarium
 from Quaternion import Quaternion
+from SimulationClock import SimulationClock
 import GLUtility
 
 
@@ -63,6 +70,11 @@ except ImportError:
     raise ImportError("Required dependency PyOpenGL not present")
 
 
+def _cameraProperty(name):
+    """ a Sketch attribute that reads and writes the attribute of the same name of its camera """
+    return property(lambda self: getattr(self.camera, name), lambda self, value: setattr(self.camera, name, value))
+
+
 class Sketch(CanvasBase):
     """
     Drawing methods and interrupt methods will be implemented in this class.
@@ -97,21 +109,21 @@ class Sketch(CanvasBase):
 
     texture = None
     shaderProg = None
+    instancedProg = None  # GLProgram: instanced variant drawing the primitive shapes
+    instancedRenderer = None  # InstancedRenderer
+    renderQueue = None  # RenderQueue: the other draws of each frame, sorted by GL state
+    levelOfDetail = None  # LevelOfDetail: switches distant shapes to their low poly variant
+    frustumCuller = None  # FrustumCuller: skips the creatures outside the view
     glutility = None
 
     frameCount = 0
 
-    lookAtPt = None
-    upVector = None
-    # use these three to control camera position, mainly used in mouse dragging
-    cameraDis = None
-    cameraTheta = None  # theta on horizontal sphere cut, in range [0, 2pi]
-    cameraPhi = None  # in range [-pi, pi], for smooth purpose
-
-    viewMat = None
-    perspMat = None
+    # the camera parameters below (lookAtPt, upVector, cameraDis, cameraTheta, cameraPhi) and the viewMat and
+    # perspMat matrices are properties delegating to this camera, which only rebuilds the matrices when they change
+    camera = None  # Camera
 
     pauseScene = False
+    clock = None  # SimulationClock: how many simulation steps each frame runs
 
     # If you are having trouble rotating the camera, try increasing this parameter
     # (Windows users with trackpads may need this)
@@ -139,11 +151,30 @@ class Sketch(CanvasBase):
         self.components = []
 
         # add components to top level
+        self.camera = Camera()
         self.resetView()
 
         self.glutility = GLUtility.GLUtility()
         self.backgroundColor = ColorType.BLUEGREEN
 
+        # the simulation runs on its own fixed timestep, however often frames get painted
+        self.clock = SimulationClock()
+
+    lookAtPt = _cameraProperty("lookAtPt")
+    upVector = _cameraProperty("upVector")
+    # use these three to control camera position, mainly used in mouse dragging
+    cameraDis = _cameraProperty("cameraDis")
+    cameraTheta = _cameraProperty("cameraTheta")  # theta on horizontal sphere cut, in range [0, 2pi]
+    cameraPhi = _cameraProperty("cameraPhi")  # in range [-pi, pi], for smooth purpose
+
+    @property
+    def viewMat(self):
+        return self.camera.viewMat
+
+    @property
+    def perspMat(self):
+        return self.camera.perspMat
+
     def resetView(self):
         self.lookAtPt = [0, 0, 0]
         self.upVector = [0, 1, 0]
@@ -156,6 +187,12 @@ class Sketch(CanvasBase):
 
         self.shaderProg = GLProgram()
         self.shaderProg.compile()
+        self.instancedProg = GLProgram(instanced=True)
+        self.instancedProg.compile()
+
+        # buffers and bindings cached for an earlier GL context are gone with it
+        meshCache.clear()
+        textureState.forget()
 
         # instantiate models, this can only be done with a compiled GL program
         self.vivarium = Vivarium(self, self.shaderProg) 
@@ -163,6 +200,11 @@ class Sketch(CanvasBase):
         self.topLevelComponent.clear()
         self.topLevelComponent.addChild(self.vivarium)
         self.topLevelComponent.initialize()
+        # shapes sharing a primitive are drawn together, one instanced draw call per primitive
+        self.instancedRenderer = InstancedRenderer(self.instancedProg, self.topLevelComponent)
+        self.renderQueue = RenderQueue()
+        self.levelOfDetail = LevelOfDetail(self.topLevelComponent)
+        self.frustumCuller = FrustumCuller(self.topLevelComponent)
 
         self.components = self.vivarium.components
 
@@ -173,21 +215,14 @@ class Sketch(CanvasBase):
         # enable depth checking
         gl.glEnable(gl.GL_DEPTH_TEST)
 
-        # set basic viewing matrix
-        self.perspMat = self.glutility.perspective(45, self.size.width, self.size.height, 0.01, 100)
-        self.shaderProg.setMat4("projectionMat", self.perspMat)
-        self.shaderProg.setMat4("viewMat", self.glutility.view(self.getCameraPos(), self.lookAtPt, self.upVector))
+        # set basic viewing matrix, every program reads it from the camera's uniform buffer
+        self.camera.setViewport(self.size.width, self.size.height)
+        self.camera.releaseBuffer()
+        self.camera.upload()
         self.shaderProg.setMat4("modelMat", np.identity(4))
 
     def getCameraPos(self):
-        ct = math.cos(self.cameraTheta)
-        st = math.sin(self.cameraTheta)
-        cp = math.cos(self.cameraPhi)
-        sp = math.sin(self.cameraPhi)
-        result = [self.lookAtPt[0] + self.cameraDis * ct * cp,
-                  self.lookAtPt[1] + self.cameraDis * sp,
-                  self.lookAtPt[2] + self.cameraDis * st * cp]
-        return result
+        return self.camera.position()
 
     def OnResize(self, event):
         contextAttrib = glcanvas.GLContextAttrs()
@@ -219,14 +254,33 @@ class Sketch(CanvasBase):
         gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
 
         # These are per-frame updates to the shader! Update the viewing matrix and the joint transforms
-        self.viewMat = self.glutility.view(self.getCameraPos(), self.lookAtPt, self.upVector)
-        self.shaderProg.setMat4("viewMat", self.viewMat)
-
-        self.topLevelComponent.update(np.identity(4))
-        self.topLevelComponent.draw(self.shaderProg)
-
-        # perform the next step of the animation
-        self.vivarium.animationUpdate()
+        # the camera is only uploaded when it moved since the last frame
+        self.camera.upload()
+
+        # perform as many steps of the animation as the time since the last frame calls for
+        if self.pauseScene:
+            # paused creatures stay where the last step left them
+            self.clock.hold()
+        for _ in range(self.clock.advance()):
+            self.vivarium.animationUpdate()
+
+        # draw the creatures part of the way between the last two simulation steps
+        with self.vivarium.interpolated(self.clock.alpha()):
+            self.topLevelComponent.update(np.identity(4))
+            # creatures outside the view are flagged, and none of the draws below touch them
+            self.frustumCuller.update(self.camera.frustumPlanes())
+            # shapes switching mesh move to another instanced batch
+            if self.levelOfDetail.update(self.getCameraPos(), self.camera.fov, self.camera.height):
+                self.instancedRenderer.rekey(self.levelOfDetail.switched)
+            # the instanced renderer flags the components it draws, so it goes first and the queue skips them
+            self.instancedRenderer.draw()
+            self.renderQueue.collect(self.topLevelComponent, self.shaderProg, self.getCameraPos())
+            self.renderQueue.sort()
+            self.renderQueue.execute()
+        if self.debug > 1:
+            print(f"creatures culled {self.frustumCuller.culledNum}, drawn {self.frustumCuller.drawnNum}; "
+                  f"draw calls {self.instancedRenderer.drawCalls} instanced "
+                  f"({self.instancedRenderer.instanceNum} instances), {self.renderQueue.drawCalls} queued")
 
         self.SwapBuffers()
 
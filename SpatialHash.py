@@ -0,0 +1,179 @@
+"""
+Uniform grid spatial hash used as the broadphase for creature collision and proximity checks.
+The tank volume is cut into cubic cells at least as large as the longest interaction distance, so two creatures
+can only interact if they sit in the same or in adjacent cells. Instead of testing every creature against every
+other one, the interaction pass only looks at the candidate pairs the grid hands out.
+
+Rows are kept sorted by cell. When creatures move, only those that crossed a cell boundary are taken out of the
+sorted order and inserted back at their new cell, everything else stays where it is.
+"""
+
+import math
+import numpy as np
+
+
+class SpatialHash:
+    """
+    Grid over a box centered at the origin, hashing rows of a position array to cells
+    """
+    cell_size = None  # float: edge length of a cell
+    origin = None  # ndarray (3,): lowest corner of the grid
+    shape = None  # ndarray<int64> (3,): number of cells along x, y and z
+
+    cells = None  # ndarray<int64> (n,): cell key of every row
+    order = None  # ndarray<int64> (n,): rows sorted by cell key
+    sortedCells = None  # ndarray<int64> (n,): cell key of every entry of order
+
+    # the cell itself and half of its neighbors, so that each pair of adjacent cells is only visited once
+    NEIGHBOR_OFFSETS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                        if (dx, dy, dz) > (0, 0, 0)]
+
+    def __init__(self, tank_dimensions, cell_size):
+        """
+        :param tank_dimensions: size of the volume along x, y and z, centered at the origin
+        :type tank_dimensions: list
+        :param cell_size: edge length of a cell, should not be less than the longest interaction distance
+        :type cell_size: float
+        """
+        if cell_size <= 0:
+            raise ValueError("cell size of a spatial hash should be positive")
+        self.cell_size = float(cell_size)
+        dimensions = np.array(tank_dimensions, dtype=np.float64)
+        self.origin = -dimensions / 2
+        self.shape = np.array([max(1, math.ceil(d / self.cell_size)) for d in dimensions], dtype=np.int64)
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forget all rows, the next update rebuilds the hash from scratch. Call this when rows are added, removed
+        or reordered.
+        """
+        self.cells = None
+        self.order = None
+        self.sortedCells = None
+
+    def cellCoords(self, positions):
+        # positions outside the grid are clamped to the border cells, which never loses a close pair
+        coords = np.floor((positions - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(coords, 0, self.shape - 1)
+
+    def cellKeys(self, positions):
+        coords = self.cellCoords(positions)
+        return (coords[:, 0] * self.shape[1] + coords[:, 1]) * self.shape[2] + coords[:, 2]
+
+    def update(self, positions):
+        """
+        Bring the hash up to date with the current positions, moving only the rows that changed cell
+
+        :param positions: position of every row
+        :type positions: numpy.ndarray
+        :return: number of rows that changed cell
+        :rtype: int
+        """
+        keys = self.cellKeys(positions)
+        if self.cells is None or len(self.cells) != len(keys):
+            self.order = np.argsort(keys, kind="stable")
+            self.sortedCells = keys[self.order]
+            self.cells = keys
+            return len(keys)
+
+        moved = np.flatnonzero(keys != self.cells)
+        if len(moved) == 0:
+            return 0
+        movedMask = np.zeros(len(keys), dtype=bool)
+        movedMask[moved] = True
+        keep = ~movedMask[self.order]
+        order = self.order[keep]
+        sortedCells = self.sortedCells[keep]
+
+        newKeys = keys[moved]
+        byKey = np.argsort(newKeys, kind="stable")
+        moved = moved[byKey]
+        newKeys = newKeys[byKey]
+        at = np.searchsorted(sortedCells, newKeys)
+        self.order = np.insert(order, at, moved)
+        self.sortedCells = np.insert(sortedCells, at, newKeys)
+        self.cells = keys
+        return len(moved)
+
+    @staticmethod
+    def _expandRanges(starts, ends):
+        """ for every k, enumerate starts[k] .. ends[k]-1; returns (k, value) for each enumerated value """
+        counts = np.maximum(ends - starts, 0)
+        total = int(counts.sum())
+        source = np.repeat(np.arange(len(starts)), counts)
+        firsts = np.cumsum(counts) - counts
+        values = np.repeat(starts, counts) + np.arange(total) - np.repeat(firsts, counts)
+        return source, values
+
+    def candidatePairs(self):
+        """
+        Every pair of rows sitting in the same or in adjacent cells, each pair once.
+        update() must have been called since the last change to the positions.
+
+        :return: arrays (i, j) of row indices with i < j
+        :rtype: tuple
+        """
+        if self.order is None or len(self.order) < 2:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        sortedCells = self.sortedCells
+        positionInOrder = np.arange(len(sortedCells))
+        cellEnds = np.searchsorted(sortedCells, sortedCells, side="right")
+
+        # rows in the same cell: pair each entry with the entries after it in that cell
+        source, target = self._expandRanges(positionInOrder + 1, cellEnds)
+        pairsA = [source]
+        pairsB = [target]
+
+        sx = sortedCells // (self.shape[1] * self.shape[2])
+        sy = (sortedCells // self.shape[2]) % self.shape[1]
+        sz = sortedCells % self.shape[2]
+        for dx, dy, dz in self.NEIGHBOR_OFFSETS:
+            nx, ny, nz = sx + dx, sy + dy, sz + dz
+            inside = (nx >= 0) & (nx < self.shape[0]) & (ny >= 0) & (ny < self.shape[1]) & \
+                     (nz >= 0) & (nz < self.shape[2])
+            entries = positionInOrder[inside]
+            neighbor = (nx[inside] * self.shape[1] + ny[inside]) * self.shape[2] + nz[inside]
+            starts = np.searchsorted(sortedCells, neighbor, side="left")
+            ends = np.searchsorted(sortedCells, neighbor, side="right")
+            source, target = self._expandRanges(starts, ends)
+            pairsA.append(entries[source])
+            pairsB.append(target)
+
+        a = self.order[np.concatenate(pairsA)]
+        b = self.order[np.concatenate(pairsB)]
+        return np.minimum(a, b), np.maximum(a, b)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from CreatureStore import CreatureStore
+    import Interaction
+
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 50000]
+    tank = [12, 12, 12]
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        store = CreatureStore(n)
+        for k in range(n):
+            store.allocate(None)
+        store.positions[:n] = (rng.random((n, 3)) - 0.5) * 11
+        store.velocities[:n] = (rng.random((n, 3)) - 0.5) * Interaction.SPEED
+        store.radii[:n] = 0.05
+        store.species[:n] = np.where(np.arange(n) % 4 == 0, Interaction.PREDATOR_SPECIES, Interaction.PREY_SPECIES)
+        store.moving[:n] = True
+        grid = SpatialHash(tank, Interaction.maxInteractionDistance(store))
+
+        grid.update(store.positions[:n])
+        store.positions[:n] += store.velocities[:n]
+        t1 = time.time()
+        dense = Interaction.nearbyPairs(store)
+        denseTime = time.time() - t1
+        t1 = time.time()
+        movedNum = grid.update(store.positions[:n])
+        hashed = Interaction.nearbyPairs(store, broadphase=grid)
+        hashTime = time.time() - t1
+        print(f"N={n}: all pairs {denseTime * 1000:.1f}ms, spatial hash {hashTime * 1000:.1f}ms "
+              f"({movedNum} rows changed cell, {len(dense[0])} / {len(hashed[0])} close pairs)")
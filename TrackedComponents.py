@@ -0,0 +1,198 @@
+"""
+Components of a tree followed through structure changes, for the passes that work on some of the components under a
+root every frame (LevelOfDetail, FrustumCuller, InstancedRenderer).
+A StructureFollower walks the whole tree once, then replays the changes its StructureCursor reports: a subtree
+joining the tree is walked for the components to take in, and a subtree leaving it for the components to drop, so a
+creature spawning or being eaten costs time in the size of its own subtree only. The components a pass works on are
+kept in TrackedComponents lists, with NumPy columns of per-component data that follow every change of the list.
+"""
+
+import numpy as np
+
+from Component import Component, StructureCursor
+
+
+class TrackedComponents:
+    """
+    A list of components, with NumPy columns holding one row per component and the row of each component in the
+    SceneCompiler holding them all. Removing a component moves the last one into its place, in the list and in every
+    column alike.
+    """
+    components = None  # list<Component>
+    index = None  # dict<Component, int>: position of each component in components
+    columns = None  # dict<str, ndarray>: per-component data, one row per component
+    scene = None  # SceneCompiler holding every component, None if they are not all compiled in the same one
+    rows = None  # ndarray<int64>: row of each component in scene
+    layoutVersion = None  # SceneCompiler.layoutVersion of scene when rows were read
+    rowsStale = False  # whether some components were added without a row in scene, so rows must be read again
+
+    def __init__(self, components=(), **columns):
+        """
+        :param components: the components to start with
+        :type components: list
+        :param columns: one array per column name, with one row per component, typed as the column will be
+        :type columns: numpy.ndarray
+        """
+        self.reset(components, **columns)
+
+    def __len__(self):
+        return len(self.components)
+
+    def __contains__(self, component):
+        return component in self.index
+
+    def reset(self, components, **columns):
+        """
+        Replace every component and column
+
+        :param components: the new components
+        :type components: list
+        :param columns: one array per column name, with one row per component
+        :type columns: numpy.ndarray
+        """
+        self.components = list(components)
+        self.index = {c: i for i, c in enumerate(self.components)}
+        self.columns = {name: np.asarray(values) for name, values in columns.items()}
+        self.readRows()
+
+    def readRows(self):
+        """ Find the scene compiling every component, and the row of each component in it """
+        scenes = {c.scene for c in self.components}
+        self.scene = scenes.pop() if len(scenes) == 1 else None
+        if self.scene is not None:
+            self.rows = np.array([c.sceneRow for c in self.components], dtype=np.int64)
+            self.layoutVersion = self.scene.layoutVersion
+        else:
+            self.rows = None
+        self.rowsStale = False
+
+    def sceneRows(self):
+        """
+        :return: the row of every component in scene, None if they are not all compiled in one scene
+        :rtype: numpy.ndarray
+        """
+        if self.rowsStale or (self.scene is not None and self.scene.layoutVersion != self.layoutVersion):
+            # the scene was compiled again, or components joined without a row
+            self.readRows()
+        if self.scene is None or not self.components or self.components[0].scene is not self.scene:
+            return None
+        return self.rows
+
+    def extend(self, components, **columns):
+        """
+        Append components that are not in the list yet
+
+        :param components: the components to append
+        :type components: list
+        :param columns: the rows of the new components in every column
+        :type columns: numpy.ndarray
+        """
+        if not components:
+            return
+        for i, component in enumerate(components, len(self.components)):
+            self.index[component] = i
+        self.components.extend(components)
+        for name, values in columns.items():
+            self.columns[name] = np.concatenate([self.columns[name], values])
+        if self.scene is not None and all(c.scene is self.scene for c in components):
+            self.rows = np.concatenate([self.rows, np.array([c.sceneRow for c in components], dtype=np.int64)])
+        else:
+            self.rowsStale = True
+
+    def remove(self, component):
+        """
+        Drop a component. The last component moves into its place.
+
+        :type component: Component
+        :return: whether component was in the list
+        :rtype: bool
+        """
+        i = self.index.pop(component, None)
+        if i is None:
+            return False
+        last = len(self.components) - 1
+        if i != last:
+            moved = self.components[last]
+            self.components[i] = moved
+            self.index[moved] = i
+            for array in self.columns.values():
+                array[i] = array[last]
+            if self.rows is not None:
+                self.rows[i] = self.rows[last]
+        self.components.pop()
+        for name, array in self.columns.items():
+            self.columns[name] = array[:last]
+        if self.rows is not None:
+            self.rows = self.rows[:last]
+        return True
+
+
+class StructureFollower:
+    """
+    Base of the passes that keep track of some components under root. Subclasses implement clear(), add() and
+    remove(); collect() and sync() drive them.
+    """
+    root = None  # Component: top of the tree to follow
+    cursor = None  # StructureCursor: structure changes not followed yet
+
+    def __init__(self, root):
+        """
+        :param root: components under this one are followed from now on
+        :type root: Component
+        """
+        if not isinstance(root, Component):
+            raise TypeError(f"{type(self).__name__} root should be a Component")
+        self.root = root
+        self.cursor = StructureCursor()
+
+    def clear(self):
+        """ Forget every component taken in so far """
+        raise NotImplementedError
+
+    def add(self, child, ancestors):
+        """
+        Take in the components of a subtree under root
+
+        :param child: top of the subtree
+        :type child: Component
+        :param ancestors: child, its parent, and so on up to root, as returned by Component.ancestorsUpTo
+        :type ancestors: list
+        """
+        raise NotImplementedError
+
+    def remove(self, child):
+        """
+        Drop the components of a subtree that left the tree
+
+        :param child: top of the subtree
+        :type child: Component
+        """
+        raise NotImplementedError
+
+    def collect(self):
+        """
+        Walk the whole tree under root again. Runs by itself from sync() when the changes since the last one are not
+        known.
+        """
+        self.clear()
+        self.add(self.root, [self.root])
+        self.cursor.skip()
+
+    def sync(self):
+        """
+        Follow the children added and removed anywhere since the last call, walking only the subtrees that changed
+        """
+        if not self.cursor.pending():
+            return
+        changes = self.cursor.changes()
+        if changes is None:
+            self.collect()
+            return
+        for parent, child, added in changes:
+            if not added:
+                self.remove(child)
+                continue
+            # a child that left the tree again, or was added outside root, is skipped
+            ancestors = child.ancestorsUpTo(self.root)
+            if ancestors is not None:
+                self.add(child, ancestors)
@@ -1,5 +1,10 @@
 """
 All creatures should be added to Vivarium. Some help functions to add/remove creature are defined here.
+Creatures are registered with an EntityRegistry, and the vivarium listens to it to keep the tank's children in the
+same order as the rows of the registry's store, so removing a creature swap-removes it from the scene tree and the
+store together in O(1).
+A Vivarium built without a shader program runs headless: creatures carry no GPU resources and the
+simulation can be driven with run() outside of any wx window or GL context.
 Created on 20181028
 
 :author: micou(Zezhou Sun)
@@ -8,21 +13,41 @@ Created on 20181028
 modified by Daniel Scrivener
 """
 
+import math
+import time
+from contextlib import contextmanager
+
 import numpy as np
 import ModelLinkage as ml
+import Interaction
 from Point import Point
 from Component import Component
 from ModelTank import Tank
-from EnvironmentObject import EnvironmentObject
+from EnvironmentObject import EnvironmentObject, facingRotations
+from CreatureStore import CreatureStore
+from SpatialHash import SpatialHash
+from Flocking import Flocking
+from EntityRegistry import EntityRegistry
+from SceneCompiler import SceneCompiler
+
+REORIENT_ANGLE = 2  # degrees a creature's heading must turn away from the one it faces before it is re-oriented
 
 class Vivarium(Component):
     """
     The Vivarium for our animation
     """
-    components = None  # List
     parent = None  # class that have current context
     tank = None
     tank_dimensions = None
+    store = None  # CreatureStore: simulation state of every creature in the tank
+    registry = None  # EntityRegistry: ids of the creatures in store and their pending removals
+    rng = None  # numpy.random.Generator: randomness of the simulation
+    broadphase = None  # SpatialHash over the creatures in store
+    flocking = None  # Flocking: group behavior of the species that flock together
+    headless = False  # True when there is no shader program, so nothing can be drawn
+    phaseTimes = None  # dict<str, float>: seconds spent in each phase of animationUpdate, collected when not None
+    components = None  # list: the tank followed by every creature in it, kept up to date by the registry. Read only,
+    # add and remove creatures with addNewObjInTank and delObjInTank
 
     ##### BONUS 5(TODO 5 for CS680 Students): Feed your creature
     # Requirements:
@@ -32,21 +57,41 @@ class Vivarium(Component):
     #     the vivarium and remain there within the tank until eaten.
     #     * The food should disappear once it has been eaten. Food is eaten by the first creature that touches it.
 
-    def __init__(self, parent, shaderProg):
+    def __init__(self, parent=None, shaderProg=None, dtype=np.float64, seed=None, populate=True):
+        """
+        :param parent: the canvas that owns the GL context, None when running headless
+        :type parent: Sketch
+        :param shaderProg: compiled shader program, None to build simulation-only creatures
+        :type shaderProg: GLProgram
+        :param dtype: floating point type of the creature state store
+        :type dtype: numpy.float32 or numpy.float64
+        :param seed: seed for the simulation's random generator, to make batch runs reproducible
+        :type seed: int
+        :param populate: add the default predators and prey, leave the tank empty otherwise
+        :type populate: bool
+        """
         self.parent = parent
         self.shaderProg = shaderProg
+        self.headless = shaderProg is None
+        self.store = CreatureStore(dtype=dtype)
+        self.registry = EntityRegistry(self.store)
+        self.registry.listeners.append(self)
+        self.rng = np.random.default_rng(seed)
 
         self.tank_dimensions = [12, 12, 12]
+        self.flocking = Flocking(self.tank_dimensions)
         tank = Tank(Point((0,0,0)), shaderProg, self.tank_dimensions)
         super(Vivarium, self).__init__(Point((0, 0, 0)))
+        # transforms of everything in the vivarium are computed in batches by a flattened copy of the tree
+        SceneCompiler(self)
 
         # Build relationship
         self.addChild(tank)
         self.tank = tank
-
-        # Store all components in one list, for us to access them later
         self.components = [tank]
 
+        if not populate:
+            return
         self.addNewObjInTank(ml.Linkage(parent, Point((0,0,0)), shaderProg))
         self.addNewObjInTank(ml.Linkage2(parent, Point((2,2,2)), shaderProg))        
         self.addNewObjInTank(ml.Linkage2(parent, Point((0,2,0)), shaderProg))
@@ -64,40 +109,196 @@ class Vivarium(Component):
         """
         Update all creatures in vivarium
         """
-        # Create a list to store creatures that need to be removed
-        creatures_to_remove = []
-        
-        for c in self.components[::-1]:
-            if isinstance(c, EnvironmentObject):
-                c.animationUpdate()
-                c.stepForward(self.components, self.tank_dimensions, self)
-                
-                # Check if the creature should be removed
-                if c.env_obj_list is not None and c not in c.env_obj_list:
-                    creatures_to_remove.append(c)
-                    
+        start = time.perf_counter()
+        n = self.store.count
+        self.store.previous_positions[:n] = self.store.positions[:n]
+
+        for c in self.store.owners:
+            c.animationUpdate()
+        start = self._phase("animation", start)
+
+        # flock mates steer together, then all creatures move and interact in vectorized passes
+        turned = self.flocking.steer(self.store)
+        turned |= Interaction.integrate(self.store, self.tank_dimensions, self.rng)
+        start = self._phase("movement", start)
+
+        pairs = Interaction.nearbyPairs(self.store, broadphase=self.getBroadphase())
+        bounced, eaten = Interaction.interact(self.store, pairs)
+        turned |= bounced
+        start = self._phase("collision", start)
+
+        # creatures face the direction they are moving, once it turned far enough from the one they face
+        rows = self.reorient(turned)
+        owners = self.store.owners
+        for row, rotation in zip(rows.tolist(), facingRotations(self.store.headings[rows])):
+            owners[row].setFacing(rotation)
+        start = self._phase("orientation", start)
+
+        self.markMoved()
+
         # Remove creatures after the iteration
-        for creature in creatures_to_remove:
-            self.delObjInTank(creature)
-        
+        for row in eaten:
+            self.registry.despawn(self.store.owners[row].entity_id)
+        if self.registry.flush():
+            if self.broadphase is not None:
+                self.broadphase.invalidate()
+        start = self._phase("removal", start)
+
+        # one pass over the scene recomputes the transforms of everything flagged dirty during the step
         self.update()
+        self._phase("transform", start)
+
+    def reorient(self, turned):
+        """
+        Pick the creatures to turn towards their new heading, and record that heading as the one they face. Flock
+        mates adjust their velocity a little on every step, so only headings more than REORIENT_ANGLE away from the
+        faced one are worth re-orienting the creature for.
+
+        :param turned: mask over the store rows whose velocity changed in this step
+        :type turned: numpy.ndarray
+        :return: rows to re-orient
+        :rtype: numpy.ndarray
+        """
+        rows = np.flatnonzero(turned)
+        velocities = self.store.velocities[rows]
+        speeds = np.linalg.norm(velocities, axis=1)
+        headings = velocities / np.maximum(speeds, np.finfo(velocities.dtype).tiny)[:, None]
+        facing = np.einsum("ij,ij->i", headings, self.store.headings[rows])
+        far = (facing < math.cos(math.radians(REORIENT_ANGLE))) & (speeds > 0)
+        rows = rows[far]
+        self.store.headings[rows] = headings[far]
+        return rows
+
+    def markMoved(self):
+        """
+        Flag the transforms of the creatures whose position differs from the one before the last step
+        """
+        n = self.store.count
+        moved = np.any(self.store.positions[:n] != self.store.previous_positions[:n], axis=1)
+        owners = self.store.owners
+        for row in np.flatnonzero(moved):
+            owners[row].translationChanged()
+
+    def _phase(self, name, start):
+        # add the time since start to the named phase, and return the current time as the start of the next one
+        now = time.perf_counter()
+        if self.phaseTimes is not None:
+            self.phaseTimes[name] = self.phaseTimes.get(name, 0.0) + now - start
+        return now
+
+    def spawned(self, obj):
+        """
+        Registry listener: a creature joined the store, at its last row, so it goes last in the tank as well
+        """
+        self.tank.children.append(obj)
+        self.tank.adopt(obj)
+        self.components.append(obj)
+
+    def despawned(self, obj, row):
+        """
+        Registry listener: a creature left the store, and the last row moved into the one it held
+        """
+        self.swapRemove(self.tank.children, row, obj)
+        self.swapRemove(self.components, row + 1, obj)
+        Component.structureChanged(self.tank, obj, False)
+
+    @staticmethod
+    def swapRemove(items, index, obj):
+        """
+        Remove obj from items the way CreatureStore.release frees a row, moving the last item into its place.
+        Falls back to a plain search if obj is not at index, in case items was changed by other means.
+        """
+        if index < len(items) and items[index] is obj:
+            last = items.pop()
+            if index < len(items):
+                items[index] = last
+        else:
+            items.remove(obj)
+
+    @contextmanager
+    def interpolated(self, alpha):
+        """
+        While the with-block runs, creatures are placed alpha of the way from their position before the last
+        simulation step to their current one. Use this to draw between two fixed size simulation steps.
+        Only positions are interpolated: orientations and joint angles are drawn as the last step left them.
+
+        :param alpha: interpolation factor, 0 for the previous step and 1 for the current one
+        :type alpha: float
+        """
+        if alpha >= 1:
+            # already where the last step left them, nothing to move or flag
+            yield
+            return
+        n = self.store.count
+        positions = self.store.positions[:n]
+        current = positions.copy()
+        # the creatures that moved in the last step are the ones shifted here
+        self.markMoved()
+        positions += (self.store.previous_positions[:n] - current) * (1 - alpha)
+        try:
+            yield
+        finally:
+            positions[:] = current
+            self.markMoved()
+
+    def getBroadphase(self):
+        """
+        The spatial hash over the tank, rebuilt when a creature can now reach further than one of its cells
+        """
+        reach = Interaction.maxInteractionDistance(self.store)
+        if reach <= 0:
+            return None
+        if self.broadphase is None or self.broadphase.cell_size < reach:
+            self.broadphase = SpatialHash(self.tank_dimensions, reach)
+        return self.broadphase
+
+    def run(self, steps):
+        """
+        Advance the simulation by a number of steps in a tight loop, without waiting for paint events.
+        This is the driver for headless batch runs, but works just as well on a drawable vivarium.
+
+        :param steps: number of simulation steps to take
+        :type steps: int
+        :return: None
+        """
+        for _ in range(steps):
+            self.animationUpdate()
 
     def delObjInTank(self, obj):
-        if isinstance(obj, Component):
-            try:
-                self.tank.children.remove(obj)
-                if obj in self.components:
-                    self.components.remove(obj)
-                del obj
-            except ValueError:
-                # Handle the case where obj is not found in the list
-                pass
+        """
+        Remove a creature from the tank at once. During a simulation step use registry.despawn instead, which
+        defers the removal to the end of the step.
+        """
+        if isinstance(obj, EnvironmentObject) and obj.registry is self.registry:
+            self.registry.despawn(obj.entity_id)
+            self.registry.flush()
+            if self.broadphase is not None:
+                self.broadphase.invalidate()
+        elif isinstance(obj, Component) and obj in self.children:
+            self.children.remove(obj)
+            Component.structureChanged(self, obj, False)
 
     def addNewObjInTank(self, newComponent):
-        if isinstance(newComponent, Component):
-            self.tank.addChild(newComponent)
-            self.components.append(newComponent)
         if isinstance(newComponent, EnvironmentObject):
-            # add environment components list reference to this new object's
-            newComponent.env_obj_list = self.components
+            # registering moves its state into the tank's shared store, and spawned() makes it a child of the tank
+            self.registry.spawn(newComponent)
+            if newComponent.flock_params is not None:
+                self.flocking.setSpecies(newComponent.species_id, newComponent.flock_params)
+            if self.broadphase is not None:
+                self.broadphase.invalidate()
+        elif isinstance(newComponent, Component):
+            # the tank's children are reserved for creatures, other components hang off the vivarium, which has
+            # the same frame as the tank
+            self.addChild(newComponent)
+
+
+if __name__ == "__main__":
+    import sys
 
+    # headless batch run: python Vivarium.py [steps]
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    vivarium = Vivarium()
+    t1 = time.time()
+    vivarium.run(steps)
+    t2 = time.time()
+    print(f"{steps} steps in {t2 - t1:.3f}s ({steps / max(t2 - t1, 1e-9):.1f} steps/s)")
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from CreatureStore import CreatureStore
+from EntityRegistry import EntityRegistry
+from EnvironmentObject import EnvironmentObject
+from Point import Point
+
+
+def makeCreature(x):
+    creature = EnvironmentObject()
+    creature.currentPos = Point((x, 0, 0))
+    return creature
+
+
+def testReleaseMovesLastRowIntoHole():
+    store = CreatureStore(capacity=2)
+    owners = [makeCreature(x) for x in range(5)]
+    for owner in owners:
+        owner.attachStore(store)
+    serials = store.serials[:store.count].copy()
+
+    store.release(owners[1].store_row)
+    assert store.count == 4
+    assert store.owners == [owners[0], owners[4], owners[2], owners[3]]
+    assert owners[4].store_row == 1
+    assert store.positions[1, 0] == 4
+    assert store.serials[1] == serials[4]
+    for row, owner in enumerate(store.owners):
+        assert owner.store_row == row
+        assert owner.currentPos.coords[0] == owners.index(owner)
+
+    with pytest.raises(IndexError):
+        store.release(4)
+
+
+def testReleaseLastRow():
+    store = CreatureStore()
+    owners = [makeCreature(x) for x in range(3)]
+    for owner in owners:
+        owner.attachStore(store)
+    store.release(2)
+    assert store.owners == owners[:2]
+    assert [owner.store_row for owner in owners[:2]] == [0, 1]
+
+
+def testDespawnWaitsForFlush():
+    registry = EntityRegistry(CreatureStore())
+    creatures = [makeCreature(x) for x in range(4)]
+    ids = [registry.spawn(creature) for creature in creatures]
+
+    assert registry.despawn(ids[0])
+    assert len(registry) == 4 and registry.get(ids[0]) is creatures[0]
+    removed = registry.flush()
+    assert removed == [creatures[0]]
+    assert len(registry) == 3
+    # the last row took the place of the removed one
+    assert registry.rowOf(ids[3]) == 0
+    assert list(registry) == [creatures[3], creatures[1], creatures[2]]
+    # the removed creature keeps its state in a private store
+    assert creatures[0].store is not registry.store and creatures[0].currentPos.coords[0] == 0
+    assert creatures[0].entity_id is None and creatures[0].registry is None
+
+
+def testStaleIdsNeverResolve():
+    registry = EntityRegistry(CreatureStore())
+    first = makeCreature(0)
+    oldId = registry.spawn(first)
+    registry.despawn(oldId)
+    registry.flush()
+
+    second = makeCreature(1)
+    newId = registry.spawn(second)
+    # the slot is reused under a new generation
+    assert EntityRegistry.slotOf(newId) == EntityRegistry.slotOf(oldId)
+    assert EntityRegistry.generationOf(newId) == EntityRegistry.generationOf(oldId) + 1
+    assert registry.get(oldId) is None and registry.rowOf(oldId) is None
+    assert oldId not in registry and newId in registry
+    assert registry.get(newId) is second
+    assert not registry.despawn(oldId)
+    assert registry.flush() == []
+    assert len(registry) == 1
+
+
+def testSpeciesSetsFollowSpawnAndDespawn():
+    registry = EntityRegistry(CreatureStore())
+    creatures = [makeCreature(x) for x in range(3)]
+    for species, creature in zip((1, 2, 2), creatures):
+        creature.species_id = species
+    ids = [registry.spawn(creature) for creature in creatures]
+    assert registry.species(2) == {ids[1], ids[2]}
+    registry.despawn(ids[1])
+    registry.flush()
+    assert registry.species(2) == {ids[2]}
+    assert registry.species(1) == {ids[0]}
+
+
+def testListenersSeeEveryRemovalWithItsRow():
+    registry = EntityRegistry(CreatureStore())
+
+    class Mirror:
+        # a list kept in row order, as Vivarium keeps the tank's children
+        def __init__(self):
+            self.items = []
+
+        def spawned(self, obj):
+            self.items.append(obj)
+
+        def despawned(self, obj, row):
+            last = self.items.pop()
+            if last is not obj:
+                self.items[row] = last
+
+    mirror = Mirror()
+    registry.listeners.append(mirror)
+    creatures = [makeCreature(x) for x in range(6)]
+    ids = [registry.spawn(creature) for creature in creatures]
+    for entity_id in ids[::2]:
+        registry.despawn(entity_id)
+    registry.flush()
+    assert mirror.items == registry.store.owners
+    assert np.array_equal(registry.store.positions[:3, 0], [o.currentPos.coords[0] for o in mirror.items])
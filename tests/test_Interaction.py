@@ -0,0 +1,145 @@
+import numpy as np
+
+import Interaction
+from CreatureStore import CreatureStore
+from Point import Point
+from SpatialHash import SpatialHash
+
+TANK = [12, 12, 12]
+
+
+class Creature:
+    """ the per-object state the original stepForward loops worked on """
+    def __init__(self, pos, speed, radius, species_id):
+        self.currentPos = Point(pos)
+        self.translation_speed = Point(speed)
+        self.bound_radius = radius
+        self.species_id = species_id
+
+
+def loopStepForward(creatures, tank_dimensions):
+    # the nested loops of Linkage.stepForward / Linkage2.stepForward, without orientation and printing
+    for c in creatures:
+        new_position = c.currentPos + c.translation_speed
+        tank_center = Point((0, 0, 0))
+        if new_position.distance(tank_center) + c.bound_radius > max(tank_dimensions) / 2:
+            n = (tank_center - new_position).normalize()
+            c.translation_speed -= 2 * n.dot(c.translation_speed) * n
+        c.currentPos += c.translation_speed
+        for other in creatures:
+            if other != c:
+                d = c.currentPos.distance(other.currentPos)
+                if c.species_id == Interaction.PREDATOR_SPECIES and d < 3 * c.bound_radius and \
+                        other.species_id == Interaction.PREY_SPECIES:
+                    c.translation_speed = (other.currentPos - c.currentPos).normalize() * Interaction.SPEED
+                if d < c.bound_radius + other.bound_radius:
+                    if c.species_id == other.species_id:
+                        n = (other.currentPos - c.currentPos).normalize()
+                        c.translation_speed -= 2 * n.dot(c.translation_speed) * n
+                        other.translation_speed -= 2 * n.dot(other.translation_speed) * n
+
+
+def makeStore(positions, velocities, radii, species, moving=None):
+    n = len(positions)
+    store = CreatureStore(n)
+    for k in range(n):
+        row = store.allocate(None)
+        store.positions[row] = positions[k]
+        store.velocities[row] = velocities[k]
+        store.radii[row] = radii[k]
+        store.species[row] = species[k]
+        store.moving[row] = True if moving is None else moving[k]
+    return store
+
+
+def step(store, broadphase=None):
+    turned = Interaction.integrate(store, TANK, np.random.default_rng(0))
+    bounced, eaten = Interaction.interact(store, Interaction.nearbyPairs(store, broadphase=broadphase))
+    return turned | bounced, eaten
+
+
+def testMovementAndWallBouncesMatchLoop():
+    rng = np.random.default_rng(1)
+    n = 200
+    # half of the creatures start against the wall, heading out
+    directions = rng.normal(size=(n, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    distances = np.where(np.arange(n) % 2 == 0, 5.98, rng.random(n) * 5)
+    positions = directions * distances[:, None]
+    velocities = directions * Interaction.SPEED + (rng.random((n, 3)) - 0.5) * 0.01
+    radii = np.full(n, 1e-4)
+    species = np.full(n, Interaction.PREY_SPECIES)
+    creatures = [Creature(positions[k], velocities[k], radii[k], species[k]) for k in range(n)]
+    store = makeStore(positions, velocities, radii, species)
+
+    for _ in range(3):
+        loopStepForward(creatures, TANK)
+        turned, eaten = step(store)
+        assert len(eaten) == 0
+    assert np.allclose(store.positions[:n], [c.currentPos.coords for c in creatures])
+    assert np.allclose(store.velocities[:n], [c.translation_speed.coords for c in creatures])
+
+
+def testChaseMatchesLoop():
+    # isolated predator and resting prey pairs, each prey within chase range of its own predator only
+    pairs = 5
+    positions, velocities, radii, species, moving = [], [], [], [], []
+    for k in range(pairs):
+        center = np.array([k * 2.0 - 4, 0, 0])
+        positions += [center, center + (0.3, 0.4, 0.1)]
+        velocities += [(0.01, 0, 0), (0, 0, 0)]
+        radii += [0.2, 0.1]
+        species += [Interaction.PREDATOR_SPECIES, Interaction.PREY_SPECIES]
+        moving += [True, False]
+    creatures = [Creature(p, v, r, s) for p, v, r, s in zip(positions, velocities, radii, species)]
+    store = makeStore(positions, velocities, radii, species, moving)
+
+    loopStepForward(creatures, TANK)
+    turned, eaten = step(store)
+    assert len(eaten) == 0
+    assert np.array_equal(np.flatnonzero(turned), np.arange(0, 2 * pairs, 2))
+    assert np.allclose(store.velocities[:2 * pairs], [c.translation_speed.coords for c in creatures])
+    assert np.allclose(np.linalg.norm(store.velocities[:2 * pairs:2], axis=1), Interaction.SPEED)
+
+
+def testPredatorChasesNearestPrey():
+    positions = [(0, 0, 0), (0.5, 0, 0), (0, 0.3, 0), (0, 0, 0.55)]
+    store = makeStore(positions, [(0, 0, 0)] * 4, [0.2, 0.05, 0.05, 0.05],
+                      [Interaction.PREDATOR_SPECIES] + [Interaction.PREY_SPECIES] * 3, [True, False, False, False])
+    step(store)
+    assert np.allclose(store.velocities[0], (0, Interaction.SPEED, 0))
+
+
+def testSameSpeciesBounceOffEachOther():
+    # two prey meeting head on each reflect once about the contact normal
+    store = makeStore([(-0.05, 0, 0), (0.05, 0, 0)], [(0.01, 0.01, 0), (-0.01, 0.01, 0)], [0.1, 0.1],
+                      [Interaction.PREY_SPECIES] * 2)
+    turned, eaten = step(store)
+    assert turned.all() and len(eaten) == 0
+    assert np.allclose(store.velocities[:2], [(-0.01, 0.01, 0), (0.01, 0.01, 0)])
+
+
+def testPreyTouchingPredatorIsEaten():
+    store = makeStore([(0, 0, 0), (0.1, 0, 0), (3, 0, 0)], [(0, 0, 0)] * 3, [0.1, 0.1, 0.1],
+                      [Interaction.PREDATOR_SPECIES, Interaction.PREY_SPECIES, Interaction.PREY_SPECIES])
+    turned, eaten = step(store)
+    assert eaten.tolist() == [1]
+    assert store.alive[:3].tolist() == [True, False, True]
+
+
+def testBroadphaseFindsSamePairs():
+    rng = np.random.default_rng(2)
+    n = 500
+    positions = (rng.random((n, 3)) - 0.5) * 8
+    radii = rng.random(n) * 0.2 + 0.05
+    store = makeStore(positions, np.zeros((n, 3)), radii, np.where(np.arange(n) % 4 == 0, 1, 2))
+    grid = SpatialHash(TANK, Interaction.maxInteractionDistance(store))
+
+    def pairSet(pairs):
+        i, j, d = pairs
+        return {(min(a, b), max(a, b)) for a, b in zip(i.tolist(), j.tolist())}
+
+    brute = Interaction.nearbyPairs(store)
+    hashed = Interaction.nearbyPairs(store, broadphase=grid)
+    assert len(brute[0]) > 0
+    assert pairSet(brute) == pairSet(hashed)
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from Component import Component
+from LevelOfDetail import LevelOfDetail
+from Point import Point
+from SceneCompiler import SceneCompiler
+from Shapes import Cube, Sphere
+
+# a 90 degree field of view on a 600 pixel viewport draws a unit radius sphere 600 / distance pixels across
+FOV = 90
+HEIGHT = 600
+
+
+@pytest.fixture
+def unitSphere(monkeypatch):
+    # a unit bounding radius, without loading the mesh asset
+    monkeypatch.setitem(LevelOfDetail.meshRadii, Sphere, 1.0)
+
+
+def makeScene(compiled):
+    root = Component(Point((0, 0, 0)))
+    sphere = Sphere(Point((0, 0, 0)), None, [1, 1, 1])
+    root.addChild(sphere)
+    # shapes without a low poly variant are left alone
+    root.addChild(Cube(Point((0, 0, 0)), None, [1, 1, 1]))
+    if compiled:
+        SceneCompiler(root)
+    root.update(np.identity(4))
+    return root, sphere
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def testHysteresis(unitSphere, compiled):
+    root, sphere = makeScene(compiled)
+    lod = LevelOfDetail(root, lowBelow=32, highAbove=40)
+
+    def lookFrom(distance):
+        return lod.update([0, 0, distance], FOV, HEIGHT)
+
+    assert lookFrom(10) == 0 and not sphere.lowPoly  # 60 pixels
+    assert lod.shapes.components == [sphere]
+    assert lookFrom(17) == 0 and not sphere.lowPoly  # 35 pixels, between the thresholds
+    assert lookFrom(20) == 1 and sphere.lowPoly  # 30 pixels
+    assert lod.switched == [sphere]
+    assert lookFrom(20) == 0 and lod.switched == []
+    # growing back between the thresholds keeps the low poly mesh
+    assert lookFrom(17) == 0 and sphere.lowPoly
+    assert lookFrom(16) == 0 and sphere.lowPoly  # 37.5 pixels
+    assert lookFrom(14) == 1 and not sphere.lowPoly  # 43 pixels
+    assert lookFrom(17) == 0 and not sphere.lowPoly
+
+
+def testScaleCountsTowardsSize(unitSphere):
+    root, sphere = makeScene(False)
+    lod = LevelOfDetail(root)
+    sphere.setCurrentScale([2, 2, 2])
+    root.update()
+    # 30 pixels unscaled, 60 pixels at twice the size
+    assert lod.update([0, 0, 20], FOV, HEIGHT) == 0 and not sphere.lowPoly
+
+
+def testFollowsShapesJoiningAndLeaving(unitSphere):
+    root, sphere = makeScene(True)
+    lod = LevelOfDetail(root)
+    lookFrom = [0, 0, 100]
+    assert lod.update(lookFrom, FOV, HEIGHT) == 1
+
+    other = Sphere(Point((0, 0, 0)), None, [1, 1, 1])
+    root.addChild(other)
+    root.update()
+    assert lod.update(lookFrom, FOV, HEIGHT) == 1 and lod.switched == [other]
+    root.children.remove(sphere)
+    Component.structureChanged(root, sphere, False)
+    root.update()
+    assert lod.update(lookFrom, FOV, HEIGHT) == 0
+    assert lod.shapes.components == [other]
+
+
+def testThresholdsMustBeOrdered():
+    with pytest.raises(ValueError):
+        LevelOfDetail(Component(Point((0, 0, 0))), lowBelow=40, highAbove=32)
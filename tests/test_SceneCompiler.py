@@ -0,0 +1,150 @@
+import random
+
+import numpy as np
+
+from Component import Component
+from Point import Point
+from Quaternion import Quaternion
+from SceneCompiler import SceneCompiler
+
+
+def buildTree(seed, size=60):
+    """ a random tree with every kind of local transform parameter set """
+    rng = random.Random(seed)
+    root = Component(Point((0, 0, 0)))
+    nodes = [root]
+    for k in range(size):
+        node = Component(Point((rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1))))
+        node.setDefaultAngle(rng.uniform(-90, 90), node.uAxis)
+        node.setCurrentAngle(rng.uniform(-90, 90), node.wAxis)
+        if k % 3 == 0:
+            node.setCurrentScale([rng.uniform(0.5, 2)] * 3)
+        if k % 5 == 0:
+            turn = np.identity(4)
+            turn[:3, :3] = ((0, -1, 0), (1, 0, 0), (0, 0, 1))
+            node.setPreRotation(turn)
+        if k % 7 == 0:
+            node.setQuaternion(Quaternion(0.9, 0.1, 0.3, 0.2))
+        if k % 4 == 0:
+            node.drawScale = [0.5, 1, 2]
+        rng.choice(nodes).addChild(node)
+        nodes.append(node)
+    return root, nodes
+
+
+def assertSameTransforms(compiledNodes, plainNodes):
+    for compiled, plain in zip(compiledNodes, plainNodes):
+        assert np.allclose(compiled.transformationMat, plain.transformationMat, atol=1e-12)
+        assert np.allclose(compiled.drawMat, plain.drawMat, atol=1e-6)
+
+
+def removeChild(parent, child):
+    parent.children.remove(child)
+    Component.structureChanged(parent, child, False)
+
+
+def testMatchesRecursiveUpdate():
+    compiledRoot, compiledNodes = buildTree(0)
+    plainRoot, plainNodes = buildTree(0)
+    scene = SceneCompiler(compiledRoot)
+    parent = np.identity(4)
+    parent[:3, 3] = (1, 2, 3)
+    compiledRoot.update(parent)
+    plainRoot.update(parent)
+    assert scene.root is compiledRoot and all(node.scene is scene for node in compiledNodes)
+    assertSameTransforms(compiledNodes, plainNodes)
+
+    rng = random.Random(1)
+    for frame in range(20):
+        # the same changes to both trees, through every kind of setter
+        for _ in range(10):
+            k = rng.randrange(1, len(compiledNodes))
+            change = rng.randrange(6)
+            value = rng.uniform(-30, 30)
+            for node in (compiledNodes[k], plainNodes[k]):
+                if change == 0:
+                    node.rotate(value, node.vAxis)
+                elif change == 1:
+                    node.setCurrentAngle(value, node.uAxis)
+                elif change == 2:
+                    node.setCurrentPosition(Point((value / 10, 0, 1)))
+                elif change == 3:
+                    node.setCurrentScale([abs(value) / 10 + 0.1] * 3)
+                elif change == 4:
+                    node.setQuaternion(Quaternion(1, value / 30, 0, 0))
+                else:
+                    # a change behind the setters' back
+                    node.wAngle = value
+                    node.markDirty()
+        compiledRoot.update(parent)
+        plainRoot.update(parent)
+        assertSameTransforms(compiledNodes, plainNodes)
+
+
+def testFollowsAddedAndRemovedSubtrees():
+    compiledRoot, compiledNodes = buildTree(2)
+    plainRoot, plainNodes = buildTree(2)
+    scene = SceneCompiler(compiledRoot)
+    compiledRoot.update()
+    plainRoot.update()
+    compiles = scene.layoutVersion
+
+    # a subtree moves away, then comes back, changed while it was out
+    parentIndex = compiledNodes.index(compiledNodes[5].parentComponent)
+    for root, nodes in ((compiledRoot, compiledNodes), (plainRoot, plainNodes)):
+        subtree = nodes[5]
+        removeChild(subtree.parentComponent, subtree)
+        subtree.parentComponent = None
+    compiledRoot.update()
+    plainRoot.update()
+    assert compiledNodes[5].scene is None and compiledNodes[5].sceneRow is None
+    for root, nodes in ((compiledRoot, compiledNodes), (plainRoot, plainNodes)):
+        nodes[5].rotate(20, nodes[5].uAxis)
+        nodes[parentIndex].addChild(nodes[5])
+    compiledRoot.update()
+    plainRoot.update()
+    assert compiledNodes[5].scene is scene
+    assertSameTransforms(compiledNodes, plainNodes)
+
+    # new creatures join, within the free rows every level starts with
+    for k in range(3):
+        for root in (compiledRoot, plainRoot):
+            node = Component(Point((k, 0, 0)))
+            node.addChild(Component(Point((0, 1, 0))))
+            root.addChild(node)
+    compiledRoot.update()
+    plainRoot.update()
+    assertSameTransforms(compiledRoot.children, plainRoot.children)
+    assertSameTransforms([c.children[0] for c in compiledRoot.children[-3:]],
+                         [c.children[0] for c in plainRoot.children[-3:]])
+    # none of this flattened the tree again
+    assert scene.layoutVersion == compiles
+
+
+def testUnknownChangeFlattensAgain():
+    root, nodes = buildTree(3)
+    scene = SceneCompiler(root)
+    root.update()
+    before = scene.layoutVersion
+    node = Component(Point((0, 0, 1)))
+    root.children.append(node)
+    node.parentComponent = root
+    Component.structureChanged()
+    root.update()
+    assert scene.layoutVersion == before + 1
+    assert scene.holds(node)
+    assert np.allclose(node.transformationMat, root.transformationMat @ node.localTransform())
+
+
+def testDetachGoesBackToRecursiveUpdate():
+    compiledRoot, compiledNodes = buildTree(4)
+    plainRoot, plainNodes = buildTree(4)
+    scene = SceneCompiler(compiledRoot)
+    compiledRoot.update()
+    scene.detach()
+    for nodes in (compiledNodes, plainNodes):
+        nodes[3].rotate(10, nodes[3].wAxis)
+    compiledRoot.update()
+    plainRoot.update()
+    assert all(node.scene is None for node in compiledNodes)
+    assertSameTransforms(compiledNodes, plainNodes)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import Interaction
+from ShardedVivarium import ShardedVivarium, populate
+from SpatialHash import SpatialHash
+
+TANK = (12, 12, 12)
+
+
+def runSingle(store, steps):
+    """ the single process loop of ShardedVivarium.py, keeping track of every creature's global id """
+    ids = np.arange(store.count)
+    grid = SpatialHash(TANK, Interaction.maxInteractionDistance(store))
+    rng = np.random.default_rng(0)
+    eaten = []
+    for _ in range(steps):
+        turned, eatenRows = Interaction.stepForward(store, TANK, rng, grid)
+        eaten.extend(ids[eatenRows].tolist())
+        keep = np.ones(store.count, dtype=bool)
+        keep[eatenRows] = False
+        store.keepRows(keep)
+        ids = ids[keep]
+    return ids, eaten
+
+
+@pytest.mark.parametrize("shardNum", [1, 3])
+def testShardsMatchSingleProcess(shardNum):
+    # fewer steps than Interaction.RETARGET_FREQUENCY, so no random heading is drawn and both runs are deterministic
+    steps = 30
+    single = populate(3000, TANK, seed=4)
+    singleIds, singleEaten = runSingle(single, steps)
+    assert singleEaten, "the scene should have some predation to compare"
+
+    store = populate(3000, TANK, seed=4)
+    with ShardedVivarium(shardNum, TANK, Interaction.maxInteractionDistance(store), seed=0) as sharded:
+        assert np.array_equal(sharded.load(store), np.arange(3000))
+        eaten = []
+        for _ in range(steps):
+            eaten.extend(sharded.step().tolist())
+        gathered, ids = sharded.gather()
+
+    assert sorted(eaten) == sorted(singleEaten) == sorted(sharded.eaten)
+    assert np.array_equal(ids, singleIds)
+    for name in ("positions", "velocities", "species"):
+        assert np.allclose(getattr(gathered, name)[:gathered.count], getattr(single, name)[:single.count]), name
+    # serials travel with their creature from slab to slab
+    assert np.array_equal(gathered.serials[:gathered.count], store.serials[ids])
+
+
+def testReachWiderThanSlabsIsRefused():
+    with pytest.raises(ValueError):
+        ShardedVivarium(4, TANK, reach=4.0)
+
+
+def testCreaturesReachingFurtherThanGhostZoneAreRefused():
+    store = populate(10, TANK)
+    with ShardedVivarium(1, TANK, reach=0.01) as sharded:
+        with pytest.raises(ValueError):
+            sharded.load(store)
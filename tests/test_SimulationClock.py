@@ -0,0 +1,68 @@
+import pytest
+
+from SimulationClock import SimulationClock
+
+# times are multiples of 1/16 so the accumulator stays exact
+
+
+def testFirstAdvanceOnlyStartsCounting():
+    clock = SimulationClock(dt=0.25)
+    assert clock.advance(5.0) == 0
+    assert clock.advance(5.0) == 0
+
+
+def testAccumulatorCarriesLeftoverTime():
+    clock = SimulationClock(dt=0.25)
+    clock.advance(0.0)
+    assert clock.advance(0.625) == 2
+    assert clock.alpha() == 0.5
+    # the leftover half step completes with the next frame
+    assert clock.advance(0.6875) == 0
+    assert clock.alpha() == 0.75
+    assert clock.advance(0.8125) == 1
+    assert clock.alpha() == 0.25
+
+
+def testTimeScale():
+    clock = SimulationClock(dt=0.25, timeScale=2.0)
+    clock.advance(0.0)
+    assert clock.advance(0.625) == 5
+
+
+def testBacklogBeyondCapIsDropped():
+    clock = SimulationClock(dt=0.25, maxStepsPerFrame=3)
+    clock.advance(0.0)
+    assert clock.advance(10.125) == 3
+    assert clock.alpha() == 0.5
+    assert clock.advance(10.25) == 1
+    assert clock.alpha() == 0.0
+
+
+def testHoldKeepsDisplayOnCurrentStep():
+    clock = SimulationClock(dt=0.25)
+    clock.advance(0.0)
+    assert clock.advance(0.375) == 1
+    assert clock.alpha() == 0.5
+    # paused frames: no steps however long the pause, and the display stays on the last step
+    for now in (0.5, 1.0, 7.0):
+        clock.hold()
+        assert clock.advance(now) == 0
+        assert clock.alpha() == 1.0
+    # the first frame after the pause runs the next step at once, instead of going back to the step before
+    assert clock.advance(7.0) == 1
+    assert clock.alpha() == 0.0
+    assert clock.advance(7.125) == 0
+    assert clock.alpha() == 0.5
+
+
+def testReset():
+    clock = SimulationClock(dt=0.25, timer=lambda: 3.0)
+    clock.advance()
+    clock.reset()
+    assert clock.accumulator == 0.0 and clock.lastTime is None
+    assert clock.advance() == 0
+
+
+def testStepMustBePositive():
+    with pytest.raises(ValueError):
+        SimulationClock(dt=0)